@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks
+----------------------------------
+Benchmarks for measuring the performance of the ingestion package.
+"""
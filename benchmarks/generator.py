@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+generator
+----------------------------------
+Deterministically generates synthetic inventory csv files resembling example.csv, tunable by row count,
+modifier columns, null density, invalid value rate and description length.
+
+python -m benchmarks.generator -o <output_file> [-n <rows>] [-m <modifiers>] [--nulls <rate>]
+                               [--invalid <rate>] [--description-length <characters>] [--seed <seed>]
+"""
+
+import csv
+import getopt
+import random
+import sys
+
+DESCRIPTIONS = ('Coffee', 'Bagel', 'Orange Juice', 'Milk', 'Ciabatta', 'Baguette', 'Croissant', 'Tea',
+                'Muffin', 'Sandwich', 'Espresso', 'Scone')
+MODIFIER_NAMES = ('Small', 'Medium', 'Large', 'Extra Shot', 'Cream Cheese', 'Oat Milk', 'Syrup')
+PRICE_TYPES = ('system', 'open')
+
+# values which fail sanitisation, substituted for numeric fields at the invalid rate
+INVALID_VALUES = ('n/a', 'free', '$1.2.3', '--', '1e', 'TBC')
+
+
+def create_header(modifiers=3):
+    """ Returns the header of an inventory csv file with modifiers name and price column pairs """
+    header = ['item id', 'description', 'price', 'cost', 'price_type', 'quantity_on_hand']
+    for index in range(1, modifiers + 1):
+        header += ['modifier_%d_name' % index, 'modifier_%d_price' % index]
+    return header
+
+
+def iter_rows(rows, modifiers=3, null_density=0.0, invalid_rate=0.0, description_length=12, seed=0):
+    """ Lazily generates inventory rows, always producing the same rows for the same arguments
+
+    null_density is the chance an optional field is empty and invalid_rate the chance a numeric field
+    holds a value failing sanitisation. Like example.csv, rows omit the columns of unused modifiers.
+    """
+    generator = random.Random(seed)
+
+    def numeric(value):
+        """ returns a numeric field, which may be empty or invalid """
+        if generator.random() < null_density:
+            return ''
+        if generator.random() < invalid_rate:
+            return generator.choice(INVALID_VALUES)
+        return value
+
+    for index in range(rows):
+        description = '%s %d' % (generator.choice(DESCRIPTIONS), index)
+        description = (description + ' ' + 'x' * description_length)[:max(description_length, 1)]
+        price = generator.randint(0, 10000) / 100
+
+        row = [
+            numeric(str(100000 + index)),
+            description,
+            numeric('$%.2f' % price),
+            numeric('$%.2f' % (price * generator.random())),
+            generator.choice(PRICE_TYPES),
+            numeric(str(generator.randint(0, 100000)))
+        ]
+
+        for modifier in range(generator.randint(0, modifiers)):
+            name = MODIFIER_NAMES[modifier % len(MODIFIER_NAMES)]
+            if generator.random() < null_density:
+                name = ''
+            sign = '-' if generator.random() < 0.1 else ''
+            row += [name, numeric('%s$%.2f' % (sign, generator.random() * 3))]
+
+        yield row
+
+
+def generate_csv(file, rows, modifiers=3, null_density=0.0, invalid_rate=0.0, description_length=12,
+                 seed=0):
+    """ Writes a synthetic inventory csv file and returns its size in bytes """
+    with open(file, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile, delimiter=',', lineterminator='\n')
+        writer.writerow(create_header(modifiers))
+        writer.writerows(iter_rows(rows, modifiers, null_density, invalid_rate, description_length,
+                                   seed))
+        return outfile.tell()
+
+
+def main(argv):
+    """ Generates a synthetic inventory csv file from the command line options """
+    output_file = ''
+    options = {'rows': 100000}
+    opts, _ = getopt.getopt(argv, "o:n:m:", ["ofile=", "rows=", "modifiers=", "nulls=", "invalid=",
+                                            "description-length=", "seed="])
+
+    for opt, arg in opts:
+        if opt in ("-o", "--ofile"):
+            output_file = arg
+        elif opt in ("-n", "--rows"):
+            options['rows'] = int(arg)
+        elif opt in ("-m", "--modifiers"):
+            options['modifiers'] = int(arg)
+        elif opt == "--nulls":
+            options['null_density'] = float(arg)
+        elif opt == "--invalid":
+            options['invalid_rate'] = float(arg)
+        elif opt == "--description-length":
+            options['description_length'] = int(arg)
+        elif opt == "--seed":
+            options['seed'] = int(arg)
+
+    if output_file == '':
+        raise Exception('Please provide an output file e.g. python -m benchmarks.generator -o out.csv')
+
+    size = generate_csv(output_file, **options)
+    print('Generated %d rows (%.1f MB) in %s' % (options['rows'], size / 1024 / 1024, output_file))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+harness
+----------------------------------
+Times the extract, parse and transform stages of a conversion separately and end to end, recording
+throughput and peak memory, and compares them with a stored baseline to catch regressions.
+
+python -m benchmarks.harness [-i <input_file>] [-n <rows>] [-m <modifiers>] [-r <repeats>]
+                             [-e <conversion_id>] [-x <extractor>] [-b <baseline_file>] [--save-baseline]
+                             [--threshold <ratio>] [--memory-threshold <ratio>]
+"""
+
+import getopt
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import generator
+from ingestion import batch
+from ingestion.conversion_factory import ConversionFactory
+
+STAGES = ('extract', 'parse', 'transform')
+END_TO_END = 'total'
+
+
+class BenchmarkResult(object):
+    """ Timings and peak memory of each stage of a conversion """
+
+    def __init__(self, rows, input_bytes, seconds=None, peak_bytes=None, max_rss=0):
+        self.rows = rows
+        self.input_bytes = input_bytes
+        self.seconds = seconds or {}
+        self.peak_bytes = peak_bytes or {}
+        self.max_rss = max_rss
+
+    def rows_per_second(self, stage):
+        """ returns the rows converted per second by a stage """
+        return self.rows / self.seconds[stage] if self.seconds[stage] else float('inf')
+
+    def megabytes_per_second(self, stage):
+        """ returns the megabytes of input converted per second by a stage """
+        if not self.seconds[stage]:
+            return float('inf')
+        return self.input_bytes / 1024 / 1024 / self.seconds[stage]
+
+    def to_dict(self):
+        """ returns the result as a dict which can be stored as a json baseline """
+        return {'rows': self.rows, 'input_bytes': self.input_bytes, 'seconds': self.seconds,
+                'peak_bytes': self.peak_bytes, 'max_rss': self.max_rss}
+
+    @staticmethod
+    def from_dict(value):
+        """ creates a result from a stored json baseline """
+        return BenchmarkResult(value['rows'], value['input_bytes'], value['seconds'],
+                               value['peak_bytes'], value.get('max_rss', 0))
+
+
+def create_conversion(input_file, output_file, conversion_id='CSVConversion', options=None):
+    """ Creates a configured conversion from the factory """
+    conversion = ConversionFactory.create_conversion(conversion_id)
+    conversion.set_input_file(input_file)
+    conversion.set_output_file(output_file)
+    batch.apply_options(conversion, options)
+    return conversion
+
+
+def time_stages(input_file, output_file, conversion_id='CSVConversion', options=None):
+    """ Returns the seconds taken by each stage of one conversion and the number of rows converted """
+    conversion = create_conversion(input_file, output_file, conversion_id, options)
+    seconds = {}
+
+    for stage in STAGES:
+        start = time.perf_counter()
+        getattr(conversion, '_' + stage)()
+        seconds[stage] = time.perf_counter() - start
+
+    return seconds, len(conversion.records)
+
+
+def time_execute(input_file, output_file, conversion_id='CSVConversion', options=None):
+    """ Returns the seconds taken to execute a conversion end to end """
+    conversion = create_conversion(input_file, output_file, conversion_id, options)
+    start = time.perf_counter()
+    conversion.execute()
+    return time.perf_counter() - start
+
+
+def trace_stages(input_file, output_file, conversion_id='CSVConversion', options=None):
+    """ Returns the peak bytes allocated by each stage of one conversion, and end to end """
+    conversion = create_conversion(input_file, output_file, conversion_id, options)
+    peak_bytes = {}
+
+    tracemalloc.start()
+    try:
+        for stage in STAGES:
+            tracemalloc.reset_peak()
+            getattr(conversion, '_' + stage)()
+            peak_bytes[stage] = tracemalloc.get_traced_memory()[1]
+
+        del conversion
+        conversion = create_conversion(input_file, output_file, conversion_id, options)
+        tracemalloc.clear_traces()
+        tracemalloc.reset_peak()
+        conversion.execute()
+        peak_bytes[END_TO_END] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return peak_bytes
+
+
+def run_benchmark(input_file, conversion_id='CSVConversion', options=None, repeats=3):
+    """ Benchmarks a conversion of an input file, keeping the quickest of repeats timings of each stage
+
+    Memory is traced in a separate run so the tracing overhead does not distort the timings.
+    """
+    seconds = {}
+    rows = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'output.json')
+
+        for _ in range(repeats):
+            timings, rows = time_stages(input_file, output_file, conversion_id, options)
+            timings[END_TO_END] = time_execute(input_file, output_file, conversion_id, options)
+            for stage, value in timings.items():
+                seconds[stage] = min(value, seconds.get(stage, value))
+
+        peak_bytes = trace_stages(input_file, output_file, conversion_id, options)
+
+    # ru_maxrss is reported in kilobytes on linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return BenchmarkResult(rows, os.path.getsize(input_file), seconds, peak_bytes, max_rss)
+
+
+def compare(result, baseline, threshold=0.1, memory_threshold=0.2):
+    """ Returns a message for each stage slower or using more memory per row than the baseline allows
+
+    Throughput and memory are compared per row, so a baseline remains usable for other row counts.
+    """
+    regressions = []
+
+    for stage in (END_TO_END,) + STAGES:
+        if stage in baseline.seconds and stage in result.seconds:
+            current = result.rows_per_second(stage)
+            expected = baseline.rows_per_second(stage)
+            if current < expected * (1 - threshold):
+                regressions.append('%s throughput %.0f rows/s is %.1f%% below the baseline %.0f rows/s'
+                                   % (stage, current, (1 - current / expected) * 100, expected))
+
+        if stage in baseline.peak_bytes and stage in result.peak_bytes and baseline.rows and result.rows:
+            current = result.peak_bytes[stage] / result.rows
+            expected = baseline.peak_bytes[stage] / baseline.rows
+            if current > expected * (1 + memory_threshold):
+                regressions.append('%s peak memory %.0f bytes/row is %.1f%% above the baseline '
+                                   '%.0f bytes/row' % (stage, current, (current / expected - 1) * 100,
+                                                       expected))
+
+    return regressions
+
+
+def print_result(result, baseline=None):
+    """ Prints the timings, throughput and peak memory of each stage """
+    print('%-10s %10s %12s %10s %12s %12s' % ('stage', 'seconds', 'rows/s', 'MB/s', 'peak MB',
+                                              'baseline'))
+
+    for stage in STAGES + (END_TO_END,):
+        relative = ''
+        if baseline is not None and stage in baseline.seconds:
+            relative = '%.2fx' % (result.rows_per_second(stage) / baseline.rows_per_second(stage))
+
+        print('%-10s %10.3f %12.0f %10.1f %12.1f %12s' % (
+            stage, result.seconds[stage], result.rows_per_second(stage),
+            result.megabytes_per_second(stage), result.peak_bytes[stage] / 1024 / 1024, relative))
+
+    print('%d rows, %.1f MB input, %.1f MB peak rss' % (
+        result.rows, result.input_bytes / 1024 / 1024, result.max_rss / 1024 / 1024))
+
+
+def main(argv):
+    """ Benchmarks a conversion, optionally saving or comparing against a baseline """
+    input_file = ''
+    baseline_file = ''
+    save_baseline = False
+    conversion_id = 'CSVConversion'
+    repeats = 3
+    threshold = 0.1
+    memory_threshold = 0.2
+    generator_options = {'rows': 100000}
+    options = {}
+    opts, _ = getopt.getopt(argv, "i:n:m:r:e:x:b:",
+                            ["ifile=", "rows=", "modifiers=", "repeats=", "conversion=", "extractor=",
+                             "baseline=", "save-baseline", "threshold=", "memory-threshold="])
+
+    for opt, arg in opts:
+        if opt in ("-i", "--ifile"):
+            input_file = arg
+        elif opt in ("-n", "--rows"):
+            generator_options['rows'] = int(arg)
+        elif opt in ("-m", "--modifiers"):
+            generator_options['modifiers'] = int(arg)
+        elif opt in ("-r", "--repeats"):
+            repeats = int(arg)
+        elif opt in ("-e", "--conversion"):
+            conversion_id = arg
+        elif opt in ("-x", "--extractor"):
+            options['extractor'] = arg
+        elif opt in ("-b", "--baseline"):
+            baseline_file = arg
+        elif opt == "--save-baseline":
+            save_baseline = True
+        elif opt == "--threshold":
+            threshold = float(arg)
+        elif opt == "--memory-threshold":
+            memory_threshold = float(arg)
+
+    if save_baseline and baseline_file == '':
+        raise Exception('Please provide a baseline file e.g. python -m benchmarks.harness '
+                        '-b baseline.json --save-baseline')
+
+    with tempfile.TemporaryDirectory() as directory:
+        if input_file == '':
+            input_file = os.path.join(directory, 'inventory.csv')
+            generator.generate_csv(input_file, **generator_options)
+
+        result = run_benchmark(input_file, conversion_id, options, repeats)
+
+    baseline = None
+    if baseline_file != '' and not save_baseline:
+        with open(baseline_file) as infile:
+            baseline = BenchmarkResult.from_dict(json.load(infile))
+
+    print_result(result, baseline)
+
+    if save_baseline:
+        with open(baseline_file, 'w') as outfile:
+            json.dump(result.to_dict(), outfile, sort_keys=True, indent=2)
+        print('Saved baseline to %s' % baseline_file)
+        return
+
+    if baseline is not None:
+        regressions = compare(result, baseline, threshold, memory_threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+serialisation
+----------------------------------
+Compares the model serialiser against json.dumps with the CustomModelEncoder callback.
+
+python -m benchmarks.serialisation [-n <items>] [-r <repeats>]
+"""
+
+import getopt
+import json
+import sys
+import timeit
+
+from ingestion import file_io
+from ingestion import models
+
+
+def create_items(count):
+    """ Creates inventory items resembling the rows of example.csv """
+    return [models.InventoryItem(id=100000 + index, price=1.25 + index % 100, description='Coffee',
+                                 cost=0.8, price_type='system', quantity_on_hand=index % 500,
+                                 modifiers=[{'name': 'Small', 'price': -0.25},
+                                            {'name': 'Medium', 'price': 0.0},
+                                            {'name': 'Large', 'price': 0.3}])
+            for index in range(count)]
+
+
+def encoder_json(items):
+    """ Serialises items through the json encoder callback """
+    return json.dumps(items, cls=file_io.CustomModelEncoder, sort_keys=True, indent=2)
+
+
+def encoder_compact_json(items):
+    """ Serialises items through the json encoder callback without whitespace """
+    return json.dumps(items, cls=file_io.CustomModelEncoder, sort_keys=True, separators=(',', ':'))
+
+
+def main(argv):
+    """ Times each serialisation of the same items and prints the speedup over the encoder """
+    count = 100000
+    repeats = 3
+    opts, _ = getopt.getopt(argv, "n:r:", ["items=", "repeats="])
+
+    for opt, arg in opts:
+        if opt in ("-n", "--items"):
+            count = int(arg)
+        elif opt in ("-r", "--repeats"):
+            repeats = int(arg)
+
+    items = create_items(count)
+
+    if encoder_json(items) != file_io.output_json(items):
+        raise Exception('Serialiser output differs from the json encoder')
+
+    cases = [
+        ('encoder', encoder_json, None),
+        ('serialiser', file_io.output_json, 'encoder'),
+        ('encoder compact', encoder_compact_json, None),
+        ('serialiser compact', lambda values: file_io.output_json(values, compact=True),
+         'encoder compact')
+    ]
+    timings = {}
+
+    for name, function, baseline in cases:
+        timings[name] = min(timeit.repeat(lambda: function(items), number=1, repeat=repeats))
+        speedup = '' if baseline is None else ' (%.1fx)' % (timings[baseline] / timings[name])
+        print('%-20s %8.3f s %10.0f items/s%s' % (name, timings[name], count / timings[name], speedup))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+batch
+----------------------------------
+Converts many input files concurrently through a bounded pool of worker processes, recording the
+outcome of each file instead of aborting the batch on the first failure
+"""
+
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingestion import file_io
+from ingestion.conversion_factory import ConversionFactory
+
+OUTPUT_EXTENSIONS = {
+    'json': '.json',
+    'ndjson': '.ndjson',
+    'sqlite': '.db'
+}
+
+# options naming a single file, which the conversions of a batch would overwrite concurrently
+SINGLE_FILE_OPTIONS = ('reject_file', 'checkpoint_file')
+
+
+class BatchResult(object):
+    """ Outcome of converting a single file within a batch """
+
+    def __init__(self, input_file, output_file, seconds=0.0, error=None, stats=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.seconds = seconds
+        self.error = error
+        self.stats = stats
+
+    @property
+    def succeeded(self):
+        """ returns true if the file was converted without error """
+        return self.error is None
+
+
+def find_inputs(pattern, extension='.csv'):
+    """ Returns the sorted files matching a glob, or every file of a directory with the extension """
+    if os.path.isdir(pattern):
+        return sorted(path for path in glob.glob(os.path.join(pattern, '*' + extension + '*'))
+                      if os.path.isfile(path) and file_io.uncompressed_name(path).endswith(extension))
+
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+
+def output_path(input_file, output_dir, output_format='json'):
+    """ Returns the output file for an input file, named after it within the output directory """
+    name = os.path.splitext(os.path.basename(file_io.uncompressed_name(input_file)))[0]
+    return os.path.join(output_dir, name + OUTPUT_EXTENSIONS[output_format])
+
+
+def check_batch_options(options):
+    """ Raises a value error for options naming a single file, which every file of a batch would share
+
+    Rows rejected from each file are written beside its output file, as <output>.rejects.csv, by default.
+    """
+    shared = [name for name in SINGLE_FILE_OPTIONS if (options or {}).get(name) is not None]
+    if shared:
+        raise ValueError('A batch of files does not support the options %s' % ', '.join(shared))
+
+
+def apply_options(conversion, options):
+    """ Configures a conversion by calling its set_<name> method for each option, unpacking tuples
+
+    A value error listing the options without a setter is raised before any option is applied.
+    """
+    unsupported = sorted(name for name in options or {} if not hasattr(conversion, 'set_' + name))
+    if unsupported:
+        raise ValueError('%s does not support the options %s' % (type(conversion).__name__,
+                                                                 ', '.join(unsupported)))
+
+    for name, value in (options or {}).items():
+        setter = getattr(conversion, 'set_' + name)
+        if isinstance(value, tuple):
+            setter(*value)
+        else:
+            setter(value)
+
+
+def convert_file(conversion_id, input_file, output_file, options=None):
+    """ Converts one file, returning its timing, statistics and any error rather than raising """
+    start = time.perf_counter()
+
+    try:
+        conversion = ConversionFactory.create_conversion(conversion_id)
+        conversion.set_input_file(input_file)
+        conversion.set_output_file(output_file)
+        apply_options(conversion, options)
+        conversion.execute()
+    except Exception:  # pylint: disable=broad-except
+        return BatchResult(input_file, output_file, time.perf_counter() - start,
+                           traceback.format_exc(limit=-1).strip())
+
+    return BatchResult(input_file, output_file, time.perf_counter() - start,
+                       stats=conversion.stats.to_dict())
+
+
+def convert_batch(input_files, output_dir, conversion_id='CSVConversion', jobs=None, options=None,
+                  callback=None):
+    """ Converts input files into the output directory using at most jobs worker processes
+
+    callback is invoked with each BatchResult as its file completes. Results are returned in the
+    order of input_files.
+    """
+    check_batch_options(options)
+    output_format = (options or {}).get('output_format', 'json')
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = {executor.submit(convert_file, conversion_id, input_file,
+                                   output_path(input_file, output_dir, output_format), options): index
+                   for index, input_file in enumerate(input_files)}
+        results = [None] * len(futures)
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+
+            if callback is not None:
+                callback(result)
+
+    return results
@@ -8,8 +8,84 @@ Polymorphic factory allowing providing a standard interface for extracting file
 parsing from one type to an intermediary state, and serialising the output to a sandarised format
 """
 
+import asyncio
+import codecs
+import io
+import json
+import locale
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from ingestion import database
 from ingestion import file_io
+from ingestion import incremental
+from ingestion import index
+from ingestion import models
 from ingestion import parser
+from ingestion import pipeline
+from ingestion import sorting
+from ingestion import stats
+from ingestion import validate
+
+# approximate size in bytes of each chunk of a csv file converted in parallel
+CHUNK_SIZE = 64 * 1024 * 1024
+
+OUTPUT_FORMAT_JSON = 'json'
+OUTPUT_FORMAT_NDJSON = 'ndjson'
+OUTPUT_FORMAT_SQLITE = 'sqlite'
+
+EXTRACTOR_CSV = 'csv'
+EXTRACTOR_MMAP = 'mmap'
+
+ERROR_POLICY_ABORT = 'abort'
+ERROR_POLICY_REJECT = 'reject'
+
+INDEX_OUTPUT = 'output'
+INDEX_SOURCE = 'source'
+
+# size in bytes of each read from the input stream of an asynchronous conversion
+PIPE_READ_SIZE = 1024 * 1024
+
+# number of blocks of text, or of serialised output, held between the stages of an async conversion
+PIPE_QUEUE_SIZE = 4
+
+# number of rows converted between each notification of the conversion hooks
+HOOK_INTERVAL = 10000
+
+# number of rows in each batch passed between the threads of a pipelined conversion
+PIPELINE_BATCH_SIZE = 10000
+
+# approximate memory in bytes of the batches queued between the threads of a pipelined conversion
+PIPELINE_MEMORY = 64 * 1024 * 1024
+
+STAGE_READ = 'read'
+STAGE_WRITE = 'write'
+
+STAGE_EXTRACT = 'extract'
+STAGE_PARSE = 'parse'
+STAGE_TRANSFORM = 'transform'
+STAGE_STREAM = 'stream'
+STAGE_PARALLEL = 'parallel'
+STAGE_INCREMENTAL = 'incremental'
+STAGE_PIPE = 'pipe'
+STAGE_RESUMABLE = 'resumable'
+STAGE_INDEX = 'index'
+STAGE_SORT = 'sort'
+STAGE_MERGE = 'merge'
+STAGE_PIPELINE = 'pipeline'
+
+# tag of the xml elements holding an inventory item, and child tags named differently to the csv header
+XML_ITEM_TAG = 'item'
+XML_COLUMNS = {'item_id': 'item id'}
+
+# serialises rows rejected by the parser threads of pipelined conversions
+_REJECT_LOCK = threading.Lock()
 
 
 class ConversionFactory:
@@ -25,55 +101,941 @@ class ConversionFactory:
     def create_conversion(id):
         """ Provides creation of conversion factories """
         if id not in ConversionFactory.factories:
-            ConversionFactory.factories[id] = eval(id + '.Factory()')
+            # looks the class up by name rather than evaluating the id, which may come from a client
+            conversion_class = globals().get(id)
+            if not isinstance(conversion_class, type) or not issubclass(conversion_class, Conversion):
+                raise NameError('name %r is not a conversion' % id)
+            ConversionFactory.factories[id] = conversion_class.Factory()
         return ConversionFactory.factories[id].create()
 
     create_conversion = staticmethod(create_conversion)
 
 
 class Conversion(object):
-    """ Abstract base class for Conversion factory """
-    pass
-
-
-class CSVConversion(Conversion):
-    """ CSV Conversion Factory """
+    """ Abstract base class for Conversion factory, recording statistics and notifying hooks """
 
     def __init__(self):
         self.input_file = None
         self.output_file = None
-        self.records = []
-        self.models = []
+        self.compact = False
+        self.money = models.MONEY_FLOAT
+        self.output_format = OUTPUT_FORMAT_JSON
+        self.shard_records = None
+        self.shard_bytes = None
+        self.columnar = False
+        self.stats = stats.ConversionStats()
+        self.hooks = []
+        self.hook_interval = HOOK_INTERVAL
+
+    def __getstate__(self):
+        """ excludes the hooks when sent to a worker process, which never notifies them """
+        state = dict(self.__dict__)
+        state['hooks'] = []
+        return state
 
     def set_input_file(self, input_file):
-        """ sets the csv input file """
+        """ sets the input file """
         self.input_file = input_file
 
     def set_output_file(self, output_file):
         """ sets the json output file """
         self.output_file = output_file
 
+    def set_compact(self, compact):
+        """ sets whether the json output is written without indentation """
+        self.compact = compact
+
+    def set_money(self, money):
+        """ sets whether prices and costs are parsed as floats, or as cents written as decimals or cents
+
+        SQLite output stores integer cents as decimals in its REAL price columns.
+        """
+        if money not in models.MONEY_FORMATS:
+            raise ValueError('Unsupported money format %s' % money)
+        self.money = money
+
+    def set_output_format(self, output_format):
+        """ sets the output format, either a json array, json lines or a sqlite database """
+        if output_format not in (OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_NDJSON, OUTPUT_FORMAT_SQLITE):
+            raise ValueError('Unsupported output format %s' % output_format)
+        self.output_format = output_format
+
+    def set_shard_limits(self, max_records=None, max_bytes=None):
+        """ sets the records or bytes after which json lines output rolls over into a new shard """
+        self.shard_records = max_records
+        self.shard_bytes = max_bytes
+
+    def set_columnar(self, columnar):
+        """ sets whether parsed models are held in a columnar batch instead of a list
+
+        A batch holds large inputs in a fraction of the memory, but builds a new item each time one
+        is read, so changes made to the items of conversion.models are not kept.
+        """
+        self.columnar = columnar
+
+    def add_hook(self, hook):
+        """ adds a ConversionHook notified of each stage and every hook interval rows """
+        self.hooks.append(hook)
+
+    def set_hook_interval(self, hook_interval):
+        """ sets the number of rows converted between each notification of the hooks """
+        self.hook_interval = hook_interval
+
+    @contextmanager
+    def _stage(self, stage):
+        """ times a stage of the conversion, notifying the hooks as it starts and finishes """
+        for hook in self.hooks:
+            hook.stage_started(self.stats, stage)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stats.stages[stage] = self.stats.stages.get(stage, 0.0) + seconds
+            for hook in self.hooks:
+                hook.stage_finished(self.stats, stage, seconds)
+
+    def _count_rows(self, models):
+        """ passes models through, counting each as a converted row """
+        for model in models:
+            yield model
+            self._add_rows(1)
+
+    def _add_rows(self, count):
+        """ counts converted rows, notifying the hooks each time another hook interval is reached """
+        previous = self.stats.rows
+        self.stats.rows += count
+
+        if self.hooks and previous // self.hook_interval != self.stats.rows // self.hook_interval:
+            for hook in self.hooks:
+                hook.rows_converted(self.stats, self.stats.rows)
+
+    def _hold_models(self, parsed):
+        """ holds parsed models in a columnar batch when set, otherwise in a list """
+        return models.InventoryBatch(parsed) if self.columnar else list(parsed)
+
+    def _record_plan(self, plan):
+        """ records the invalid values and cache counts of a parse plan once its rows are converted """
+        self.stats.add_invalid(plan.invalid)
+        self.stats.add_cache_counts(plan.cache_counts())
+
+    def _record_totals(self, start):
+        """ records the duration, peak memory and input size of a conversion started at start """
+        self.stats.seconds = time.perf_counter() - start
+        self.stats.peak_memory = stats.peak_memory()
+        if self.input_file is not None and os.path.isfile(self.input_file):
+            self.stats.bytes_read = os.path.getsize(self.input_file)
+
+    def _transform(self):
+        """ serialises a list of models to an output json file """
+        if self.output_format != OUTPUT_FORMAT_JSON:
+            with self._create_writer() as writer:
+                for model in self.models:
+                    writer.write(model)
+            self.stats.bytes_written += writer.bytes_written
+            return
+
+        data = file_io.output_json(self.models, self.compact, self.money)
+        file_io.write_json(self.output_file, data)
+        self.stats.bytes_written += len(data)
+
+    def _create_writer(self, output=None):
+        """ creates an incremental writer for the output format, writing to the output file or stream """
+        output = self.output_file if output is None else output
+        if self.output_format == OUTPUT_FORMAT_NDJSON:
+            return file_io.NDJSONWriter(output, self.shard_records, self.shard_bytes, self.money)
+        if self.output_format == OUTPUT_FORMAT_SQLITE:
+            return database.SQLiteWriter(output)
+        return file_io.JSONArrayWriter(output, self.compact, self.money)
+
+    def _serialise(self, models):
+        """ serialises models to a fragment which can be written by the output format writer """
+        if self.output_format == OUTPUT_FORMAT_NDJSON:
+            return file_io.output_ndjson_fragment(models, self.money)
+        if self.output_format == OUTPUT_FORMAT_SQLITE:
+            return database.item_rows(models)
+        return file_io.output_json_fragment(models, self.compact, self.money)
+
+
+class CSVConversion(Conversion):
+    """ CSV Conversion Factory """
+
+    def __init__(self):
+        super().__init__()
+        self.header = []
+        self.records = []
+        self.models = []
+        self.streaming = False
+        self.workers = 1
+        self.chunk_size = CHUNK_SIZE
+        self.state_file = None
+        self.full_rebuild = False
+        self.skipped = False
+        self.changes = None
+        self.extractor = EXTRACTOR_CSV
+        self.encoding = None
+        self.error_policy = ERROR_POLICY_ABORT
+        self.reject_file = None
+        self.checkpoint_file = None
+        self.index = None
+        self.lazy = False
+        self.columns = None
+        self.predicates = []
+        self.sort_by_id = False
+        self.duplicate_policy = sorting.DUPLICATES_LAST
+        self.sort_buffer = sorting.SORT_BUFFER
+        self.pipelined = False
+        self.pipeline_batch_size = PIPELINE_BATCH_SIZE
+        self.pipeline_depth = None
+        self.memory_budget = PIPELINE_MEMORY
+        self.parsers = 1
+        self._plan = None
+        self._reject_writer = None
+        self._collect_rejects = False
+        self._rejected = []
+
+    def __getstate__(self):
+        """ leaves the reject file to the main process, workers collecting their rejected rows """
+        state = super().__getstate__()
+        state['_reject_writer'] = None
+        state['_collect_rejects'] = True
+        state['_rejected'] = []
+        return state
+
+    def set_streaming(self, streaming):
+        """ sets whether records are streamed one at a time instead of held in memory """
+        self.streaming = streaming
+
+    def set_workers(self, workers):
+        """ sets the number of processes converting chunks of the csv file in parallel """
+        self.workers = workers
+
+    def set_chunk_size(self, chunk_size):
+        """ sets the approximate size in bytes of each chunk converted in parallel """
+        self.chunk_size = chunk_size
+
+    def set_state_file(self, state_file):
+        """ sets the state store enabling incremental conversion, which writes only changed items """
+        self.state_file = state_file
+
+    def set_full_rebuild(self, full_rebuild):
+        """ sets whether an incremental conversion writes the full output and re-records every row """
+        self.full_rebuild = full_rebuild
+
+    def set_extractor(self, extractor):
+        """ sets the csv reader, the csv module or a memory mapped reader splitting rows as bytes """
+        if extractor not in (EXTRACTOR_CSV, EXTRACTOR_MMAP):
+            raise ValueError('Unsupported extractor %s' % extractor)
+        self.extractor = extractor
+
+    def set_encoding(self, encoding):
+        """ sets the encoding of the csv input file, defaulting to the platform encoding """
+        self.encoding = encoding
+
+    def set_error_policy(self, error_policy):
+        """ sets whether a row failing validation aborts the conversion or is rejected """
+        if error_policy not in (ERROR_POLICY_ABORT, ERROR_POLICY_REJECT):
+            raise ValueError('Unsupported error policy %s' % error_policy)
+        self.error_policy = error_policy
+
+    def set_reject_file(self, reject_file):
+        """ sets the csv file receiving rejected rows, defaulting to the output file + .rejects.csv """
+        self.reject_file = reject_file
+
+    def set_checkpoint_file(self, checkpoint_file):
+        """ sets the checkpoint recorded after each chunk, from which an interrupted run resumes """
+        self.checkpoint_file = checkpoint_file
+
+    def set_lazy(self, lazy):
+        """ sets whether rows are wrapped in models converting each property only when first accessed
+
+        Under the reject policy rows are still parsed eagerly, so rows failing validation are rejected.
+        """
+        self.lazy = lazy
+
+    def set_columns(self, columns):
+        """ sets the properties written for each item, the columns of others never being converted """
+        self.columns = columns
+
+    def set_predicates(self, predicates):
+        """ sets the predicates, e.g. price_type=open or quantity_on_hand>0, every row written matches
+
+        Each predicate converts only the column it tests, before the rest of the row is parsed.
+        """
+        self.predicates = predicates
+
+    def set_sort_by_id(self, sort_by_id):
+        """ sets whether items are written in id order, sorting rows externally in the sort buffer """
+        self.sort_by_id = sort_by_id
+
+    def set_duplicate_policy(self, duplicate_policy):
+        """ sets whether the last or first row of each item id is written when sorting, or every row """
+        if duplicate_policy not in (sorting.DUPLICATES_LAST, sorting.DUPLICATES_FIRST,
+                                    sorting.DUPLICATES_KEEP):
+            raise ValueError('Unsupported duplicate policy %s' % duplicate_policy)
+        self.duplicate_policy = duplicate_policy
+
+    def set_sort_buffer(self, sort_buffer):
+        """ sets the number of rows held in memory before a sorted run is spilled to disk """
+        self.sort_buffer = sort_buffer
+
+    def set_pipelined(self, pipelined):
+        """ sets whether rows are read, parsed and written in threads connected by bounded queues """
+        self.pipelined = pipelined
+
+    def set_pipeline_batch_size(self, pipeline_batch_size):
+        """ sets the number of rows in each batch passed between the threads of a pipeline """
+        self.pipeline_batch_size = pipeline_batch_size
+
+    def set_pipeline_depth(self, pipeline_depth):
+        """ sets the number of batches each queue of a pipeline holds, instead of the memory budget """
+        self.pipeline_depth = pipeline_depth
+
+    def set_memory_budget(self, memory_budget):
+        """ sets the approximate memory in bytes of the batches queued by a pipelined conversion """
+        self.memory_budget = memory_budget
+
+    def set_parsers(self, parsers):
+        """ sets the number of threads parsing and serialising batches in a pipelined conversion """
+        self.parsers = parsers
+
+    def set_index(self, index):
+        """ sets whether a sidecar id index is written for the json output or the csv input """
+        if index not in (None, INDEX_OUTPUT, INDEX_SOURCE):
+            raise ValueError('Unsupported index %s' % index)
+        self.index = index
+
     def execute(self):
-        """ converts input csv file to json output file """
-        self._extract()
-        self._parse()
-        self._transform()
+        """ converts input csv file to json output file, recording the statistics of the conversion """
+        self._check_options()
+
+        self.stats = stats.ConversionStats()
+        start = time.perf_counter()
+
+        try:
+            if self.state_file is not None:
+                with self._stage(STAGE_INCREMENTAL):
+                    self._execute_incremental()
+            elif self.sort_by_id:
+                self._execute_sorted()
+            elif self.checkpoint_file is not None:
+                with self._stage(STAGE_RESUMABLE):
+                    self._execute_resumable()
+            elif self.workers > 1:
+                with self._stage(STAGE_PARALLEL):
+                    self._execute_parallel()
+            elif self.pipelined:
+                with self._stage(STAGE_PIPELINE):
+                    self._execute_pipelined()
+            elif self.streaming:
+                with self._stage(STAGE_STREAM):
+                    self._stream()
+            else:
+                with self._stage(STAGE_EXTRACT):
+                    self._extract()
+                with self._stage(STAGE_PARSE):
+                    self._parse()
+                with self._stage(STAGE_TRANSFORM):
+                    self._transform()
+
+            if self.index is not None:
+                with self._stage(STAGE_INDEX):
+                    self._write_index()
+        finally:
+            self._close_rejects()
+            self._record_totals(start)
+
+    def _check_options(self):
+        """ raises a value error for options which cannot be combined """
+        if self.state_file is not None and (self.columns is not None or self.predicates):
+            raise ValueError('Incremental conversion does not support columns or predicates')
+        if self.columns is not None and self.output_format == OUTPUT_FORMAT_SQLITE:
+            raise ValueError('SQLite output does not support columns')
+
+        # the json lines delta, or the empty delta of a skipped file, would overwrite the database
+        if self.state_file is not None and self.output_format == OUTPUT_FORMAT_SQLITE:
+            raise ValueError('Incremental conversion does not support SQLite output')
+        if self.sort_by_id and (
+                self.state_file is not None or self.checkpoint_file is not None or self.workers > 1):
+            raise ValueError('Sorting by id does not support incremental, resumable or parallel runs')
+
+        # compressed files are streamed, so byte offsets within them can be neither seeked nor recorded
+        if file_io.compression_of(self.input_file) is not None and (
+                self.workers > 1 or self.extractor == EXTRACTOR_MMAP or
+                self.checkpoint_file is not None or self.index == INDEX_SOURCE):
+            raise ValueError('Compressed input cannot be split, memory mapped, resumed or indexed')
+        if file_io.compression_of(self.output_file) is not None and (
+                self.output_format == OUTPUT_FORMAT_SQLITE or self.checkpoint_file is not None or
+                self.index == INDEX_OUTPUT):
+            raise ValueError('Compressed output cannot be written to SQLite, resumed or indexed')
+
+    async def execute_async(self, reader, writer):
+        """ converts csv from a stream reader to json on a stream writer, e.g. stdin and stdout
+
+        reader provides an awaitable read(size) returning bytes, and writer a write(bytes) and awaitable
+        drain(), as do asyncio.StreamReader and asyncio.StreamWriter. Reading the next block of records,
+        converting a block in a worker thread and draining the output of the block before it overlap.
+        """
+        if self.state_file is not None:
+            raise ValueError('Incremental conversion requires an input file')
+        if self.output_format == OUTPUT_FORMAT_SQLITE:
+            raise ValueError('SQLite output requires an output file')
+        if self.index is not None:
+            raise ValueError('An id index requires an input and output file')
+        if self.sort_by_id:
+            raise ValueError('Sorting by id requires an input file')
+        if self.workers > 1:
+            raise ValueError('Parallel conversion requires an input file')
+        if self.checkpoint_file is not None:
+            raise ValueError('Resumable conversion requires an input and output file')
+        if self.pipelined:
+            raise ValueError('Pipelined conversion requires an input file')
+        if self.extractor == EXTRACTOR_MMAP:
+            raise ValueError('The memory mapped extractor requires an input file')
+
+        self.stats = stats.ConversionStats()
+        start = time.perf_counter()
+
+        try:
+            with self._stage(STAGE_PIPE):
+                await self._execute_pipe(reader, writer)
+        finally:
+            self._close_rejects()
+            self.stats.seconds = time.perf_counter() - start
+            self.stats.peak_memory = stats.peak_memory()
+
+    async def _execute_pipe(self, reader, writer):
+        """ runs the read, convert and write stages of a conversion connected by bounded queues """
+        blocks = asyncio.Queue(PIPE_QUEUE_SIZE)
+        fragments = asyncio.Queue(PIPE_QUEUE_SIZE)
+        tasks = [asyncio.ensure_future(self._read_blocks(reader, blocks)),
+                 asyncio.ensure_future(self._convert_blocks(blocks, fragments)),
+                 asyncio.ensure_future(self._write_fragments(fragments, writer))]
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _read_blocks(self, reader, blocks):
+        """ reads and decodes the input stream, queueing blocks of text holding whole csv records """
+        decoder = codecs.getincrementaldecoder(self.encoding or locale.getpreferredencoding(False))()
+        pending = ''
+
+        while True:
+            data = await reader.read(PIPE_READ_SIZE)
+            self.stats.bytes_read += len(data)
+            text = pending + decoder.decode(data, final=not data)
+
+            if not data:
+                if text:
+                    await blocks.put(text)
+                await blocks.put(None)
+                return
+
+            boundary = file_io.find_record_boundary(text)
+            pending = text[boundary:]
+            if boundary:
+                await blocks.put(text[:boundary])
+
+    async def _convert_blocks(self, blocks, fragments):
+        """ parses and serialises each block of text in a worker thread, queueing the fragments """
+        loop = asyncio.get_running_loop()
+        plan = None
+
+        while True:
+            text = await blocks.get()
+            if text is None:
+                if plan is not None:
+                    self._record_plan(plan)
+                await fragments.put(None)
+                return
+
+            plan, fragment, count = await loop.run_in_executor(None, _convert_text, self, plan, text)
+            self._add_rows(count)
+            await fragments.put((fragment, count))
+
+    async def _write_fragments(self, fragments, writer):
+        """ frames each output fragment in the output format and drains it to the stream writer """
+        buffer = io.StringIO()
+
+        def flush():
+            """ moves the framed output from the buffer to the stream writer """
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            writer.write(data)
+            self.stats.bytes_written += len(data)
+            return writer.drain()
+
+        output = self._create_writer(buffer)
+        output.open()
+
+        while True:
+            fragment = await fragments.get()
+            if fragment is None:
+                break
+
+            output.write_fragment(*fragment)
+            await flush()
+
+        output.close()
+        await flush()
+
+    def _stream(self):
+        """ extracts, parses and serialises one record at a time using constant memory """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        rows = self._iter_rows()
+        plan = self._compile_plan(next(rows, []))
+
+        with self._create_writer() as writer:
+            for model in self._count_rows(self._convert_rows(plan, rows)):
+                writer.write(model)
+
+        self._record_plan(plan)
+        self.stats.bytes_written += writer.bytes_written
+
+    def _execute_sorted(self):
+        """ spills sorted runs of the rows matching the predicates, then parses and writes them merged
+
+        Every column is decoded by the mmap extractor, as the id column is read even if not projected.
+        """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        rows = self._iter_rows(decode_all=True)
+        plan = self._compile_plan(next(rows, []))
+
+        with sorting.ExternalSorter(self.sort_buffer) as sorter:
+            with self._stage(STAGE_SORT):
+                for row in self._filter_rows(plan, rows) if plan.predicates else rows:
+                    sorter.add(plan.parse_id(row), row)
+
+            with self._stage(STAGE_MERGE), self._create_writer() as writer:
+                parsed = self._parse_rows(plan, sorter.sorted(self.duplicate_policy))
+                if plan.projection is not None:
+                    parsed = map(plan.project, parsed)
+                for model in self._count_rows(parsed):
+                    writer.write(model)
+
+        self._record_plan(plan)
+        self.stats.duplicates += sorter.duplicates
+        self.stats.bytes_written += writer.bytes_written
+
+    def _execute_pipelined(self):
+        """ reads, parses and writes batches of rows in concurrent threads connected by bounded queues
+
+        The queue depth is set so the queued batches fit the memory budget, estimated from the first
+        batch read, unless set explicitly. The time each stage waits on its queues is recorded in
+        stats.waits.
+        """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        rows = self._iter_rows()
+        header = next(rows, [])
+        batch = list(islice(rows, self.pipeline_batch_size))
+
+        flow = pipeline.Pipeline(self.pipeline_depth or self._pipeline_depth(batch))
+        batches = flow.queue()
+        fragments = flow.queue()
+        plans = [self._compile_plan(header) for _ in range(self.parsers)]
+
+        flow.start(STAGE_READ, self._read_batches, flow, batch, rows, batches)
+        for number, plan in enumerate(plans):
+            stage = STAGE_PARSE if self.parsers == 1 else '%s-%d' % (STAGE_PARSE, number + 1)
+            flow.start(stage, self._parse_batches, flow, stage, plan, batches, fragments)
+        flow.start(STAGE_WRITE, self._write_batches, flow, fragments)
+
+        try:
+            flow.join()
+        finally:
+            self.stats.waits.update(flow.waits)
+
+        for plan in plans:
+            self._record_plan(plan)
+
+    def _pipeline_depth(self, batch):
+        """ returns the queue depth holding the batches of both queues within the memory budget """
+        size = sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in batch)
+        return max(1, int(self.memory_budget // (2 * max(size, 1))))
+
+    def _read_batches(self, flow, batch, rows, batches):
+        """ queues numbered batches of rows, from the batch already read, then an end for each parser """
+        sequence = 0
+
+        while batch:
+            flow.put(STAGE_READ, batches, (sequence, batch))
+            sequence += 1
+            batch = list(islice(rows, self.pipeline_batch_size))
+
+        for _ in range(self.parsers):
+            flow.put(STAGE_READ, batches, None)
+
+    def _parse_batches(self, flow, stage, plan, batches, fragments):
+        """ parses and serialises batches of rows, queueing the numbered fragments """
+        while True:
+            batch = flow.get(stage, batches)
+            if batch is None:
+                flow.put(stage, fragments, None)
+                return
+
+            sequence, rows = batch
+            converted = list(self._convert_rows(plan, rows))
+            flow.put(stage, fragments, (sequence, self._serialise(converted), len(converted)))
+
+    def _write_batches(self, flow, fragments):
+        """ writes the fragments in the order their batches were read, opening the writer in-thread """
+        pending = {}
+        sequence = 0
+        finished = 0
+
+        with self._create_writer() as writer:
+            while finished < self.parsers:
+                fragment = flow.get(STAGE_WRITE, fragments)
+                if fragment is None:
+                    finished += 1
+                    continue
+
+                pending[fragment[0]] = fragment[1:]
+                while sequence in pending:
+                    fragment, count = pending.pop(sequence)
+                    writer.write_fragment(fragment, count)
+                    self._add_rows(count)
+                    sequence += 1
+
+        self.stats.bytes_written += writer.bytes_written
+
+    def _execute_parallel(self):
+        """ converts byte ranges of the csv file in a process pool, writing the results in order """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        ranges = file_io.iter_csv_ranges(self.input_file, self.chunk_size)
+        header = self._read_header(next(ranges))
+
+        with self._create_writer() as writer:
+            for _, result in self._convert_ranges(header, ranges):
+                self._write_range(writer, result)
+
+        self.stats.bytes_written += writer.bytes_written
+
+    def _execute_resumable(self):
+        """ converts byte ranges of the csv file in order, checkpointing as each range is written
+
+        A conversion interrupted after a checkpoint truncates its output to the checkpointed position and
+        resumes from the next range. The checkpoint is removed once the conversion completes.
+        """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        checkpoint = self._load_checkpoint()
+        ranges = file_io.iter_csv_ranges(self.input_file, self.chunk_size)
+        header = self._read_header(next(ranges))
+        writer = self._create_writer()
+
+        if checkpoint is None:
+            writer.open()
+        else:
+            writer.resume(checkpoint['output_position'], checkpoint['rows'])
+            self.stats.rows = checkpoint['rows']
+            self.stats.rejected = checkpoint['rejected']
+            if checkpoint['reject_position'] is not None:
+                self._reject_writer = file_io.RejectWriter(self._reject_path(), header, self.encoding)
+                self._reject_writer.resume(checkpoint['reject_position'], checkpoint['rejected'])
+            ranges = file_io.iter_csv_ranges(self.input_file, self.chunk_size, checkpoint['offset'])
+
+        try:
+            for end, result in self._convert_ranges(header, ranges):
+                self._write_range(writer, result)
+                self._save_checkpoint(end, writer)
+        except BaseException:
+            writer.abort()
+            raise
+
+        writer.close()
+        self.stats.bytes_written += writer.bytes_written
+        os.remove(self.checkpoint_file)
+
+    def _write_index(self):
+        """ writes the sidecar id index of the csv input or the json output """
+        if self.index == INDEX_SOURCE:
+            index.write_csv_index(self.input_file, self.encoding)
+        elif self.output_format == OUTPUT_FORMAT_SQLITE or self.shard_records or self.shard_bytes:
+            raise ValueError('An id index can only be written for a single json or json lines output')
+        else:
+            index.write_json_index(self.output_file)
+
+    def _load_checkpoint(self):
+        """ returns the checkpoint of an interrupted conversion of the input file, otherwise none """
+        if not os.path.isfile(self.checkpoint_file):
+            return None
+
+        with open(self.checkpoint_file) as infile:
+            checkpoint = json.load(infile)
+
+        status = os.stat(self.input_file)
+        if checkpoint['input_size'] != status.st_size or checkpoint['input_mtime'] != status.st_mtime_ns:
+            raise ValueError('Checkpoint %s was recorded for a different input' % self.checkpoint_file)
+        if (not os.path.isfile(self.output_file) or
+                os.path.getsize(self.output_file) < checkpoint['output_position']):
+            raise ValueError('Checkpoint %s is ahead of the output file' % self.checkpoint_file)
+
+        return checkpoint
+
+    def _save_checkpoint(self, offset, writer):
+        """ flushes the output and reject files to disk, then atomically replaces the checkpoint """
+        status = os.stat(self.input_file)
+        checkpoint = {
+            'input_size': status.st_size,
+            'input_mtime': status.st_mtime_ns,
+            'offset': offset,
+            'rows': writer.count,
+            'output_position': writer.checkpoint(),
+            'rejected': self.stats.rejected,
+            'reject_position': None if self._reject_writer is None else self._reject_writer.checkpoint()
+        }
+
+        with open(self.checkpoint_file + '.tmp', 'w') as outfile:
+            outfile.write(json.dumps(checkpoint, sort_keys=True, indent=2))
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+
+    def _read_header(self, header_range):
+        """ reads the header from the first byte range returned by split_csv """
+        header = file_io.read_csv_range(self.input_file, *header_range, encoding=self.encoding)
+        return header[0] if header else []
+
+    def _convert_ranges(self, header, ranges):
+        """ lazily converts byte ranges of the csv file in order, yielding each range end and result
+
+        With more than one worker the ranges are converted in a process pool, otherwise in this process.
+        """
+        if self.workers <= 1:
+            for start, end in ranges:
+                yield end, _convert_range(self, header, start, end)
+            return
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            pending = deque()
+
+            for start, end in ranges:
+                pending.append((end, executor.submit(_convert_range, self, header, start, end)))
+
+                # bounds the number of converted chunks held in memory awaiting their turn
+                if len(pending) >= self.workers * 2:
+                    end, future = pending.popleft()
+                    yield end, future.result()
+
+            while pending:
+                end, future = pending.popleft()
+                yield end, future.result()
+
+    def _write_range(self, writer, result):
+        """ writes a converted byte range, recording its statistics and the rows rejected by a worker """
+        fragment, count, invalid, cache_counts, header, rejected = result
+        writer.write_fragment(fragment, count)
+        self._add_rows(count)
+        self.stats.add_invalid(invalid)
+        self.stats.add_cache_counts(cache_counts)
+
+        if rejected:
+            self.stats.rejected += len(rejected)
+            rejects = self._open_rejects(header)
+            for row, reason in rejected:
+                rejects.write(row, reason)
+
+    def _execute_incremental(self):
+        """ skips an unchanged file, otherwise writes the items changed since the last run
+
+        Each line of the delta output holds the change, the item id and, unless removed, the item. A full
+        rebuild writes every item in the configured output format instead.
+        """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        path = os.path.abspath(self.input_file)
+
+        with incremental.StateStore(self.state_file) as store:
+            digest = incremental.file_digest(self.input_file)
+            self.skipped = not self.full_rebuild and store.file_digest(path) == digest
+
+            # an empty delta ensures the changes of the previous run are never applied twice
+            if self.skipped:
+                file_io.write_json(self.output_file, '')
+                return
+
+            # every field is decoded as whole rows are hashed
+            rows = self._iter_rows(decode_all=True)
+            header = next(rows, [])
+            plan = parser.compile_parse_plan(header, money=self.money)
+
+            if plan.index_of('id') is None:
+                raise ValueError('Incremental conversion requires an item id column')
+
+            # a full rebuild is also compared with the previous run, so rejected rows keep their digest
+            diff = incremental.RowDiff(header, plan.index_of('id'), store.row_digests(path))
+
+            if self.full_rebuild:
+                with self._create_writer() as writer:
+                    for _, model in self._diff_rows(plan, diff, rows, True):
+                        writer.write(model)
+            else:
+                with file_io.NDJSONWriter(self.output_file, money=self.money) as writer:
+                    for change, item in self._diff_rows(plan, diff, rows, False):
+                        if change != incremental.CHANGE_UNCHANGED:
+                            writer.write({'change': change, 'id': item.id, 'item': item})
+
+                    for key in diff.removed():
+                        writer.write({'change': incremental.CHANGE_REMOVED,
+                                      'id': validate.is_valid_int(key.replace('$', ''))})
+
+            self._record_plan(plan)
+            self.stats.bytes_written += writer.bytes_written
+            store.save(path, digest, diff.current)
+            self.changes = diff.counts
+
+    def _diff_rows(self, plan, diff, rows, parse_unchanged):
+        """ lazily compares csv row lists with the previous run, yielding each change and model
+
+        Unchanged rows are only parsed when parse_unchanged is set, otherwise yielding none as their
+        model. A row rejected by the parser is not yielded and its comparison is reverted, so whatever
+        the output mode it is neither counted nor recorded, and its id is not reported as removed.
+        """
+        for row in rows:
+            key, change = diff.compare(row)
+
+            item = None
+            if parse_unchanged or change != incremental.CHANGE_UNCHANGED:
+                item = next(iter(self._parse_rows(plan, (row,))), None)
+                if item is None:
+                    diff.revert(key, change)
+                    continue
+
+            self._add_rows(1)
+            yield change, item
 
     def _extract(self):
         """ extracts the contents of the csv file to a list of records """
         if self.input_file is None:
             raise FileNotFoundError()
 
-        self.records = file_io.read_csv(self.input_file)
+        if self.extractor == EXTRACTOR_MMAP:
+            rows = self._iter_rows()
+            self.header = next(rows, [])
+            self.records = list(rows)
+            return
+
+        self.header, self.records = file_io.read_csv_rows(self.input_file, self.encoding)
+
+    def _iter_rows(self, decode_all=False):
+        """ lazily reads the header followed by each non-blank row list with the configured extractor """
+        if self.extractor == EXTRACTOR_MMAP:
+            with file_io.MappedCSVReader(self.input_file, self.encoding) as reader:
+                yield reader.header
+                columns = None if decode_all else self._compile_plan(reader.header).columns
+                yield from reader.rows(columns)
+            return
+
+        yield from file_io.iter_csv_rows(self.input_file, self.encoding)
 
     def _parse(self):
-        """ parses a list of records into a list of models """
-        self.models = [parser.parse_inventory_item(record) for record in self.records]
+        """ parses a list of records into models, holding lazy models and projections in a list """
+        self._plan = self._compile_plan(self.header)
+        parsed = self._count_rows(self._convert_rows(self._plan, self.records))
+
+        if self.lazy or self._plan.projection is not None:
+            self.models = list(parsed)
+        else:
+            self.models = self._hold_models(parsed)
 
     def _transform(self):
-        """ serialises a list of models to an output json file """
-        data = file_io.output_json(self.models)
-        file_io.write_json(self.output_file, data)
+        """ serialises the models, then records the parse plan statistics lazy models update """
+        super()._transform()
+        if self._plan is not None:
+            self._record_plan(self._plan)
+            self._plan = None
+
+    def _compile_plan(self, header):
+        """ compiles the parse plan of a csv header with the configured columns, predicates and money """
+        return parser.compile_parse_plan(header, self.columns, self.predicates, self.money)
+
+    def _convert_rows(self, plan, rows):
+        """ lazily parses the csv row lists matching the predicates into models or projected dicts """
+        if plan.predicates:
+            rows = self._filter_rows(plan, rows)
+
+        parsed = self._parse_rows(plan, rows)
+        return parsed if plan.projection is None else map(plan.project, parsed)
+
+    def _filter_rows(self, plan, rows):
+        """ lazily filters csv row lists by the predicates, rejecting rows failing validation """
+        if self.error_policy != ERROR_POLICY_REJECT:
+            yield from filter(plan.matches, rows)
+            return
+
+        for row in rows:
+            try:
+                if not plan.matches(row):
+                    continue
+            except validate.ValidationError as error:
+                self._reject(plan, row, error)
+                continue
+            yield row
+
+    def _parse_rows(self, plan, rows):
+        """ lazily parses csv row lists into models, rejecting invalid rows under the reject policy """
+        if self.error_policy == ERROR_POLICY_REJECT:
+            return self._parse_tolerant(plan, rows)
+        if self.lazy:
+            return map(plan.parse_lazy, rows)
+        return map(plan.parse, rows)
+
+    def _parse_tolerant(self, plan, rows):
+        """ lazily parses csv row lists into models, rejecting rows failing validation """
+        for row in rows:
+            try:
+                item = plan.parse(row)
+            except validate.ValidationError as error:
+                self._reject(plan, row, error)
+                continue
+            yield item
+
+    def _reject(self, plan, row, error):
+        """ writes a row failing validation to the reject file, or collects it in a worker process """
+        with _REJECT_LOCK:
+            self.stats.rejected += 1
+
+            if self._collect_rejects:
+                self._rejected.append((row, str(error)))
+            else:
+                self._open_rejects(plan.header).write(row, str(error))
+
+    def _open_rejects(self, header):
+        """ returns the reject file writer, creating the reject file when the first row is rejected """
+        if self._reject_writer is None:
+            self._reject_writer = file_io.RejectWriter(self._reject_path(), header, self.encoding)
+            self._reject_writer.open()
+
+        return self._reject_writer
+
+    def _reject_path(self):
+        """ returns the reject file, defaulting to the output file with a .rejects.csv suffix """
+        if self.reject_file is not None:
+            return self.reject_file
+        if self.output_file is None:
+            raise ValueError('A reject file is required to reject rows without an output file')
+        return self.output_file + '.rejects.csv'
+
+    def _close_rejects(self):
+        """ closes the reject file """
+        if self._reject_writer is not None:
+            self._reject_writer.close()
+            self._reject_writer = None
 
     class Factory:
         """ Allows instantization of factory """
@@ -83,40 +1045,105 @@ class CSVConversion(Conversion):
             return CSVConversion()
 
 
+def _convert_text(conversion, plan, text):
+    """ parses and serialises the csv records of a block of text, planned from the first header """
+    rows = file_io.read_csv_text(text)
+
+    if plan is None and rows:
+        plan = conversion._compile_plan(rows.pop(0))
+
+    if not rows:
+        return plan, '', 0
+
+    converted = list(conversion._convert_rows(plan, rows))
+    return plan, conversion._serialise(converted), len(converted)
+
+
+def _convert_range(conversion, header, start, end):
+    """ parses and serialises the records within a byte range of the csv file in a worker process """
+    plan = conversion._compile_plan(header)
+
+    if conversion.extractor == EXTRACTOR_MMAP:
+        with file_io.MappedCSVReader(conversion.input_file, conversion.encoding) as reader:
+            rows = list(reader.rows(plan.columns, start, end))
+    else:
+        rows = file_io.read_csv_range(conversion.input_file, start, end, conversion.encoding)
+
+    converted = list(conversion._convert_rows(plan, rows))
+    rejects, conversion._rejected = conversion._rejected, []
+
+    return (conversion._serialise(converted), len(converted), plan.invalid, plan.cache_counts(), header,
+            rejects)
+
+
 class XMLConversion(Conversion):
-    """ XML Conversion Factory """
+    """ XML Conversion Factory, streaming item elements with iterparse so memory use stays constant """
 
     def __init__(self):
-        self.input_file = None
-        self.output_file = None
+        super().__init__()
+        self.item_tag = XML_ITEM_TAG
         self.records = []
         self.models = []
 
-    def set_input_file(self, input_file):
-        """ sets the xml input file """
-        self.input_file = input_file
+    def set_item_tag(self, item_tag):
+        """ sets the tag of the elements holding an inventory item, whose children hold its fields """
+        self.item_tag = item_tag
 
-    def set_output_file(self, output_file):
-        """ sets the json output file """
-        self.output_file = output_file
+    def set_streaming(self, streaming):
+        """ accepts the streaming option of csv conversions, xml items always being streamed """
 
     def execute(self):
-        """ extracts the contents of the csv file to a list of records """
-        self._extract()
-        self._parse()
-        self._transform()
+        """ converts the xml input file to json output one item at a time, recording statistics """
+        self.stats = stats.ConversionStats()
+        start = time.perf_counter()
+
+        try:
+            with self._stage(STAGE_STREAM):
+                self._stream()
+        finally:
+            self._record_totals(start)
+
+    def _stream(self):
+        """ extracts, parses and serialises one item element at a time using constant memory """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        plans = {}
+        with self._create_writer() as writer:
+            for model in self._count_rows(self._parse_records(plans, self._iter_records())):
+                writer.write(model)
+
+        for plan in plans.values():
+            self._record_plan(plan)
+        self.stats.bytes_written += writer.bytes_written
 
     def _extract(self):
-        """ extracts the contents of the csv file to a list of records """
-        raise NotImplementedError
+        """ extracts the item elements of the xml file to a list of (columns, values) records """
+        if self.input_file is None:
+            raise FileNotFoundError()
+
+        self.records = list(self._iter_records())
+
+    def _iter_records(self):
+        """ lazily reads the (columns, values) of each item element, named as in the csv header """
+        for tags, values in file_io.iter_xml_records(self.input_file, self.item_tag):
+            yield tuple(XML_COLUMNS.get(tag, tag) for tag in tags), values
 
     def _parse(self):
-        """ parses a list of records into a list of models """
-        raise NotImplementedError
+        """ parses a list of records into models """
+        plans = {}
+        self.models = self._hold_models(self._count_rows(self._parse_records(plans, self.records)))
 
-    def _transform(self):
-        """ serialises a list of models to an output json file """
-        raise NotImplementedError
+        for plan in plans.values():
+            self._record_plan(plan)
+
+    def _parse_records(self, plans, records):
+        """ lazily parses records into models, compiling a parse plan once for each set of columns """
+        for columns, values in records:
+            plan = plans.get(columns)
+            if plan is None:
+                plan = plans[columns] = parser.compile_parse_plan(columns, money=self.money)
+            yield plan.parse(values)
 
     class Factory:
         """ Allows instantization of factory """
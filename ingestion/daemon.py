@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+daemon
+----------------------------------
+Long lived conversion server accepting jobs over a unix socket, converting them in a pool of warm
+worker processes so small files no longer pay for an interpreter launch and imports each, and a
+client submitting jobs to it
+"""
+
+import json
+import os
+import socket
+import socketserver
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ingestion import batch
+from ingestion.conversion_factory import ConversionFactory
+
+# options passed to their setter as several arguments, which json turns from tuples into lists
+TUPLE_OPTIONS = ('shard_limits',)
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+
+def warm_worker(conversion_id):
+    """ Builds the conversion factory within a worker process before its first job arrives """
+    ConversionFactory.create_conversion(conversion_id)
+
+
+def job_options(job):
+    """ Returns the options of a job, restoring the tuples of options taking several arguments """
+    options = dict(job.get('options') or {})
+
+    if job.get('output_format') is not None:
+        options['output_format'] = job['output_format']
+    for name in TUPLE_OPTIONS:
+        if isinstance(options.get(name), list):
+            options[name] = tuple(options[name])
+
+    return options
+
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Converts the jobs sent by clients over a unix socket in a pool of worker processes
+
+    Each job is a line of json holding an id, input_file, output_file and optionally output_format,
+    options and conversion. A client sends its jobs then shuts down its side of the connection, and is
+    replied to with a line of json per job, holding its id, status, seconds, error and statistics, as
+    each job completes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, conversion_id='CSVConversion', jobs=None):
+        self.socket_path = socket_path
+        self.conversion_id = conversion_id
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.jobs, initializer=warm_worker,
+                                            initargs=(conversion_id,))
+
+        # starts every worker before any connection is handled, rather than forking from a handler thread
+        for future in [self.executor.submit(os.getpid) for _ in range(self.jobs)]:
+            future.result()
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, JobHandler)
+
+    def submit(self, job):
+        """ submits a job to the worker pool, returning its future """
+        return self.executor.submit(batch.convert_file, job.get('conversion', self.conversion_id),
+                                    job['input_file'], job['output_file'], job_options(job))
+
+    def server_close(self):
+        """ closes the socket, removing its file, and shuts down the worker pool """
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.executor.shutdown()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """ Submits the jobs of a connection as they are read, replying to each as it completes """
+
+    def handle(self):
+        futures = {}
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                job = json.loads(line)
+                futures[self.server.submit(job)] = job
+            except (ValueError, TypeError, KeyError, AttributeError) as error:
+                self.__reply({'id': None, 'status': STATUS_FAILED, 'error': 'Invalid job: %r' % error})
+
+        for future in as_completed(futures):
+            job = futures[future]
+            result = future.result()
+            self.__reply({'id': job.get('id'), 'input_file': result.input_file,
+                          'output_file': result.output_file,
+                          'status': STATUS_OK if result.succeeded else STATUS_FAILED,
+                          'seconds': result.seconds, 'error': result.error, 'stats': result.stats})
+
+    def __reply(self, reply):
+        """ writes a line of json to the client """
+        self.wfile.write(json.dumps(reply, sort_keys=True).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+def serve(socket_path, conversion_id='CSVConversion', jobs=None):
+    """ Serves conversion jobs on a unix socket until interrupted """
+    with ConversionServer(socket_path, conversion_id, jobs) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def submit(socket_path, jobs, callback=None):
+    """ Submits (input_file, output_file, options) jobs to a server, returning a BatchResult for each
+
+    callback is invoked with each BatchResult as its job completes. Results are in the order of jobs.
+    """
+    jobs = list(jobs)
+    results = [None] * len(jobs)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+
+        with client.makefile('wb') as outfile:
+            for id, (input_file, output_file, options) in enumerate(jobs):
+                job = {'id': id, 'input_file': os.path.abspath(input_file),
+                       'output_file': os.path.abspath(output_file), 'options': options or {}}
+                outfile.write(json.dumps(job, sort_keys=True).encode('utf-8') + b'\n')
+        client.shutdown(socket.SHUT_WR)
+
+        with client.makefile('rb') as infile:
+            for line in infile:
+                reply = json.loads(line)
+                if reply['id'] is None:
+                    raise ValueError(reply['error'])
+
+                result = batch.BatchResult(reply['input_file'], reply['output_file'], reply['seconds'],
+                                           reply['error'], reply['stats'])
+                results[reply['id']] = result
+
+                if callback is not None:
+                    callback(result)
+
+    return results
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+database
+----------------------------------
+SQLite output target writing inventory items and their modifiers into normalised tables, bulk loading
+an empty database before indexing it and upserting items by id when a database is re-ingested
+"""
+
+import json
+import os
+import sqlite3
+
+from ingestion import models
+
+# number of items inserted within each transaction
+BATCH_SIZE = 50000
+
+# pragmas trading durability of the transaction in flight for bulk load throughput
+PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (key INTEGER PRIMARY KEY, id INTEGER, description TEXT, price REAL,
+                                  cost REAL, price_type TEXT, quantity_on_hand INTEGER, extras TEXT);
+CREATE TABLE IF NOT EXISTS modifiers (item_key INTEGER NOT NULL, position INTEGER NOT NULL, name TEXT,
+                                      price REAL);
+"""
+
+INDEXES = ('CREATE UNIQUE INDEX IF NOT EXISTS items_id ON items (id)',
+           'CREATE INDEX IF NOT EXISTS modifiers_item_key ON modifiers (item_key)')
+
+INSERT_ITEM = ('INSERT INTO items (key, id, description, price, cost, price_type, quantity_on_hand, '
+               'extras) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+UPSERT_ITEM = INSERT_ITEM + (' ON CONFLICT (id) DO UPDATE SET key = excluded.key, '
+                             'description = excluded.description, price = excluded.price, '
+                             'cost = excluded.cost, price_type = excluded.price_type, '
+                             'quantity_on_hand = excluded.quantity_on_hand, extras = excluded.extras')
+INSERT_MODIFIER = 'INSERT INTO modifiers (item_key, position, name, price) VALUES (?, ?, ?, ?)'
+
+
+def item_rows(models):
+    """ Converts models to the rows written by SQLiteWriter, which can be passed to write_fragment """
+    return [item_row(model) for model in models]
+
+
+def item_row(model):
+    """ Converts a model to an item row followed by a (name, price) tuple for each of its modifiers """
+    extras = model.extras
+    return ((model.id, model.description, decimal(model.price), decimal(model.cost), model.price_type,
+             model.quantity_on_hand, json.dumps(extras, sort_keys=True) if extras else None),
+            [(modifier.get('name'), decimal(modifier.get('price'))) for modifier in model.modifiers])
+
+
+def decimal(value):
+    """ Returns cents as the decimal stored in the REAL price columns, other values as they are """
+    return value / 100 if type(value) is models.Cents else value
+
+
+class SQLiteWriter(object):
+    """ Writes models to the items and modifiers tables of a SQLite database in batched transactions
+
+    An empty database is bulk loaded without indexes, which are created once the load completes, keeping
+    the last of any items sharing an id. Items written to a database which already holds items replace
+    the item with the same id, along with its modifiers.
+    """
+
+    def __init__(self, file, batch_size=BATCH_SIZE):
+        self.file = file
+        self.batch_size = batch_size
+        self.count = 0
+        self.bytes_written = 0
+        self.upsert = False
+        self._connection = None
+        self._key = 0
+        self._items = []
+        self._modifiers = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        """ opens the database, creating its tables, and upserts items if it already holds any """
+        if hasattr(self.file, 'write'):
+            raise ValueError('SQLite output requires a database file')
+
+        self._connection = sqlite3.connect(self.file)
+        self._connection.executescript(PRAGMAS + SCHEMA)
+
+        self.upsert = self._connection.execute('SELECT 1 FROM items LIMIT 1').fetchone() is not None
+        if self.upsert:
+            self.__create_indexes()
+
+        self._key = self._connection.execute('SELECT COALESCE(MAX(key), 0) FROM items').fetchone()[0]
+
+    def resume(self, position, count):
+        """ reopens the database after an interrupted conversion, upserting re-converted items """
+        self.open()
+        self.count = count
+
+    def checkpoint(self):
+        """ commits the items written so far, returning zero as upserts need no resume position """
+        self.__flush()
+        return 0
+
+    def write(self, model):
+        """ writes a single model, committing a transaction every batch size items """
+        self.write_fragment([item_row(model)], 1)
+
+    def write_fragment(self, fragment, count):
+        """ writes count pre-converted item rows, as returned by item_rows """
+        for item, modifiers in fragment:
+            self._key += 1
+            self._items.append((self._key,) + item)
+            for position, (name, price) in enumerate(modifiers):
+                self._modifiers.append((self._key, position, name, price))
+
+        self.count += count
+        if len(self._items) >= self.batch_size:
+            self.__flush()
+
+    def close(self):
+        """ commits the remaining items, indexing a bulk load and removing replaced modifiers """
+        if self._connection is None:
+            return
+
+        self.__flush()
+        self.__create_indexes()
+        self._connection.close()
+        self._connection = None
+        self.bytes_written = os.path.getsize(self.file)
+
+    def abort(self):
+        """ closes the database, discarding the items not yet committed """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __flush(self):
+        """ inserts the pending items and modifiers within a single transaction """
+        if not self._items:
+            return
+
+        with self._connection:
+            self._connection.executemany(UPSERT_ITEM if self.upsert else INSERT_ITEM, self._items)
+            self._connection.executemany(INSERT_MODIFIER, self._modifiers)
+
+        self._items = []
+        self._modifiers = []
+
+    def __create_indexes(self):
+        """ keeps the last item of each id and its modifiers, then indexes both tables """
+        with self._connection:
+            self._connection.execute('DELETE FROM items WHERE id IS NOT NULL AND key NOT IN '
+                                     '(SELECT MAX(key) FROM items WHERE id IS NOT NULL GROUP BY id)')
+            for index in INDEXES:
+                self._connection.execute(index)
+            self._connection.execute('DELETE FROM modifiers WHERE item_key NOT IN '
+                                     '(SELECT key FROM items)')
@@ -7,32 +7,838 @@ file_io
 Generic IO for reading and writing to files
 """
 
+import asyncio
+import bz2
+import codecs
 import csv
+import gzip
+import io
+import locale
+import lzma
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from xml.etree import ElementTree
 
 import json
 
+from ingestion import models
+from ingestion import serialiser
+
+# serialisers matching output_json, indented by default or compact without whitespace
+SERIALISER = serialiser.ModelSerialiser(indent=2)
+COMPACT_SERIALISER = serialiser.ModelSerialiser(indent=None)
+
+# serialisers of each layout and money format keyed by (compact, money), created when first used
+SERIALISERS = {
+    (False, models.MONEY_FLOAT): SERIALISER,
+    (True, models.MONEY_FLOAT): COMPACT_SERIALISER
+}
+
+# approximate size in bytes of each block of a memory mapped csv file split into rows at once
+MAPPED_BLOCK_SIZE = 1024 * 1024
+
+# size in bytes of each block of output compressed independently of the others
+COMPRESSION_BLOCK_SIZE = 4 * 1024 * 1024
+
+# gzip level of compressed output, matching the default of the gzip command line tool
+GZIP_LEVEL = 6
+
+# opener of compressed files by extension, and the function compressing each block of output to a
+# complete gzip member, bzip2 stream or xz stream, which their decompressors read back as one file
+COMPRESSIONS = {
+    '.gz': (gzip.open, partial(gzip.compress, compresslevel=GZIP_LEVEL, mtime=0)),
+    '.bz2': (bz2.open, bz2.compress),
+    '.xz': (lzma.open, lzma.compress)
+}
+
+
+def compression_of(file):
+    """ Returns the (opener, block compressor) of a compressed path by extension, otherwise none """
+    if not isinstance(file, str):
+        return None
+    return COMPRESSIONS.get(os.path.splitext(file)[1].lower())
+
+
+def uncompressed_name(file):
+    """ Returns a file path without its compression extension """
+    return os.path.splitext(file)[0] if compression_of(file) is not None else file
+
+
+def open_input(file, mode='r', encoding=None, newline=None):
+    """ Opens an input file for reading, decompressing it when its extension is compressed """
+    compression = compression_of(file)
+    if compression is None:
+        return open(file, mode, encoding=encoding, newline=newline)
+
+    if 'b' in mode:
+        return compression[0](file, mode)
+    return compression[0](file, mode.replace('t', '') + 't', encoding=encoding, newline=newline)
+
 
 def read_csv(file):
     """ Reads a csv file and returns all rows (including field names) """
-    with open(file, newline='') as csv_file:
+    with open_input(file, newline='') as csv_file:
         reader = csv.DictReader(csv_file, delimiter=',')
         rows = [row for row in reader]
         return rows
 
 
+def read_csv_rows(file, encoding=None):
+    """ Reads a csv file and returns the header and all remaining rows as lists """
+    with open_input(file, newline='', encoding=encoding) as csv_file:
+        reader = csv.reader(csv_file, delimiter=',')
+        header = next(reader, [])
+        rows = [row for row in reader if row]
+        return header, rows
+
+
+def iter_csv_rows(file, encoding=None):
+    """ Lazily reads a csv file yielding the header followed by each non-blank row list """
+    with open_input(file, newline='', encoding=encoding) as csv_file:
+        for row in csv.reader(csv_file, delimiter=','):
+            if row:
+                yield row
+
+
+def split_csv(file, chunk_size):
+    """ Splits a csv file at record boundaries into (start, end) byte ranges of roughly chunk_size bytes
+
+    The first range holds only the header record. Newlines within quoted fields are never used as a
+    boundary: a newline only ends a record when an even number of quotes precede it within the record.
+    """
+    return list(iter_csv_ranges(file, chunk_size))
+
+
+def iter_csv_ranges(file, chunk_size, start=0):
+    """ Lazily splits a csv file into the byte ranges of split_csv, optionally from a record boundary
+
+    Ranges starting after the header are only scanned as they are requested.
+    """
+    size = os.path.getsize(file)
+    if size == 0:
+        yield 0, 0
+        return
+
+    with open(file, 'rb') as csv_file, mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        target = start if start == 0 else start + chunk_size
+
+        while start < size:
+            end = _next_record_boundary(data, start, target, size)
+            yield start, end
+            start = end
+            target = start + chunk_size
+
+
+def _next_record_boundary(data, start, target, size):
+    """ Returns the offset after the first record-ending newline at or beyond target """
+    quotes = _count_quotes(data, start, target)
+
+    while True:
+        newline = data.find(b'\n', target)
+        if newline == -1:
+            return size
+
+        quotes += _count_quotes(data, target, newline)
+        if quotes % 2 == 0:
+            return newline + 1
+
+        target = newline + 1
+
+
+def _count_quotes(data, start, end, window=1024 * 1024):
+    """ Counts the quote characters between two offsets of a memory map, one window at a time """
+    quotes = 0
+    for offset in range(start, end, window):
+        quotes += data[offset:min(offset + window, end)].count(b'"')
+    return quotes
+
+
+def read_csv_range(file, start, end, encoding=None):
+    """ Reads the rows held within a byte range of a csv file, as returned by split_csv """
+    with open(file, 'rb') as csv_file:
+        csv_file.seek(start)
+        text = csv_file.read(end - start).decode(encoding or locale.getpreferredencoding(False))
+
+    return read_csv_text(text)
+
+
+def read_csv_text(text):
+    """ Reads the non-blank rows held within a block of csv text """
+    return [row for row in csv.reader(io.StringIO(text, newline=''), delimiter=',') if row]
+
+
+def find_record_boundary(text):
+    """ Returns the offset after the last newline of csv text which ends a record, otherwise zero
+
+    As with split_csv, a newline only ends a record when an even number of quotes precede it.
+    """
+    boundary = text.rfind('\n')
+    quotes = text.count('"', 0, boundary) if boundary != -1 else 0
+
+    while boundary != -1 and quotes % 2:
+        previous = text.rfind('\n', 0, boundary)
+        quotes -= text.count('"', previous + 1, boundary)
+        boundary = previous
+
+    return boundary + 1
+
+
+class MappedCSVReader(object):
+    """ Reads a csv file from a memory map, splitting rows on the raw bytes a block at a time
+
+    Unquoted ascii lines are decoded whole, otherwise only the fields at the column indexes requested
+    are decoded and the remaining fields are None. Records containing quotes fall back to the csv module.
+    The encoding must be ascii compatible.
+    """
+
+    def __init__(self, file, encoding=None):
+        self.file = file
+        self.encoding = _mapped_encoding(encoding)
+        self.header = []
+        self._data = None
+        self._start = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """ maps the csv file into memory and reads its header """
+        if os.path.getsize(self.file) == 0:
+            return
+
+        with open(self.file, 'rb') as csv_file:
+            self._data = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._start = _next_record_boundary(self._data, 0, 0, len(self._data))
+        self.header = next(_split_mapped_block(self._data[:self._start], self.encoding, None), [])
+
+    def rows(self, columns=None, start=None, end=None):
+        """ lazily yields each non-blank row list after the header, or in a byte range of split_csv """
+        if self._data is None:
+            return
+
+        data = self._data
+        columns = None if columns is None else frozenset(columns)
+        position = self._start if start is None else max(start, self._start)
+        end = len(data) if end is None else end
+
+        while position < end:
+            boundary = min(_next_record_boundary(data, position, position + MAPPED_BLOCK_SIZE, end), end)
+            block = data[position:boundary]
+            position = boundary
+
+            # the common case of a block of plain ascii csv is split without visiting each field
+            if block.isascii() and b'"' not in block and b'\r' not in block:
+                yield from [line.split(',') for line in block.decode('ascii').split('\n') if line]
+                continue
+
+            yield from _split_mapped_block(block, self.encoding, columns)
+
+    def close(self):
+        """ unmaps the csv file """
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+
+def _mapped_encoding(encoding):
+    """ Returns the encoding of a memory mapped csv file, which must encode csv delimiters as ascii """
+    encoding = codecs.lookup(encoding or locale.getpreferredencoding(False)).name
+    try:
+        compatible = b'",\r\n'.decode(encoding) == '",\r\n'
+    except UnicodeDecodeError:
+        compatible = False
+
+    if not compatible:
+        raise ValueError('Memory mapped csv files need an ascii compatible encoding, not %s' % encoding)
+    return encoding
+
+
+def _split_mapped_block(block, encoding, columns):
+    """ Splits a block of whole csv records into row lists, decoding only the fields required """
+    lines = iter(block.split(b'\n'))
+
+    for line in lines:
+        if b'"' in line:
+            # a newline within a quoted field splits a record across lines until its quotes are balanced
+            while line.count(b'"') % 2:
+                following = next(lines, None)
+                if following is None:
+                    break
+                line += b'\n' + following
+
+            row = next(csv.reader((line.decode(encoding),), delimiter=','), [])
+            if row:
+                yield row
+            continue
+
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        if not line:
+            continue
+
+        if line.isascii():
+            yield line.decode('ascii').split(',')
+        elif columns is None:
+            yield [field.decode(encoding) for field in line.split(b',')]
+        else:
+            yield [field.decode(encoding) if index in columns else None
+                   for index, field in enumerate(line.split(b','))]
+
+
+def iter_csv_records(file, encoding=None):
+    """ Lazily yields the (byte offset, byte length, row list) of each non-blank record of a csv file
+
+    The header is yielded first. As with split_csv, newlines within quoted fields do not end a record.
+    """
+    size = os.path.getsize(file)
+    if size == 0:
+        return
+
+    encoding = encoding or locale.getpreferredencoding(False)
+
+    with open(file, 'rb') as csv_file, mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = _next_record_boundary(data, start, start, size)
+            rows = read_csv_text(data[start:end].decode(encoding))
+            if rows:
+                yield start, end - start, rows[0]
+            start = end
+
+
+def iter_json_records(file, block_size=MAPPED_BLOCK_SIZE):
+    """ Lazily yields the (byte offset, byte length, value) of each element of a json array written by
+    output_json or JSONArrayWriter, or of each line of json lines
+
+    The file is decoded a block at a time, relying on the ascii output of the serialisers for the
+    character offsets within a block to be byte offsets.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(file, 'rb') as infile:
+        text = ''
+        base = 0
+        position = 0
+        eof = False
+        started = False
+
+        while True:
+            # skips the whitespace and separators between elements
+            while position < len(text) and text[position] in ' \t\r\n,':
+                position += 1
+
+            if position < len(text) and text[position] in '[]':
+                if text[position] == ']' or started:
+                    return
+                position += 1
+                started = True
+                continue
+
+            try:
+                if position == len(text):
+                    raise ValueError('end of block')
+                value, end = decoder.raw_decode(text, position)
+            except ValueError:
+                # the element continues into the next block, unless the file has been read entirely
+                if eof:
+                    if position == len(text):
+                        return
+                    raise
+                block = infile.read(block_size)
+                eof = len(block) < block_size
+                base += position
+                text = text[position:] + block.decode('ascii')
+                position = 0
+                continue
+
+            started = True
+            yield base + position, end - position, value
+            position = end
+
+
 def write_json(file, data):
-    """ Reads a csv file and returns all rows (including field names) """
-    with open(file, 'w') as outfile:
+    """ Writes data to a json file, compressing it when its extension is compressed """
+    outfile = _open_output(file)
+    try:
         outfile.write(data)
+    finally:
+        _close_output(file, outfile)
+
+
+class AsyncFileReader(object):
+    """ Reads a binary file such as stdin in a worker thread, like the read of asyncio.StreamReader """
+
+    def __init__(self, file):
+        self.file = file
+
+    async def read(self, size=-1):
+        """ returns up to size bytes, or an empty bytes object at the end of the file """
+        read = getattr(self.file, 'read1', self.file.read)
+        return await asyncio.get_running_loop().run_in_executor(None, read, size)
+
+
+class AsyncFileWriter(object):
+    """ Writes to a binary file such as stdout from a worker thread, providing the write and drain of
+    asyncio.StreamWriter """
+
+    def __init__(self, file):
+        self.file = file
+        self._pending = []
+
+    def write(self, data):
+        """ buffers data until the writer is drained """
+        self._pending.append(data)
+
+    async def drain(self):
+        """ writes and flushes the buffered data """
+        data, self._pending = b''.join(self._pending), []
+        await asyncio.get_running_loop().run_in_executor(None, self.__write, data)
+
+    def __write(self, data):
+        """ writes data to the file and flushes it """
+        self.file.write(data)
+        self.file.flush()
+
+
+def iter_xml_records(file, item_tag):
+    """ Lazily yields the (child tags, child texts) of each item element of an xml file
+
+    Each item is cleared and detached from its parent once it has been processed, so memory use stays
+    constant however many items the file holds. Namespaces are dropped from the tags.
+    """
+    with open_input(file, 'rb') as xml_file:
+        yield from _iter_xml_items(xml_file, item_tag)
+
+
+def _iter_xml_items(xml_file, item_tag):
+    """ Lazily yields the (child tags, child texts) of each item element of an open xml file """
+    parents = []
+
+    for event, element in ElementTree.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if _local_name(element.tag) != item_tag:
+            continue
+
+        yield [_local_name(child.tag) for child in element], [child.text or '' for child in element]
+
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+
+
+def _local_name(tag):
+    """ Returns an element tag without its namespace """
+    return tag.rpartition('}')[2]
+
+
+class RejectWriter(object):
+    """ Writes rows rejected by validation to a csv file of the input columns and the reason """
+
+    def __init__(self, file, header, encoding=None):
+        self.file = file
+        self.header = list(header)
+        self.encoding = encoding
+        self.count = 0
+        self._outfile = None
+        self._writer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """ creates the reject file, writing its header """
+        self.__open('w')
+        self._writer.writerow(self.header + ['reject_reason'])
+
+    def resume(self, position, count):
+        """ reopens a reject file truncated to a checkpointed position, holding count rejected rows """
+        self.__open('r+')
+        self._outfile.seek(position)
+        self._outfile.truncate()
+        self.count = count
+
+    def write(self, row, reason):
+        """ writes a rejected row and the reason it was rejected """
+        self._writer.writerow(list(row) + [reason])
+        self.count += 1
+
+    def checkpoint(self):
+        """ flushes the reject file to disk, returning its position """
+        return _sync_output(self._outfile)
+
+    def close(self):
+        """ closes the reject file """
+        if self._outfile is not None:
+            self._outfile.close()
+            self._outfile = None
+
+    def __open(self, mode):
+        """ opens the reject file in a mode """
+        self._outfile = open(self.file, mode, newline='', encoding=self.encoding)
+        self._writer = csv.writer(self._outfile, delimiter=',', lineterminator='\n')
 
 
 class CustomModelEncoder(json.JSONEncoder):
     """ Customer JSON Encoder used to strip _ from model properties """
 
     def default(self, o):
-        return {key.lstrip('_'): value for key, value in vars(o).items()}
+        return serialiser.default(o)
+
 
+def get_serialiser(compact=False, money=models.MONEY_FLOAT):
+    """ Returns the shared serialiser of indented or compact json writing cents in a money format """
+    model_serialiser = SERIALISERS.get((compact, money))
+    if model_serialiser is None:
+        model_serialiser = serialiser.ModelSerialiser(None if compact else 2, money)
+        SERIALISERS[(compact, money)] = model_serialiser
+    return model_serialiser
 
-def output_json(models):
+
+def output_json(models, compact=False, money=models.MONEY_FLOAT):
     """ Converts object and all properties to valid json with keys sorted """
-    return json.dumps(models, cls=CustomModelEncoder, sort_keys=True, indent=2)
+    return get_serialiser(compact, money).dumps(models)
+
+
+def output_json_element(model, compact=False, money=models.MONEY_FLOAT):
+    """ Converts a model to valid json indented as an element of the array produced by output_json """
+    if compact:
+        return get_serialiser(True, money).dumps(model)
+    return '  ' + get_serialiser(False, money).dumps(model, 1)
+
+
+def output_json_fragment(models, compact=False, money=models.MONEY_FLOAT):
+    """ Converts models to a run of json array elements which can be written with JSONArrayWriter """
+    separator = ',' if compact else ',\n'
+    return separator.join(output_json_element(model, compact, money) for model in models)
+
+
+class JSONArrayWriter(object):
+    """ Incrementally writes models as a json array identical to output_json
+
+    file is either a path or an open text stream, which is left open when the writer is closed.
+    """
+
+    def __init__(self, file, compact=False, money=models.MONEY_FLOAT):
+        self.file = file
+        self.compact = compact
+        self.money = money
+        self.count = 0
+        self.bytes_written = 0
+        self._outfile = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        """ opens the output file for writing """
+        self._outfile = _open_output(self.file)
+
+    def resume(self, position, count):
+        """ reopens an output file truncated to a checkpointed position, holding count array elements """
+        self._outfile = _resume_output(self.file, position)
+        self.count = count
+        self.bytes_written = position
+
+    def checkpoint(self):
+        """ flushes the output to disk, returning its position """
+        return _sync_output(self._outfile)
+
+    def write(self, model):
+        """ serialises a single model as the next element of the array """
+        self.write_fragment(output_json_element(model, self.compact, self.money), 1)
+
+    def write_fragment(self, fragment, count):
+        """ writes count pre-serialised array elements, as returned by output_json_fragment """
+        if count == 0:
+            return
+
+        if self.compact:
+            self.bytes_written += self._outfile.write(('[' if self.count == 0 else ',') + fragment)
+        else:
+            self.bytes_written += self._outfile.write(('[\n' if self.count == 0 else ',\n') + fragment)
+        self.count += count
+
+    def close(self):
+        """ terminates the json array and closes the output file """
+        if self._outfile is None:
+            return
+
+        if self.count == 0:
+            self.bytes_written += self._outfile.write('[]')
+        else:
+            self.bytes_written += self._outfile.write(']' if self.compact else '\n]')
+        _close_output(self.file, self._outfile)
+        self._outfile = None
+
+    def abort(self):
+        """ closes the output file without terminating the json array, leaving it visibly incomplete """
+        if self._outfile is not None:
+            _close_output(self.file, self._outfile)
+            self._outfile = None
+
+
+def output_ndjson_fragment(models, money=models.MONEY_FLOAT):
+    """ Converts models to json lines, one compact model per line """
+    model_serialiser = get_serialiser(True, money)
+    return '\n'.join(model_serialiser.dumps(model) for model in models)
+
+
+class NDJSONWriter(object):
+    """ Incrementally writes models as json lines, optionally rolling over into numbered shard files
+
+    When sharding, each shard is named after the output file with a zero padded number before its
+    extension and a manifest listing the shards and their row counts is kept beside the output file.
+    The manifest is rewritten as each shard is completed so consumers can start on finished shards.
+    Without sharding, file may also be an open text stream, which is left open when the writer is closed.
+    """
+
+    def __init__(self, file, max_records=None, max_bytes=None, money=models.MONEY_FLOAT):
+        if (max_records or max_bytes) and hasattr(file, 'write'):
+            raise ValueError('Sharded json lines must be written to a file path, not a stream')
+
+        self.file = file
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.money = money
+        self._serialiser = get_serialiser(True, money)
+        self.count = 0
+        self.bytes_written = 0
+        self.shards = []
+        self._outfile = None
+        self._records = 0
+        self._bytes = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def sharded(self):
+        """ returns true if output rolls over into shard files """
+        return bool(self.max_records or self.max_bytes)
+
+    @property
+    def manifest_file(self):
+        """ returns the path of the shard manifest """
+        return self.file + '.manifest.json'
+
+    def shard_file(self, number):
+        """ returns the path of a numbered shard, numbered before the extensions of a compressed file """
+        root, extension = os.path.splitext(uncompressed_name(self.file))
+        return '%s-%05d%s%s' % (root, number, extension, self.file[len(uncompressed_name(self.file)):])
+
+    def open(self):
+        """ opens the output file, or the first shard, for writing """
+        self.__open_file()
+
+    def resume(self, position, count):
+        """ reopens an unsharded output file truncated to a checkpoint holding count lines """
+        if self.sharded:
+            raise ValueError('Sharded json lines output cannot be resumed')
+
+        self._outfile = _resume_output(self.file, position)
+        self.count = self._records = count
+        self.bytes_written = self._bytes = position
+
+    def checkpoint(self):
+        """ flushes the output to disk, returning its position """
+        return _sync_output(self._outfile)
+
+    def write(self, model):
+        """ serialises a single model as the next line """
+        self.__write_line(self._serialiser.dumps(model))
+
+    def write_fragment(self, fragment, count):
+        """ writes count pre-serialised lines, as returned by output_ndjson_fragment """
+        if count == 0:
+            return
+
+        if self.sharded:
+            for line in fragment.split('\n'):
+                self.__write_line(line)
+            return
+
+        self.bytes_written += self._outfile.write(fragment + '\n')
+        self.count += count
+        self._records += count
+
+    def close(self):
+        """ closes the current file and completes the shard manifest """
+        if self._outfile is None:
+            return
+
+        self.__close_file()
+
+        if self.sharded:
+            self.__write_manifest(complete=True)
+
+    def abort(self):
+        """ closes the current file leaving the shard manifest incomplete """
+        if self._outfile is not None:
+            _close_output(self.file, self._outfile)
+            self._outfile = None
+
+    def __write_line(self, line):
+        """ writes a line, first rolling over to a new shard when a limit would be exceeded """
+        size = len(line) + 1
+
+        if self.sharded and self._records > 0 and (
+                (self.max_records and self._records >= self.max_records) or
+                (self.max_bytes and self._bytes + size > self.max_bytes)):
+            self.__close_file()
+            self.__write_manifest(complete=False)
+            self.__open_file()
+
+        self._outfile.write(line + '\n')
+        self.count += 1
+        self.bytes_written += size
+        self._records += 1
+        self._bytes += size
+
+    def __open_file(self):
+        """ opens the output file, or the next shard when sharding """
+        file = self.shard_file(len(self.shards)) if self.sharded else self.file
+        self._outfile = _open_output(file)
+        self._records = 0
+        self._bytes = 0
+
+    def __close_file(self):
+        """ closes the current file, recording it as a shard when sharding """
+        _close_output(self.file, self._outfile)
+        self._outfile = None
+
+        if self.sharded:
+            self.shards.append({
+                'file': os.path.basename(self.shard_file(len(self.shards))),
+                'records': self._records,
+                'bytes': self._bytes
+            })
+
+    def __write_manifest(self, complete):
+        """ atomically replaces the manifest listing the completed shards """
+        manifest = {'complete': complete, 'records': sum(shard['records'] for shard in self.shards),
+                    'shards': self.shards}
+
+        with open(self.manifest_file + '.tmp', 'w') as outfile:
+            outfile.write(json.dumps(manifest, sort_keys=True, indent=2))
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+
+class CompressedWriter(io.RawIOBase):
+    """ Binary output stream compressing blocks independently on a thread pool, writing them in order
+
+    Each block becomes a complete gzip member, bzip2 stream or xz stream, so the output is read back
+    as a single file by gzip, bz2 and lzma and by their command line tools, while compression, which
+    releases the GIL, runs on every core instead of holding up the conversion.
+    """
+
+    def __init__(self, file, compress, block_size=COMPRESSION_BLOCK_SIZE, workers=None):
+        super().__init__()
+        self.file = file
+        self.compress = compress
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self._outfile = open(file, 'wb')
+        self._executor = ThreadPoolExecutor(self.workers)
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._blocks = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """ buffers data, compressing each block once it is full """
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self.__compress(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """ compresses the remaining data, even when empty so the output is a valid compressed file """
+        if self.closed:
+            return
+
+        try:
+            if self._buffer or self._blocks == 0:
+                self.__compress(self._buffer)
+            while self._pending:
+                self._outfile.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown()
+            self._outfile.close()
+            super().close()
+
+    def __compress(self, block):
+        """ submits a block for compression, writing blocks in order while too many are pending """
+        self._pending.append(self._executor.submit(self.compress, bytes(block)))
+        self._blocks += 1
+
+        while len(self._pending) > self.workers * 2:
+            self._outfile.write(self._pending.popleft().result())
+
+
+def _open_output(file):
+    """ Opens an output path for writing, compressed by extension, or returns a text stream as is """
+    if hasattr(file, 'write'):
+        return file
+
+    compression = compression_of(file)
+    if compression is None:
+        return open(file, 'w')
+    return io.TextIOWrapper(CompressedWriter(file, compression[1]),
+                            encoding=locale.getpreferredencoding(False))
+
+
+def _close_output(file, outfile):
+    """ Closes an output file opened by _open_output, leaving streams passed by the caller open """
+    if outfile is not file:
+        outfile.close()
+
+
+def _resume_output(file, position):
+    """ Reopens an output file for writing, discarding anything written after position """
+    if compression_of(file) is not None:
+        raise ValueError('Compressed output %s cannot be resumed' % file)
+
+    outfile = open(file, 'r+')
+    outfile.seek(position)
+    outfile.truncate()
+    return outfile
+
+
+def _sync_output(outfile):
+    """ Flushes an output file to disk and returns its position """
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    return outfile.tell()
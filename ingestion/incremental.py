@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+incremental
+----------------------------------
+Local state store of file and row content hashes, allowing unchanged files to be skipped and changed
+files to be reduced to the items which were added, changed or removed since the previous run
+"""
+
+import hashlib
+import sqlite3
+
+CHANGE_ADDED = 'added'
+CHANGE_CHANGED = 'changed'
+CHANGE_REMOVED = 'removed'
+CHANGE_UNCHANGED = 'unchanged'
+
+# size of the blocks read when hashing a whole file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, digest TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS rows (path TEXT NOT NULL, id TEXT NOT NULL, digest BLOB NOT NULL,
+                                 PRIMARY KEY (path, id)) WITHOUT ROWID;
+"""
+
+
+def file_digest(file):
+    """ Returns the sha256 hex digest of a file's contents """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as infile:
+        for block in iter(lambda: infile.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RowHasher(object):
+    """ Hashes csv rows, seeded with the header so a changed header changes every row """
+
+    def __init__(self, header):
+        self._base = hashlib.blake2b(_encode_row(header), digest_size=16)
+
+    def digest(self, row):
+        """ returns the 16 byte digest of a row """
+        digest = self._base.copy()
+        digest.update(_encode_row(row))
+        return digest.digest()
+
+
+def _encode_row(row):
+    """ Encodes a row unambiguously for hashing """
+    return '\x1f'.join(row).encode('utf-8', 'surrogatepass') + b'\x1e'
+
+
+class StateStore(object):
+    """ SQLite store of the content hashes recorded by the previous run of each input file """
+
+    def __init__(self, file):
+        self.file = file
+        self._connection = sqlite3.connect(file, timeout=60)
+        self._connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def file_digest(self, path):
+        """ returns the digest recorded for a file, otherwise none """
+        row = self._connection.execute('SELECT digest FROM files WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+    def row_digests(self, path):
+        """ returns the row digest recorded for each item id of a file """
+        return dict(self._connection.execute('SELECT id, digest FROM rows WHERE path = ?', (path,)))
+
+    def save(self, path, digest, row_digests):
+        """ replaces the recorded hashes of a file within a single transaction """
+        with self._connection:
+            self._connection.execute('DELETE FROM rows WHERE path = ?', (path,))
+            self._connection.executemany('INSERT OR REPLACE INTO rows (path, id, digest) '
+                                         'VALUES (?, ?, ?)',
+                                         ((path, key, value) for key, value in row_digests.items()))
+            self._connection.execute('INSERT OR REPLACE INTO files (path, digest) VALUES (?, ?)',
+                                     (path, digest))
+
+    def close(self):
+        """ closes the underlying database connection """
+        self._connection.close()
+
+
+class RowDiff(object):
+    """ Compares the rows of a file with the digests of its previous run, keyed by raw item id """
+
+    def __init__(self, header, id_index, previous):
+        self.hasher = RowHasher(header)
+        self.id_index = id_index
+        self.previous = previous
+        self.current = {}
+        self.counts = dict.fromkeys((CHANGE_ADDED, CHANGE_CHANGED, CHANGE_REMOVED, CHANGE_UNCHANGED), 0)
+
+    def compare(self, row):
+        """ records the digest of a row and returns its item id key and change """
+        key = row[self.id_index] if self.id_index < len(row) else ''
+        digest = self.hasher.digest(row)
+        self.current[key] = digest
+
+        previous = self.previous.get(key)
+        if previous is None:
+            change = CHANGE_ADDED
+        elif previous == digest:
+            change = CHANGE_UNCHANGED
+        else:
+            change = CHANGE_CHANGED
+
+        self.counts[change] += 1
+        return key, change
+
+    def revert(self, key, change):
+        """ forgets the comparison of a row which failed to convert, keeping the previous digest
+
+        The id is still in the file so it is not removed, and once corrected is compared with the last
+        version converted.
+        """
+        self.counts[change] -= 1
+
+        previous = self.previous.get(key)
+        if previous is None:
+            self.current.pop(key, None)
+        else:
+            self.current[key] = previous
+
+    def removed(self):
+        """ returns the item id keys of the previous run which no longer appear """
+        removed = [key for key in self.previous if key not in self.current]
+        self.counts[CHANGE_REMOVED] = len(removed)
+        return removed
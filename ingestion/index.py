@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+index
+----------------------------------
+Sidecar index mapping item ids to the byte offset and length of each record in a converted json or json
+lines file, or in the source csv file, so single items can be read without parsing the whole file
+"""
+
+import json
+import locale
+import mmap
+import os
+import struct
+from array import array
+
+from ingestion import file_io
+from ingestion import parser
+from ingestion import validate
+
+# suffix of the sidecar index written alongside an indexed file
+INDEX_SUFFIX = '.idx'
+
+KIND_JSON = 0
+KIND_CSV = 1
+
+# magic and kind of the indexed file, followed by (id, offset, length) entries sorted by id then offset
+HEADER = struct.Struct('<8sB7x')
+ENTRY = struct.Struct('<qQI')
+MAGIC = b'INVIDX01'
+
+
+def index_file(file):
+    """ Returns the path of the sidecar index of a file """
+    return file + INDEX_SUFFIX
+
+
+def write_json_index(file, output=None):
+    """ Indexes the id of each element of a json array or line of json lines, returning the count """
+    entries = ((value.get('id'), offset, length)
+               for offset, length, value in file_io.iter_json_records(file) if isinstance(value, dict))
+    return write_index(output or index_file(file), KIND_JSON, entries)
+
+
+def write_csv_index(file, encoding=None, output=None):
+    """ Indexes the item id of each record of a csv file, returning the count """
+    records = file_io.iter_csv_records(file, encoding)
+    header = next(records, (0, 0, []))[2]
+    id_index = parser.compile_parse_plan(header).index_of('id')
+
+    if id_index is None:
+        raise ValueError('%s has no item id column' % file)
+
+    entries = ((validate.is_valid_int(row[id_index].replace('$', '')) if id_index < len(row) else None,
+                offset, length) for offset, length, row in records)
+    return write_index(output or index_file(file), KIND_CSV, entries)
+
+
+def write_index(output, kind, entries):
+    """ Writes (id, offset, length) entries as a sidecar index sorted by id, skipping non-int ids """
+    ids = array('q')
+    offsets = array('Q')
+    lengths = array('I')
+
+    for id, offset, length in entries:
+        if isinstance(id, int) and not isinstance(id, bool) and -2 ** 63 <= id < 2 ** 63:
+            ids.append(id)
+            offsets.append(offset)
+            lengths.append(length)
+
+    # entries are read in file order so a stable sort keeps duplicate ids in the order they were written
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+
+    with open(output + '.tmp', 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, kind))
+        for start in range(0, len(order), 65536):
+            chunk = order[start:start + 65536]
+            block = bytearray(ENTRY.size * len(chunk))
+            for position, entry in enumerate(chunk):
+                ENTRY.pack_into(block, position * ENTRY.size, ids[entry], offsets[entry], lengths[entry])
+            outfile.write(block)
+    os.replace(output + '.tmp', output)
+
+    return len(ids)
+
+
+class IdIndex(object):
+    """ Reads single items from an indexed file, seeking to their records through the sidecar index
+
+    Items are returned as the dicts of the json output: records of a json file are deserialised as they
+    are, and records of a csv file are parsed and serialised as the conversion would. Where an id appears
+    more than once the last record is returned.
+    """
+
+    def __init__(self, file, encoding=None):
+        self.file = file
+        self.encoding = encoding
+        self.kind = None
+        self.count = 0
+        self._index = None
+        self._infile = None
+        self._plan = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """ maps the sidecar index into memory and opens the indexed file """
+        with open(index_file(self.file), 'rb') as infile:
+            self._index = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.kind = HEADER.unpack_from(self._index)
+        if magic != MAGIC:
+            raise ValueError('%s is not an id index' % index_file(self.file))
+
+        self.count = (len(self._index) - HEADER.size) // ENTRY.size
+        self._infile = open(self.file, 'rb')
+
+        if self.kind == KIND_CSV:
+            header = next(file_io.iter_csv_records(self.file, self.encoding), (0, 0, []))[2]
+            self._plan = parser.compile_parse_plan(header)
+
+    def lookup(self, id):
+        """ returns the item with an id, otherwise none """
+        entry = self.__find(id)
+        return None if entry is None else self.__read(*entry)
+
+    def lookup_many(self, ids):
+        """ returns the items found for many ids keyed by id, reading their records in file order """
+        found = ((id, self.__find(id)) for id in set(ids))
+        entries = [(entry, id) for id, entry in found if entry is not None]
+        return {id: self.__read(*entry) for entry, id in sorted(entries)}
+
+    def close(self):
+        """ closes the sidecar index and the indexed file """
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._infile is not None:
+            self._infile.close()
+            self._infile = None
+
+    def __find(self, id):
+        """ returns the (offset, length) of the last record of an id by binary search, otherwise none """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(self._index, HEADER.size + middle * ENTRY.size)[0] <= id:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == 0:
+            return None
+
+        entry_id, offset, length = ENTRY.unpack_from(self._index, HEADER.size + (low - 1) * ENTRY.size)
+        return (offset, length) if entry_id == id else None
+
+    def __read(self, offset, length):
+        """ reads and deserialises the record at an offset """
+        self._infile.seek(offset)
+        data = self._infile.read(length)
+
+        if self.kind == KIND_JSON:
+            return json.loads(data)
+
+        row = file_io.read_csv_text(data.decode(self.encoding or locale.getpreferredencoding(False)))[0]
+        return json.loads(file_io.output_json_element(self._plan.parse(row), compact=True))
@@ -7,19 +7,71 @@ models
 Models store record state during parsing and serialisation to other formats.
 """
 
+from array import array
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# null flags packed into a single byte per inventory batch row
+NULL_ID = 1
+NULL_PRICE = 2
+NULL_COST = 4
+NULL_QUANTITY_ON_HAND = 8
+
+# flags of an inventory batch row whose price or cost is held in cents
+CENTS_PRICE = 16
+CENTS_COST = 32
+
+# field flags packed into a single byte per inventory batch modifier
+MODIFIER_NAME = 1
+MODIFIER_PRICE = 2
+MODIFIER_PRICE_FIRST = 4
+MODIFIER_PRICE_CENTS = 8
+
+# largest number of cents held exactly by the float arrays of an inventory batch
+MAX_EXACT_CENTS = 2 ** 53
+
+# how prices and costs are parsed and written: as floats, or as integer cents written as decimals
+# or as cents
+MONEY_FLOAT = 'float'
+MONEY_DECIMAL = 'decimal'
+MONEY_CENTS = 'cents'
+MONEY_FORMATS = (MONEY_FLOAT, MONEY_DECIMAL, MONEY_CENTS)
+
+# value of a lazy inventory item property which has not been converted yet
+UNPARSED = object()
+
+
+class Cents(int):
+    """ Amount of money held exactly as a whole number of cents
+
+    Arithmetic on cents returns plain integers, so totals are summed without the rounding of floats.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Cents(%d)' % self
+
 
 class InventoryItem(object):
     """ Inventory Item Model """
 
+    FIELDS = ('id', 'price', 'description', 'cost', 'price_type', 'quantity_on_hand', 'modifiers')
+
+    __slots__ = ('_id', '_price', '_description', '_cost', '_price_type', '_quantity_on_hand',
+                 '_modifiers', '_extras')
+
     def __init__(self, id=None, price=None, description=None, cost=None, price_type=None,
-                 quantity_on_hand=None, modifiers=[]):
+                 quantity_on_hand=None, modifiers=None):
         self._id = id
         self._price = price
         self._description = description
         self._cost = cost
         self._price_type = price_type
         self._quantity_on_hand = quantity_on_hand
-        self._modifiers = modifiers
+        self._modifiers = [] if modifiers is None else modifiers
+        self._extras = None
 
     @property
     def id(self):
@@ -90,3 +142,278 @@ class InventoryItem(object):
     def modifiers(self, modifiers):
         """ set modifiers property """
         self._modifiers = modifiers
+
+    @property
+    def extras(self):
+        """ get values of columns which do not map to a model property """
+        return self._extras
+
+    def set_extra(self, key, value):
+        """ stores the value of a column which does not map to a model property """
+        if self._extras is None:
+            self._extras = {}
+        self._extras[key] = value
+
+    def to_dict(self):
+        """ returns all properties (including extra columns) keyed by name """
+        values = {
+            'id': self.id,
+            'price': self.price,
+            'description': self.description,
+            'cost': self.cost,
+            'price_type': self.price_type,
+            'quantity_on_hand': self.quantity_on_hand,
+            'modifiers': self.modifiers
+        }
+
+        if self.extras:
+            values.update(self.extras)
+
+        return values
+
+
+def _lazy_property(attribute):
+    """ Returns a property converting a field of a lazy inventory item's raw row when first accessed """
+    slot = '_' + attribute
+
+    def getter(self):
+        value = getattr(self, slot)
+        if value is UNPARSED:
+            value = self._plan.parse_field(self._row, attribute)
+            setattr(self, slot, value)
+        return value
+
+    def setter(self, value):
+        setattr(self, slot, value)
+
+    return property(getter, setter, doc='get %s property, converting it when first accessed' % attribute)
+
+
+class LazyInventoryItem(InventoryItem):
+    """ Inventory Item Model holding a raw csv row and the parse plan of its header
+
+    Each property is converted by the plan when it is first accessed and then cached, so items which
+    are only filtered on a few properties skip converting the rest. Values failing sanitisation are
+    counted by the plan, and validation errors raised, when the property is first accessed.
+    """
+
+    __slots__ = ('_row', '_plan')
+
+    def __init__(self, plan, row):
+        super().__init__(UNPARSED, UNPARSED, UNPARSED, UNPARSED, UNPARSED, UNPARSED, UNPARSED)
+        self._extras = UNPARSED
+        self._row = row
+        self._plan = plan
+
+    id = _lazy_property('id')
+    price = _lazy_property('price')
+    description = _lazy_property('description')
+    cost = _lazy_property('cost')
+    price_type = _lazy_property('price_type')
+    quantity_on_hand = _lazy_property('quantity_on_hand')
+    modifiers = _lazy_property('modifiers')
+
+    @property
+    def extras(self):
+        """ get values of columns not mapping to a model property, converting them on first access """
+        if self._extras is UNPARSED:
+            self._extras = self._plan.parse_extras(self._row)
+        return self._extras
+
+    def set_extra(self, key, value):
+        """ stores the value of a column which does not map to a model property """
+        if self._extras is UNPARSED:
+            self._extras = self._plan.parse_extras(self._row)
+        super().set_extra(key, value)
+
+
+class StringDictionary(object):
+    """ Dictionary encoding of repeated strings as integer codes, with code zero holding none """
+
+    def __init__(self):
+        self.values = [None]
+        self._codes = {None: 0}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """ returns the code of a string, adding it to the dictionary when first seen """
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def decode(self, code):
+        """ returns the string of a code """
+        return self.values[code]
+
+
+class InventoryBatch(object):
+    """ Columnar container holding inventory items in typed arrays
+
+    Low cardinality strings, price types and modifier names, are dictionary encoded as codes.
+    """
+
+    def __init__(self, items=()):
+        self._ids = array('q')
+        self._prices = array('d')
+        self._costs = array('d')
+        self._quantities = array('q')
+        self._nulls = bytearray()
+        self._descriptions = []
+        self._price_types = array('I')
+        self._modifier_offsets = array('Q', [0])
+        self._modifier_names = array('I')
+        self._dictionary = StringDictionary()
+        self._modifier_prices = array('d')
+        self._modifier_flags = bytearray()
+
+        # rows whose values cannot be packed into the typed arrays are kept as models
+        self._fallback = {}
+
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self._nulls)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('inventory batch index out of range')
+
+        if index in self._fallback:
+            return self._fallback[index]
+
+        nulls = self._nulls[index]
+        price = None if nulls & NULL_PRICE else self._prices[index]
+        cost = None if nulls & NULL_COST else self._costs[index]
+
+        if nulls & (CENTS_PRICE | CENTS_COST):
+            price = Cents(price) if nulls & CENTS_PRICE else price
+            cost = Cents(cost) if nulls & CENTS_COST else cost
+
+        quantity_on_hand = None if nulls & NULL_QUANTITY_ON_HAND else self._quantities[index]
+
+        return InventoryItem(id=None if nulls & NULL_ID else self._ids[index],
+                             price=price,
+                             description=self._descriptions[index],
+                             cost=cost,
+                             price_type=self._dictionary.values[self._price_types[index]],
+                             quantity_on_hand=quantity_on_hand,
+                             modifiers=self.__unpack_modifiers(index))
+
+    def append(self, item):
+        """ packs an inventory item into the columnar arrays """
+        modifiers = _pack_modifiers(item.modifiers)
+
+        if modifiers is None or not _packable(item):
+            self._fallback[len(self)] = item
+            self.__append_row(0, 0, None, 0.0, 0.0, 0, None, ())
+            return
+
+        nulls = ((NULL_ID if item.id is None else 0) | (NULL_PRICE if item.price is None else 0) |
+                 (NULL_COST if item.cost is None else 0) |
+                 (NULL_QUANTITY_ON_HAND if item.quantity_on_hand is None else 0) |
+                 (CENTS_PRICE if type(item.price) is Cents else 0) |
+                 (CENTS_COST if type(item.cost) is Cents else 0))
+
+        self.__append_row(nulls, item.id or 0, item.description, item.price or 0.0, item.cost or 0.0,
+                          item.quantity_on_hand or 0, item.price_type, modifiers)
+
+    def __append_row(self, nulls, id, description, price, cost, quantity_on_hand, price_type, modifiers):
+        """ appends one value to every column """
+        self._nulls.append(nulls)
+        self._ids.append(id)
+        self._descriptions.append(description)
+        self._prices.append(price)
+        self._costs.append(cost)
+        self._quantities.append(quantity_on_hand)
+        self._price_types.append(self._dictionary.encode(price_type))
+
+        for flags, name, modifier_price in modifiers:
+            self._modifier_flags.append(flags)
+            self._modifier_names.append(self._dictionary.encode(name))
+            self._modifier_prices.append(modifier_price)
+
+        self._modifier_offsets.append(len(self._modifier_flags))
+
+    def __unpack_modifiers(self, index):
+        """ rebuilds the modifier dictionaries of a row from the flat modifier arrays """
+        modifiers = []
+
+        for position in range(self._modifier_offsets[index], self._modifier_offsets[index + 1]):
+            flags = self._modifier_flags[position]
+            modifier = {}
+
+            price = self._modifier_prices[position]
+            if flags & MODIFIER_PRICE_CENTS:
+                price = Cents(price)
+
+            if flags & MODIFIER_PRICE and flags & MODIFIER_PRICE_FIRST:
+                modifier['price'] = price
+            if flags & MODIFIER_NAME:
+                modifier['name'] = self._dictionary.values[self._modifier_names[position]]
+            if flags & MODIFIER_PRICE and not flags & MODIFIER_PRICE_FIRST:
+                modifier['price'] = price
+
+            modifiers.append(modifier)
+
+        return modifiers
+
+
+def _packable(item):
+    """ Returns true if the item properties fit the typed arrays of an inventory batch """
+    return (type(item) is InventoryItem and item.extras is None and
+            _is_int64(item.id) and _is_int64(item.quantity_on_hand) and
+            _is_money(item.price) and _is_money(item.cost) and
+            (item.description is None or type(item.description) is str) and
+            (item.price_type is None or type(item.price_type) is str))
+
+
+def _pack_modifiers(modifiers):
+    """ Returns modifiers as (flags, name, price) tuples, otherwise none if they cannot be packed """
+    if type(modifiers) is not list:
+        return None
+
+    packed = []
+
+    for modifier in modifiers:
+        if type(modifier) is not dict or not modifier.keys() <= {'name', 'price'}:
+            return None
+
+        name = modifier.get('name')
+        price = modifier.get('price', 0.0)
+
+        if (name is not None and type(name) is not str) or price is None or not _is_money(price):
+            return None
+
+        flags = ((MODIFIER_NAME if 'name' in modifier else 0) |
+                 (MODIFIER_PRICE if 'price' in modifier else 0))
+        if 'price' in modifier and next(iter(modifier)) == 'price':
+            flags |= MODIFIER_PRICE_FIRST
+        if type(price) is Cents:
+            flags |= MODIFIER_PRICE_CENTS
+
+        packed.append((flags, name, price))
+
+    return packed
+
+
+def _is_int64(value):
+    """ Returns true if value is none or an integer within the signed 64 bit range """
+    return value is None or (type(value) is int and INT64_MIN <= value <= INT64_MAX)
+
+
+def _is_money(value):
+    """ Returns true if value is none, a float or cents held exactly by a float """
+    if value is None or type(value) is float:
+        return True
+    return type(value) is Cents and -MAX_EXACT_CENTS <= value <= MAX_EXACT_CENTS
@@ -7,6 +7,10 @@ parser
 Handles parsing and sanitisation of records to item models
 """
 
+import operator
+import re
+import sys
+
 from ingestion import validate
 from ingestion import models
 
@@ -20,6 +24,28 @@ ITEM_SANITISATION = {
     'price_type': validate.is_valid_price_type
 }
 
+# sanitisation holding prices and costs as integer cents
+CENTS_SANITISATION = dict(ITEM_SANITISATION, price=validate.is_valid_cents, cost=validate.is_valid_cents)
+
+# fields whose few distinct values repeat across rows, so their sanitisation is memoized per file
+CACHED_FIELDS = ('description', 'price_type')
+
+# maximum number of distinct raw values memoized for each column before its cache is cleared
+CACHE_SIZE = 4096
+
+_MISSING = object()
+
+# comparisons of the row predicates, longest operators first so >= is not read as >
+PREDICATE_OPERATORS = {
+    '>=': operator.ge,
+    '<=': operator.le,
+    '!=': operator.ne,
+    '=': operator.eq,
+    '>': operator.gt,
+    '<': operator.lt
+}
+PREDICATE_PATTERN = re.compile(r'^\s*([^<>=!]+?)\s*(>=|<=|!=|=|>|<)\s*(.*?)\s*$')
+
 
 def parse_inventory_item(record):
     """ Converts a csv inventory item record to a inventory item model """
@@ -29,7 +55,7 @@ def parse_inventory_item(record):
     item = models.InventoryItem()
     modifier_map = {}
 
-    for key in record:
+    for key in list(record):
         # handles parsing of item id field name to id
         if key == 'item id':
             record['id'] = record[key]
@@ -49,7 +75,7 @@ def parse_inventory_item(record):
         elif 'modifier_' in key:
             modifier_map = __create_update_price_modifiers(key, record[key], modifier_map)
         else:
-            setattr(item, validate.enforce_key_consistency(key), record[key])
+            __set_field(item, validate.enforce_key_consistency(key), record[key])
 
     # updates modifiers when all keys have been parsed
     modifiers = [modifier_map[key] for key in modifier_map]
@@ -58,6 +84,14 @@ def parse_inventory_item(record):
     return item
 
 
+def __set_field(item, attribute, value):
+    """ Sets a model property, storing columns without a matching property as extras """
+    if attribute in models.InventoryItem.FIELDS:
+        setattr(item, attribute, value)
+    else:
+        item.set_extra(attribute, value)
+
+
 def __create_update_price_modifiers(key, value, modifier_map):
     """ Handles creation and updating of price modifier map """
     (_, identifier, field_name) = validate.regex_match_modifiers(key)
@@ -73,3 +107,308 @@ def __create_update_price_modifiers(key, value, modifier_map):
         modifier_map[identifier] = modifier
 
     return modifier_map
+
+
+def compile_parse_plan(header, projection=None, predicates=(), money=models.MONEY_FLOAT):
+    """ Compiles a parse plan from a csv header row so it can be reused for every row """
+    return ParsePlan(header, projection, predicates, money)
+
+
+def parse_predicate(text):
+    """ Splits a predicate such as price_type=open into (attribute, operator, value) """
+    match = PREDICATE_PATTERN.match(text)
+    if match is None:
+        raise ValueError('Unsupported predicate %r, expected e.g. price_type=open or cost>0' % text)
+
+    attribute, comparison, value = match.groups()
+    return _attribute_name(attribute), comparison, value
+
+
+def _attribute_name(key):
+    """ Returns the model property or extra name of a csv column or property name """
+    return 'id' if key in ('item id', 'item_id') else validate.enforce_key_consistency(key)
+
+
+class ParsePlan(object):
+    """ Column index to converter and attribute mapping resolved once per csv header
+
+    A projection limits the properties parsed to a list of property names, and predicates limit the rows
+    parsed to those matching every predicate, each converting only the column it tests. Prices and costs,
+    including those of modifiers, are parsed as floats unless money is a format holding integer cents.
+    """
+
+    def __init__(self, header, projection=None, predicates=(), money=models.MONEY_FLOAT):
+        if money not in models.MONEY_FORMATS:
+            raise ValueError('Unsupported money format %s' % money)
+
+        self.header = list(header)
+        self.money = money
+        self.fields = []
+        self.extras = []
+        self.modifiers = []
+        self.invalid = {}
+        self.projection = None
+        self.predicates = []
+        self._attributes = {}
+
+        sanitisation = ITEM_SANITISATION if money == models.MONEY_FLOAT else CENTS_SANITISATION
+        modifier_converter = convert_modifier if money == models.MONEY_FLOAT else convert_modifier_cents
+
+        for index, key in enumerate(self.header):
+            # handles parsing of item id field name to id
+            if key == 'item id':
+                key = 'id'
+
+            if key in sanitisation:
+                converter = sanitisation[key]
+                if key in CACHED_FIELDS:
+                    converter = ValueCache(converter)
+                self.fields.append((index, converter, validate.enforce_key_consistency(key)))
+            elif 'modifier_' in key:
+                (_, identifier, field_name) = validate.regex_match_modifiers(key)
+                self.modifiers.append((index, identifier, field_name, ValueCache(modifier_converter)))
+            elif validate.enforce_key_consistency(key) in models.InventoryItem.FIELDS:
+                self.fields.append((index, None, validate.enforce_key_consistency(key)))
+            else:
+                self.extras.append((index, validate.enforce_key_consistency(key)))
+
+        # later columns mapping to the same property take precedence, as when parse sets them in turn
+        for index, attribute in self.extras:
+            self._attributes[attribute] = (index, None)
+        for index, converter, attribute in self.fields:
+            self._attributes[attribute] = (index, converter)
+
+        for predicate in predicates:
+            self.__add_predicate(*parse_predicate(predicate))
+        if projection is not None:
+            self.__project(projection)
+
+    def __add_predicate(self, attribute, comparison, value):
+        """ Compiles a predicate, converting its value with the sanitisation of the column it tests """
+        field = self._attributes.get(attribute)
+        if field is None:
+            raise ValueError('Predicate column %s is not a column of the csv header' % attribute)
+
+        index, converter = field
+        if value == '':
+            value = None
+        elif converter is not None:
+            try:
+                value = converter(value.replace('$', ''))
+            except validate.ValidationError as error:
+                raise ValueError('Unsupported predicate value for %s: %s' % (attribute, error))
+            if value is None:
+                raise ValueError('Unsupported predicate value for %s' % attribute)
+
+        self.predicates.append((index, attribute, PREDICATE_OPERATORS[comparison], value))
+
+    def __project(self, projection):
+        """ Limits the properties parsed to the projected property names """
+        self.projection = [_attribute_name(attribute) for attribute in projection]
+
+        for attribute in self.projection:
+            if attribute not in models.InventoryItem.FIELDS and attribute not in self._attributes:
+                raise ValueError('Projected column %s is not a property or header column' % attribute)
+
+        self.fields = [field for field in self.fields if field[2] in self.projection]
+        self.extras = [extra for extra in self.extras if extra[1] in self.projection]
+        if 'modifiers' not in self.projection:
+            self.modifiers = []
+
+    @property
+    def columns(self):
+        """ Returns the sorted indexes of the columns read when parsing or filtering a row """
+        return sorted(set([index for index, _, _ in self.fields] + [index for index, _ in self.extras] +
+                          [index for index, _, _, _ in self.modifiers] +
+                          [index for index, _, _, _ in self.predicates]))
+
+    def index_of(self, attribute):
+        """ Returns the column index of a model property, otherwise none """
+        for index, _, field in self.fields:
+            if field == attribute:
+                return index
+        return None
+
+    def parse(self, row):
+        """ Converts a csv row list to an inventory item model """
+        item = models.InventoryItem()
+        length = len(row)
+
+        for index, converter, attribute in self.fields:
+            value = row[index] if index < length else None
+
+            # handles removal of currency symbol from value before sanitisation
+            if converter is not None:
+                text = 'None' if value is None else value.replace('$', '')
+                value = converter(text)
+                if value is None and text and index < length:
+                    self.__count_invalid(index, 1)
+
+            setattr(item, attribute, value)
+
+        for index, attribute in self.extras:
+            item.set_extra(attribute, row[index] if index < length else None)
+
+        item.modifiers = self.parse_modifiers(row, length)
+
+        return item
+
+    def matches(self, row):
+        """ Returns true if a csv row list matches every predicate, converting only the columns tested
+
+        Invalid values are counted as the row is parsed, so a column is not counted twice if projected.
+        """
+        for _, attribute, comparison, value in self.predicates:
+            field = self.__convert_field(row, attribute, False)
+
+            if value is None or field is None:
+                if comparison not in (operator.eq, operator.ne) or not comparison(field, value):
+                    return False
+            elif not comparison(field, value):
+                return False
+
+        return True
+
+    def project(self, item):
+        """ Returns the projected properties of a model as a dict """
+        values = {}
+
+        for attribute in self.projection:
+            if attribute in models.InventoryItem.FIELDS:
+                values[attribute] = getattr(item, attribute)
+            else:
+                values[attribute] = (item.extras or {}).get(attribute)
+
+        return values
+
+    def parse_lazy(self, row):
+        """ Wraps a csv row list in an item model converting each property when first accessed """
+        return models.LazyInventoryItem(self, row)
+
+    def parse_field(self, row, attribute):
+        """ Converts a single model property of a csv row list, as parse would """
+        if attribute == 'modifiers':
+            return self.parse_modifiers(row, len(row))
+        return self.__convert_field(row, attribute, True)
+
+    def __convert_field(self, row, attribute, count):
+        """ converts the column of a property in a csv row list, optionally counting an invalid value """
+        field = self._attributes.get(attribute)
+        if field is None:
+            return None
+
+        index, converter = field
+        value = row[index] if index < len(row) else None
+
+        if converter is not None:
+            text = 'None' if value is None else value.replace('$', '')
+            value = converter(text)
+            if count and value is None and text and index < len(row):
+                self.__count_invalid(index, 1)
+
+        return value
+
+    def parse_id(self, row):
+        """ Converts the item id of a csv row list without counting an invalid value, e.g. to sort """
+        return self.__convert_field(row, 'id', False)
+
+    def parse_extras(self, row):
+        """ Returns the columns of a csv row list not mapping to a model property, otherwise none """
+        if not self.extras:
+            return None
+
+        length = len(row)
+        return {attribute: row[index] if index < length else None for index, attribute in self.extras}
+
+    def parse_modifiers(self, row, length):
+        """ Builds the list of price modifiers from the modifier columns of a csv row """
+        modifier_map = {}
+
+        for index, identifier, field_name, cache in self.modifiers:
+            if index >= length:
+                break
+
+            value = cache(row[index])
+            if value is None:
+                if row[index].replace('$', ''):
+                    self.__count_invalid(index, 1)
+                continue
+
+            modifier = modifier_map.get(identifier)
+            if modifier is None:
+                modifier = modifier_map[identifier] = {}
+            modifier[field_name] = value
+
+        return list(modifier_map.values())
+
+    def cache_counts(self):
+        """ Returns the (hits, misses) of the memoized sanitisation of each cached column """
+        caches = [(index, converter) for index, converter, _ in self.fields
+                  if isinstance(converter, ValueCache)]
+        caches += [(index, cache) for index, _, _, cache in self.modifiers]
+        return {self.header[index]: (cache.hits, cache.misses) for index, cache in caches}
+
+    def count_invalid(self, index, values, converted):
+        """ Counts the non-empty values of a column converted in bulk which failed sanitisation """
+        if None not in converted:
+            return
+
+        count = sum(1 for value, result in zip(values, converted)
+                    if result is None and value and value.replace('$', ''))
+        self.__count_invalid(index, count)
+
+    def __count_invalid(self, index, count):
+        """ Adds to the count of values failing sanitisation in a column """
+        if count:
+            column = self.header[index]
+            self.invalid[column] = self.invalid.get(column, 0) + count
+
+
+def convert_modifier(value):
+    """ Returns a modifier value, alpha strings kept as is and prices as floats, otherwise none """
+    if value.isalpha():
+        return value
+    return validate.is_valid_float(value.replace('$', ''))
+
+
+def convert_modifier_cents(value):
+    """ Returns a modifier value, alpha strings as is and prices as integer cents, otherwise none """
+    if value.isalpha():
+        return value
+    return validate.is_valid_cents(value)
+
+
+class ValueCache(object):
+    """ Bounded memo of a converter's results for repeated raw values
+
+    Every row holding the same raw value shares one result, and string results are interned so values
+    converted again after the cache is cleared are still shared.
+    """
+
+    def __init__(self, converter, max_size=CACHE_SIZE):
+        self.converter = converter
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+
+    def __call__(self, value):
+        result = self._values.get(value, _MISSING)
+        if result is _MISSING:
+            return self.__convert(value)
+
+        self.hits += 1
+        return result
+
+    def __convert(self, value):
+        """ converts and memoizes a value, clearing the memo when it is full """
+        self.misses += 1
+        result = self.converter(value)
+        if type(result) is str:
+            result = sys.intern(result)
+
+        if len(self._values) >= self.max_size:
+            self._values.clear()
+        self._values[value] = result
+
+        return result
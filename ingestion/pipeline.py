@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pipeline
+----------------------------------
+Threads running the stages of a conversion concurrently, connected by bounded queues which hold back
+a fast stage once the next one falls behind, recording how long each stage waits on its queues
+"""
+
+import queue
+import sys
+import threading
+import time
+
+# seconds between checks of whether the pipeline has stopped while a stage waits on a queue
+POLL_INTERVAL = 0.1
+
+
+class PipelineStopped(Exception):
+    """ Raised within a stage waiting on a queue once another stage has failed """
+    pass
+
+
+class Pipeline(object):
+    """ Runs stage functions in threads connected by queues of depth items
+
+    The time each stage spends blocked on a queue, waiting for input or for room to queue its output,
+    is recorded in waits keyed by stage name: the stage waiting least is the bottleneck. When a stage
+    raises, the others stop at their next queue operation and join re-raises the error.
+    """
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.waits = {}
+        self._stopped = threading.Event()
+        self._errors = []
+        self._threads = []
+
+    def queue(self):
+        """ returns a queue holding at most depth items """
+        return queue.Queue(self.depth)
+
+    def start(self, stage, target, *args):
+        """ runs target(*args) in a thread as the named stage """
+        self.waits.setdefault(stage, 0.0)
+        thread = threading.Thread(target=self.__run, args=(target, args), name=stage, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def get(self, stage, items):
+        """ returns the next item of a queue, recording the time the stage waits for it """
+        return self.__wait(stage, items.get)
+
+    def put(self, stage, items, item):
+        """ queues an item, recording the time the stage waits for room """
+        self.__wait(stage, lambda timeout: items.put(item, timeout=timeout))
+
+    def join(self):
+        """ waits for every stage to finish, re-raising the first error of a failed stage """
+        for thread in self._threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def __wait(self, stage, operation):
+        """ retries a blocking queue operation until it succeeds or the pipeline stops """
+        start = time.perf_counter()
+        try:
+            while True:
+                if self._stopped.is_set():
+                    raise PipelineStopped()
+                try:
+                    return operation(timeout=POLL_INTERVAL)
+                except (queue.Empty, queue.Full):
+                    continue
+        finally:
+            self.waits[stage] += time.perf_counter() - start
+
+    def __run(self, target, args):
+        """ runs a stage, stopping the other stages if it fails """
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except BaseException:  # pylint: disable=broad-except
+            self._errors.append(sys.exc_info()[1])
+            self._stopped.set()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+serialiser
+----------------------------------
+Serialises models to json without the json encoder callbacks, producing the same output as
+json.dumps(..., cls=CustomModelEncoder, sort_keys=True)
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+
+from ingestion import models
+
+# item properties in the order they are serialised when keys are sorted
+ITEM_KEYS = tuple(sorted(models.InventoryItem.FIELDS))
+
+# models serialised from their properties in the order of ITEM_KEYS
+ITEM_TYPES = (models.InventoryItem, models.LazyInventoryItem)
+
+# json representations of the floats whose repr is not valid json
+FLOAT_CONSTANTS = {
+    'nan': 'NaN',
+    'inf': 'Infinity',
+    '-inf': '-Infinity'
+}
+
+
+class ModelSerialiser(object):
+    """ Serialises models, lists, dicts and json primitives with keys sorted
+
+    Cents are written as decimals when money is the decimal format, as in the csv input, and otherwise as
+    integers, exactly as they are held.
+    """
+
+    def __init__(self, indent=2, money=models.MONEY_FLOAT):
+        if money not in models.MONEY_FORMATS:
+            raise ValueError('Unsupported money format %s' % money)
+
+        self.indent = indent
+        self.money = money
+        self.key_separator = ':' if indent is None else ': '
+        self.encoders = dict(SCALAR_ENCODERS)
+        self.encoders[models.Cents] = encode_cents if money == models.MONEY_DECIMAL else int.__repr__
+
+        # the json C encoder writes cents as plain integers, so decimals are formatted here
+        self._native = indent is None and money != models.MONEY_DECIMAL
+        self._newlines = {}
+        self._item_templates = {}
+        self._modifier_templates = {}
+
+    def dumps(self, value, level=0):
+        """ Returns the json representation of value nested level indents deep """
+        # without indentation the json module uses its C encoder, which is quicker than formatting here
+        if self._native:
+            return self._encode_json(value, level)
+
+        encoder = self.encoders.get(type(value))
+        if encoder is not None:
+            return encoder(value)
+
+        if type(value) in ITEM_TYPES:
+            return self._encode_item(value, level)
+        if isinstance(value, dict):
+            return self._encode_dict(value, level)
+        if isinstance(value, (list, tuple)):
+            return self._encode_list(value, level)
+        if isinstance(value, str):
+            return encode_basestring_ascii(value)
+        if isinstance(value, int):
+            return int.__repr__(value)
+        if isinstance(value, float):
+            return encode_float(value)
+
+        return self.dumps(default(value), level)
+
+    def _newline(self, level):
+        """ Returns the line break and indentation preceding a value nested level indents deep """
+        newline = self._newlines.get(level)
+        if newline is None:
+            newline = '' if self.indent is None else '\n' + ' ' * (self.indent * level)
+            self._newlines[level] = newline
+        return newline
+
+    def _item_template(self, level):
+        """ Returns the format string of an inventory item with its keys in sorted order """
+        template = self._item_templates.get(level)
+        if template is None:
+            newline = self._newline(level + 1)
+            fields = [encode_basestring_ascii(key) + self.key_separator + '%s' for key in ITEM_KEYS]
+            template = '{' + newline + (',' + newline).join(fields) + self._newline(level) + '}'
+            self._item_templates[level] = template
+        return template
+
+    def _encode_item(self, item, level):
+        """ Returns an inventory item using the precomputed sorted key order """
+        if item.extras:
+            return self._encode_dict(item.to_dict(), level)
+
+        level += 1
+        encoders = self.encoders
+        values = []
+
+        for value in (item.cost, item.description, item.id):
+            encoder = encoders.get(type(value))
+            values.append(encoder(value) if encoder is not None else self.dumps(value, level))
+
+        values.append(self._encode_modifiers(item.modifiers, level))
+
+        for value in (item.price, item.price_type, item.quantity_on_hand):
+            encoder = encoders.get(type(value))
+            values.append(encoder(value) if encoder is not None else self.dumps(value, level))
+
+        return self._item_template(level - 1) % tuple(values)
+
+    def _encode_modifiers(self, modifiers, level):
+        """ Returns a list of modifiers, formatting each dict from a template cached by its keys """
+        if type(modifiers) is not list:
+            return self.dumps(modifiers, level)
+        if not modifiers:
+            return '[]'
+
+        encoders = self.encoders
+        elements = []
+
+        for modifier in modifiers:
+            template = None
+            if type(modifier) is dict:
+                template = self._modifier_templates.get((level, tuple(modifier)))
+            if template is None:
+                elements.append(self._encode_modifier(modifier, level + 1))
+                continue
+
+            keys, template = template
+            values = []
+            for key in keys:
+                value = modifier[key]
+                encoder = encoders.get(type(value))
+                values.append(encoder(value) if encoder is not None else self.dumps(value, level + 2))
+            elements.append(template % tuple(values))
+
+        newline = self._newline(level + 1)
+        return '[' + newline + (',' + newline).join(elements) + self._newline(level) + ']'
+
+    def _encode_modifier(self, modifier, level):
+        """ Returns a single modifier, caching a template for dicts with string keys """
+        if type(modifier) is dict and modifier and all(type(key) is str for key in modifier):
+            keys = sorted(modifier)
+            newline = self._newline(level + 1)
+            fields = [encode_basestring_ascii(key).replace('%', '%%') + self.key_separator + '%s'
+                      for key in keys]
+            template = '{' + newline + (',' + newline).join(fields) + self._newline(level) + '}'
+            self._modifier_templates[(level - 1, tuple(modifier))] = (keys, template)
+
+        return self.dumps(modifier, level)
+
+    def _encode_dict(self, value, level):
+        """ Returns a dict with its keys sorted """
+        if not value:
+            return '{}'
+
+        if not all(isinstance(key, str) for key in value):
+            return self._encode_json(value, level)
+
+        newline = self._newline(level + 1)
+        separator = self.key_separator
+        encoders = self.encoders
+        items = []
+
+        # scalars and lists of dicts, such as a projected item's modifiers, skip the dispatch of dumps
+        for key in sorted(value):
+            element = value[key]
+            encoder = encoders.get(type(element))
+            if encoder is not None:
+                element = encoder(element)
+            elif type(element) is list:
+                element = self._encode_modifiers(element, level + 1)
+            else:
+                element = self.dumps(element, level + 1)
+            items.append(encode_basestring_ascii(key) + separator + element)
+
+        return '{' + newline + (',' + newline).join(items) + self._newline(level) + '}'
+
+    def _encode_json(self, value, level):
+        """ Returns a value encoded by the json module, for compact output or dicts of converted keys """
+        data = json.dumps(value, default=default, sort_keys=True, indent=self.indent,
+                          separators=(',', self.key_separator), check_circular=False)
+        return data if self.indent is None else data.replace('\n', self._newline(level))
+
+    def _encode_list(self, value, level):
+        """ Returns a list or tuple """
+        if not value:
+            return '[]'
+
+        newline = self._newline(level + 1)
+        elements = [self.dumps(element, level + 1) for element in value]
+
+        return '[' + newline + (',' + newline).join(elements) + self._newline(level) + ']'
+
+
+def encode_float(value):
+    """ Returns the json representation of a float, matching the json module """
+    text = float.__repr__(value)
+    return FLOAT_CONSTANTS.get(text, text)
+
+
+def encode_cents(value):
+    """ Returns the json of cents as a decimal, matching the float parsed from the same text """
+    return encode_float(value / 100)
+
+
+def default(value):
+    """ Converts an unsupported object to a serialisable value, matching CustomModelEncoder """
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if hasattr(value, '__iter__'):
+        return list(value)
+    return {key.lstrip('_'): item for key, item in vars(value).items()}
+
+
+SCALAR_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: encode_float,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null'
+}
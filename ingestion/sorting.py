@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+sorting
+----------------------------------
+External sort of csv rows by item id within a bounded number of rows held in memory, spilling sorted
+runs to temporary files and merging them as the output is written, resolving rows sharing an id
+"""
+
+import heapq
+import pickle
+import tempfile
+
+DUPLICATES_LAST = 'last'
+DUPLICATES_FIRST = 'first'
+DUPLICATES_KEEP = 'keep'
+
+# number of rows held in memory before they are sorted and spilled to a run file
+SORT_BUFFER = 100000
+
+# maximum number of run files merged at once, more runs being merged into a single run beforehand
+MERGE_WIDTH = 64
+
+# number of rows pickled together within a run file, and so read back into memory from each run at once
+RUN_BLOCK_SIZE = 4096
+
+
+class ExternalSorter(object):
+    """ Sorts rows by item id, rows without an id following the rest in the order they were added
+
+    Rows are held in memory until buffer_size rows have been added, then sorted and spilled to a run
+    file in directory, defaulting to the system temporary directory. Iterating the sorted rows merges
+    the runs with the rows still in memory, so at most buffer_size rows plus a block of each run are
+    held at once. Rows sharing an id are in the order they were added.
+    """
+
+    def __init__(self, buffer_size=SORT_BUFFER, directory=None):
+        self.buffer_size = buffer_size
+        self.directory = directory
+        self.count = 0
+        self.spilled = 0
+        self.duplicates = 0
+        self._buffer = []
+        self._runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, id, row):
+        """ adds a row with its item id, or none, spilling a sorted run once the buffer is full """
+        self._buffer.append((id is None, 0 if id is None else id, self.count, row))
+        self.count += 1
+
+        if len(self._buffer) >= self.buffer_size:
+            self.__spill()
+
+    def sorted(self, duplicates=DUPLICATES_LAST):
+        """ lazily yields the rows in id order, keeping the last or first row of each id, or every row
+
+        Each row dropped, or kept alongside another row of its id, is counted in duplicates.
+        """
+        if duplicates not in (DUPLICATES_LAST, DUPLICATES_FIRST, DUPLICATES_KEEP):
+            raise ValueError('Unsupported duplicate policy %s' % duplicates)
+
+        self._buffer.sort()
+        records = heapq.merge(*[_read_run(run) for run in self._runs], self._buffer)
+        previous = None
+
+        for record in records:
+            if previous is None or record[0] or record[:2] != previous[:2]:
+                if previous is not None:
+                    yield previous[3]
+                previous = record
+                continue
+
+            self.duplicates += 1
+            if duplicates == DUPLICATES_LAST:
+                previous = record
+            elif duplicates == DUPLICATES_KEEP:
+                yield previous[3]
+                previous = record
+
+        if previous is not None:
+            yield previous[3]
+
+    def close(self):
+        """ removes the run files """
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
+
+    def __spill(self):
+        """ sorts the buffered rows into a run file, first merging the runs at the merge width """
+        self._buffer.sort()
+        self._runs.append(_write_run(self._buffer, self.directory))
+        self.spilled += 1
+        self._buffer = []
+
+        if len(self._runs) >= MERGE_WIDTH:
+            runs, self._runs = self._runs, []
+            self._runs.append(_write_run(heapq.merge(*[_read_run(run) for run in runs]), self.directory))
+            for run in runs:
+                run.close()
+
+
+def _write_run(records, directory):
+    """ Pickles sorted records to a temporary run file a block at a time, returning the file """
+    run = tempfile.TemporaryFile(dir=directory)
+    block = []
+
+    for record in records:
+        block.append(record)
+        if len(block) >= RUN_BLOCK_SIZE:
+            pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+            block = []
+
+    if block:
+        pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+
+    return run
+
+
+def _read_run(run):
+    """ Lazily reads the records of a run file a block at a time """
+    run.seek(0)
+    while True:
+        try:
+            block = pickle.load(run)
+        except EOFError:
+            return
+        yield from block
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+stats
+----------------------------------
+Statistics recorded while executing a conversion, hooks notified as it progresses and a breakdown of
+the cost of each validator from a cProfile run
+"""
+
+import pstats
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - resource is only available on unix
+    resource = None
+
+from ingestion import validate
+
+
+class ConversionStats(object):
+    """ Timings, row and byte counts, invalid values, duplicates, waits and peak rss of a conversion
+
+    peak_memory is the peak resident memory of the whole process over its lifetime, not of this
+    conversion alone, so a batch or server reports the largest job it has run so far.
+    waits holds the seconds each thread of a pipelined conversion waited on its queues, keyed by stage.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.invalid = {}
+        self.rejected = 0
+        self.duplicates = 0
+        self.waits = {}
+        self.caches = {}
+        self.peak_memory = None
+
+    def add_invalid(self, invalid):
+        """ adds counts of values failing sanitisation, keyed by column name """
+        for column, count in invalid.items():
+            self.invalid[column] = self.invalid.get(column, 0) + count
+
+    def add_cache_counts(self, counts):
+        """ adds the (hits, misses) of memoized column sanitisation, keyed by column name """
+        for column, (hits, misses) in counts.items():
+            previous_hits, previous_misses = self.caches.get(column, (0, 0))
+            self.caches[column] = (previous_hits + hits, previous_misses + misses)
+
+    def hit_rate(self, column):
+        """ returns the fraction of a column's values whose sanitisation was memoized, otherwise none """
+        hits, misses = self.caches.get(column, (0, 0))
+        return hits / (hits + misses) if hits + misses else None
+
+    def to_dict(self):
+        """ returns the statistics as a dict """
+        return {'stages': dict(self.stages), 'seconds': self.seconds, 'rows': self.rows,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+                'invalid': dict(self.invalid), 'rejected': self.rejected, 'duplicates': self.duplicates,
+                'waits': dict(self.waits), 'caches': dict(self.caches), 'peak_memory': self.peak_memory}
+
+
+class ConversionHook(object):
+    """ Receives the progress of a conversion, e.g. to forward it to a metrics system
+
+    Subclasses override the notifications they need, the default implementations do nothing.
+    """
+
+    def stage_started(self, stats, stage):
+        """ called when a stage of the conversion starts """
+        pass
+
+    def stage_finished(self, stats, stage, seconds):
+        """ called when a stage of the conversion finishes, including when it fails """
+        pass
+
+    def rows_converted(self, stats, rows):
+        """ called every hook interval rows with the number of rows converted so far """
+        pass
+
+
+def peak_memory():
+    """ Returns the lifetime peak rss in bytes of this process or its largest worker, otherwise none """
+    if resource is None:
+        return None
+
+    # ru_maxrss is reported in bytes on macos and kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return scale * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                       resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def validator_costs(profile):
+    """ Returns the (name, calls, own seconds, cumulative seconds) of each validator in a profile """
+    costs = []
+
+    for (file, _, name), (_, calls, total, cumulative, _) in pstats.Stats(profile).stats.items():
+        if file == validate.__file__ and not name.startswith('<'):
+            costs.append((name, calls, total, cumulative))
+
+    return sorted(costs, key=lambda cost: cost[3], reverse=True)
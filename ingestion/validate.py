@@ -10,12 +10,23 @@ provides helper functions for sanitizing data when parsing
 import re
 from string import digits
 
+from ingestion import models
+
 # captures modifiers in the following groups: (word)(_)(int)(_)(word)
 MODIFIER_REGEX = '((?:[a-z][a-z]+))(_)(\\d+)(_)((?:[a-z][a-z]+))'
+MODIFIER_PATTERN = re.compile(MODIFIER_REGEX, re.IGNORECASE | re.DOTALL)
 
 PRICE_TYPE_OPEN = 'open'
 PRICE_TYPE_SYSTEM = 'system'
 
+# translation table removing digits from descriptions
+REMOVE_DIGITS = str.maketrans('', '', digits)
+
+
+class ValidationError(Exception):
+    """ Raised when a value cannot be sanitised, making its whole record invalid """
+    pass
+
 
 def is_valid_int(value):
     """ Returns value if valid cast to integer, otherwise none """
@@ -37,6 +48,47 @@ def is_valid_float(value):
     return value
 
 
+def is_valid_cents(value):
+    """ Returns a currency value such as $1,234.50 or -$0.25 as integer cents if valid, otherwise none
+
+    The sign, currency symbol, thousands separators and at most two decimal places are read without
+    going through a float, so blank values, misplaced separators and fractions of a cent are none.
+    """
+    whole, _, fraction = value.partition('.')
+
+    # plain amounts with two decimal places are the common case, their sign and digits read as one int
+    if len(fraction) == 2 and fraction.isdecimal() and (whole.isdecimal() or (
+            whole[:1] == '-' and whole[1:].isdecimal())):
+        return models.Cents(whole + fraction)
+
+    whole = whole.strip()
+    fraction = fraction.rstrip()
+    if not (whole or fraction) or len(fraction) > 2:
+        return None
+
+    sign = whole[:1]
+    if sign == '-' or sign == '+':
+        whole = whole[1:]
+    if whole[:1] == '$':
+        whole = whole[1:]
+        if sign != '-' and whole[:1] == '-':
+            sign = '-'
+            whole = whole[1:]
+
+    # thousands separators must fall every third digit from the decimal point
+    if ',' in whole:
+        digits = whole.replace(',', '')
+        if whole[:1] == ',' or whole[-4::-4] != ',' * (len(whole) - len(digits)):
+            return None
+        whole = digits
+
+    if not (whole + fraction).isdecimal():
+        return None
+
+    cents = int(whole or '0') * 100 + int(fraction.ljust(2, '0'))
+    return models.Cents(-cents if sign == '-' else cents)
+
+
 def is_valid_string(value):
     """ Returns value if valid cast to string, otherwise none """
     try:
@@ -49,8 +101,7 @@ def is_valid_string(value):
 
 def is_valid_description(value):
     """ Returns alpha string """
-    remove_digits = str.maketrans('', '', digits)
-    value = value.translate(remove_digits)
+    value = value.translate(REMOVE_DIGITS)
 
     if len(value) > 0 and value[-1:] == ' ':
         value = value[:-1]
@@ -59,12 +110,12 @@ def is_valid_description(value):
 
 
 def is_valid_price_type(value):
-    """ Returns value if valid maps to supported price types, otherwise an Exception is raised """
-    value = value.lower().replace(' ', '')
-    if value == PRICE_TYPE_OPEN or value == PRICE_TYPE_SYSTEM:
-        return value
+    """ Returns value if valid maps to supported price types, otherwise a ValidationError is raised """
+    price_type = value.lower().replace(' ', '')
+    if price_type == PRICE_TYPE_OPEN or price_type == PRICE_TYPE_SYSTEM:
+        return price_type
     else:
-        raise Exception('Unsupported price type')
+        raise ValidationError('Unsupported price type %r' % value)
 
 
 def enforce_key_consistency(key):
@@ -74,8 +125,7 @@ def enforce_key_consistency(key):
 
 def regex_match_modifiers(txt):
     """ Returns regex capture group if text is valid, otherwise none """
-    regex = re.compile(MODIFIER_REGEX, re.IGNORECASE | re.DOTALL)
-    match = regex.search(txt)
+    match = MODIFIER_PATTERN.search(txt)
 
     if match is not None:
         modifier = match.group(1)
@@ -8,23 +8,106 @@ An entry point to using the ingestion package
 """
 
 import sys
+import asyncio
+import cProfile
 import getopt
+import json
 import os
+import pstats
+import time
+from contextlib import nullcontext
 
+from ingestion import batch
+from ingestion import daemon
+from ingestion import file_io
+from ingestion import index
+from ingestion import stats
 from ingestion.conversion_factory import ConversionFactory
 
 CSV_CONVERSION = 'CSVConversion'
+XML_CONVERSION = 'XMLConversion'
 PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
 
+# input or output file reading from stdin or writing to stdout
+PIPE = '-'
+
+USAGE = """test.py -i <input_file> -o <output_file> [options]
+test.py -d <input_dir_or_glob> -O <output_dir> [-j <jobs>] [options]
+test.py -i <indexed_file> --lookup <id>[,<id>...]
+test.py --serve <socket> [-j <jobs>]
+test.py --submit <socket> (-i <input_file> -o <output_file> | -d <input_dir> -O <output_dir>) [options]
+    -i -, -o -                    read csv from stdin or write json to stdout, e.g. test.py -i - -o -
+    -i <input_file>.xml           convert an xml feed of <item> elements, one at a time
+    -i <file>.gz, -o <file>.gz    read or write gzip, bz2 (.bz2) or xz (.xz) compressed files
+    -s, --stream                  convert one record at a time in constant memory
+    -p, --pipeline                read, parse and write batches of rows in concurrent threads
+    --batch-size <rows>           with --pipeline, rows in each batch passed between the threads
+    --queue-depth <batches>       with --pipeline, batches queued between threads, not --memory-budget
+    --memory-budget <bytes>       with --pipeline, memory of the queued batches (default 64 MiB)
+    --parsers <threads>           with --pipeline, threads parsing and serialising batches
+    -w, --workers <workers>       convert chunks of the input in parallel processes
+    --chunk-size <bytes>          size of the chunks converted in parallel or between checkpoints
+    -x, --extractor <extractor>   csv (default) or mmap, which splits rows from a memory map as bytes
+    --encoding <encoding>         encoding of the input files, defaulting to the platform encoding
+    --lazy                        convert each field of a row only when it is first used
+    --columnar                    hold parsed items in typed column arrays, using less memory
+    --columns <columns>           write only these comma separated properties, e.g. --columns id,price
+    --where <predicate>           write only rows matching a predicate, e.g. --where price_type=open
+                                  (repeatable)
+    --sort                        write items in id order, spilling sorted runs to temporary files
+    --duplicates <policy>         with --sort, keep the last (default) or first row of each id, or all
+    --sort-buffer <rows>          with --sort, rows held in memory before a sorted run is spilled
+    -c, --compact                 write json without indentation
+    --money <format>              parse prices as float (default), or as exact integer cents written as
+                                  decimals or as cents, e.g. --money cents writes $1,234.50 as 123450
+    -f, --format <format>         json (default), ndjson or sqlite
+    --shard-records <records>     roll ndjson output over into a new shard after this many records
+    --shard-bytes <bytes>         roll ndjson output over into a new shard before exceeding this size
+    --state <file>                record content hashes, skipping unchanged files and items
+    --full                        with --state, write the full output and re-record every row
+    --on-error <policy>           abort (default) or reject, writing invalid rows to a reject file
+    --rejects <file>              reject file, defaulting to <output_file>.rejects.csv (not with -d)
+    --checkpoint <file>           record a checkpoint after each chunk to resume from (not with -d)
+    --index <target>              write a sidecar id index (<file>.idx) of the output or source csv
+    --lookup <ids>                print the items with comma separated ids from an indexed file
+    --profile                     profile the conversion, printing its statistics and validator costs
+    -d, --input-dir <dir_or_glob> convert every csv file in a directory, or every file matching a glob
+    -O, --output-dir <dir>        directory receiving one output file per input file
+    -j, --jobs <jobs>             number of files converted concurrently (defaults to the cpu count)
+    --serve <socket>              serve conversion jobs on a unix socket from a pool of warm workers
+    --submit <socket>             submit the input file or directory to a conversion server"""
+
+
+def resolve_path(path):
+    """ Resolves a path relative to the project root, leaving absolute paths unchanged """
+    return os.path.join(PROJECT_ROOT, path)
+
 
 def main(argv):
     """ Accepts CLI arguments for an CSV input file and outputs data as a JSON file """
     input_file = ''
     output_file = ''
+    input_dir = ''
+    output_dir = ''
+    jobs = None
+    shard_records = None
+    shard_bytes = None
+    profile = False
+    lookup = None
+    serve = None
+    submit = None
+    options = {}
     try:
-        opts, _ = getopt.getopt(argv, "hi:o:", ["ifile=", "ofile="])
+        opts, _ = getopt.getopt(argv, "hi:o:spw:x:cf:d:O:j:",
+                                ["ifile=", "ofile=", "stream", "workers=", "extractor=", "encoding=",
+                                 "lazy", "columnar", "compact", "format=", "shard-records=",
+                                 "shard-bytes=", "state=", "full", "profile", "chunk-size=", "on-error=",
+                                 "rejects=", "checkpoint=", "index=", "lookup=", "columns=", "where=",
+                                 "serve=", "submit=", "sort", "duplicates=", "sort-buffer=", "pipeline",
+                                 "batch-size=", "queue-depth=", "memory-budget=", "parsers=", "money=",
+                                 "input-dir=", "output-dir=", "jobs="])
     except getopt.GetoptError:
-        print('test.py -i <input_file> -o <output_file>')
+        print(USAGE)
         sys.exit(2)
 
     for opt, arg in opts:
@@ -32,19 +115,235 @@ def main(argv):
             input_file = arg
         elif opt in ("-o", "--ofile"):
             output_file = arg
+        elif opt in ("-s", "--stream"):
+            options['streaming'] = True
+        elif opt in ("-p", "--pipeline"):
+            options['pipelined'] = True
+        elif opt == "--batch-size":
+            options['pipeline_batch_size'] = int(arg)
+        elif opt == "--queue-depth":
+            options['pipeline_depth'] = int(arg)
+        elif opt == "--memory-budget":
+            options['memory_budget'] = int(arg)
+        elif opt == "--parsers":
+            options['parsers'] = int(arg)
+        elif opt in ("-w", "--workers"):
+            options['workers'] = int(arg)
+        elif opt in ("-x", "--extractor"):
+            options['extractor'] = arg
+        elif opt == "--encoding":
+            options['encoding'] = arg
+        elif opt == "--lazy":
+            options['lazy'] = True
+        elif opt == "--columnar":
+            options['columnar'] = True
+        elif opt == "--columns":
+            options['columns'] = arg.split(',')
+        elif opt == "--where":
+            options.setdefault('predicates', []).append(arg)
+        elif opt == "--sort":
+            options['sort_by_id'] = True
+        elif opt == "--duplicates":
+            options['duplicate_policy'] = arg
+        elif opt == "--sort-buffer":
+            options['sort_buffer'] = int(arg)
+        elif opt in ("-c", "--compact"):
+            options['compact'] = True
+        elif opt == "--money":
+            options['money'] = arg
+        elif opt in ("-f", "--format"):
+            options['output_format'] = arg
+        elif opt == "--shard-records":
+            shard_records = int(arg)
+        elif opt == "--shard-bytes":
+            shard_bytes = int(arg)
+        elif opt == "--state":
+            options['state_file'] = resolve_path(arg)
+        elif opt == "--full":
+            options['full_rebuild'] = True
+        elif opt == "--chunk-size":
+            options['chunk_size'] = int(arg)
+        elif opt == "--on-error":
+            options['error_policy'] = arg
+        elif opt == "--rejects":
+            options['reject_file'] = resolve_path(arg)
+        elif opt == "--checkpoint":
+            options['checkpoint_file'] = resolve_path(arg)
+        elif opt == "--index":
+            options['index'] = arg
+        elif opt == "--lookup":
+            lookup = [int(id) for id in arg.split(',')]
+        elif opt == "--profile":
+            profile = True
+        elif opt in ("-d", "--input-dir"):
+            input_dir = arg
+        elif opt in ("-O", "--output-dir"):
+            output_dir = arg
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt == "--serve":
+            serve = arg
+        elif opt == "--submit":
+            submit = arg
+
+    if shard_records or shard_bytes:
+        options['shard_limits'] = (shard_records, shard_bytes)
+
+    if serve is not None:
+        print('Serving conversions on %s' % serve)
+        daemon.serve(serve, CSV_CONVERSION, jobs)
+        return
+
+    if submit is not None:
+        main_submit(submit, input_file, output_file, input_dir, output_dir, options)
+        return
+
+    if input_dir != '' or output_dir != '':
+        if input_dir == '' or output_dir == '':
+            raise Exception('Please provide an input and output directory e.g. python -d data/ -O out/')
+
+        main_batch(CSV_CONVERSION, resolve_path(input_dir), resolve_path(output_dir), jobs, options)
+        return
+
+    if lookup is not None:
+        if input_file == '':
+            raise Exception('Please provide an indexed file e.g. python -i example.json --lookup 111010')
+
+        main_lookup(resolve_path(input_file), lookup, options.get('encoding'))
+        return
 
     if input_file == '' or output_file == '':
         raise Exception('Please provide an input and outfile e.g. python -i example.csv -o example.json')
 
+    if PIPE in (input_file, output_file):
+        file_import = ConversionFactory.create_conversion(CSV_CONVERSION)
+        batch.apply_options(file_import, options)
+        main_pipe(file_import, input_file, output_file)
+        return
+
     print('Converting file %s to %s' % (input_file, output_file))
 
-    file_import = ConversionFactory.create_conversion(CSV_CONVERSION)
-    file_import.set_input_file(PROJECT_ROOT + '/' + input_file)
-    file_import.set_output_file(PROJECT_ROOT + '/' + output_file)
-    file_import.execute()
+    is_xml = file_io.uncompressed_name(input_file).lower().endswith('.xml')
+    conversion_id = XML_CONVERSION if is_xml else CSV_CONVERSION
+    file_import = ConversionFactory.create_conversion(conversion_id)
+    file_import.set_input_file(resolve_path(input_file))
+    file_import.set_output_file(resolve_path(output_file))
+    batch.apply_options(file_import, options)
+
+    if profile:
+        profile_conversion(file_import)
+    else:
+        file_import.execute()
 
     print('Conversion Complete')
 
 
+def main_pipe(conversion, input_file, output_file):
+    """ Converts csv from stdin or a file to json on stdout or a file, overlapping reads and writes """
+    with open_pipe(input_file, sys.stdin, 'rb') as infile:
+        with open_pipe(output_file, sys.stdout, 'wb') as outfile:
+            reader, writer = file_io.AsyncFileReader(infile), file_io.AsyncFileWriter(outfile)
+            asyncio.run(conversion.execute_async(reader, writer))
+
+
+def main_lookup(input_file, ids, encoding=None):
+    """ Prints the item of each id found through the sidecar index of a file, one json line each """
+    with index.IdIndex(input_file, encoding) as id_index:
+        items = id_index.lookup_many(ids)
+
+    for id in ids:
+        print(json.dumps(items.get(id), sort_keys=True))
+
+
+def open_pipe(path, stream, mode):
+    """ Opens a file for a pipe conversion, or the binary buffer of a standard stream for - """
+    if path == PIPE:
+        return nullcontext(stream.buffer)
+    return open(resolve_path(path), mode)
+
+
+def profile_conversion(conversion):
+    """ Executes a conversion under cProfile, printing its statistics and the cost of each validator """
+    profiler = cProfile.Profile()
+    profiler.runcall(conversion.execute)
+
+    summary = conversion.stats
+    print('Converted %d rows in %.3fs, read %d bytes, wrote %d bytes, process peak rss %s bytes' % (
+        summary.rows, summary.seconds, summary.bytes_read, summary.bytes_written, summary.peak_memory))
+
+    if summary.rejected:
+        print('  rejected %d rows' % summary.rejected)
+    if summary.duplicates:
+        print('  duplicate ids %d rows' % summary.duplicates)
+
+    for stage, seconds in summary.stages.items():
+        print('  %-12s %10.3fs' % (stage, seconds))
+
+    for stage, seconds in summary.waits.items():
+        print('  %-12s %10.3fs waiting on queues' % (stage, seconds))
+
+    for column, count in sorted(summary.invalid.items()):
+        print('  invalid %-24s %8d' % (column, count))
+
+    for column in sorted(summary.caches):
+        print('  cached  %-24s %7.1f%% hits' % (column, summary.hit_rate(column) * 100))
+
+    print('%-30s %10s %12s %12s' % ('validator', 'calls', 'own s', 'cumulative s'))
+    for name, calls, total, cumulative in stats.validator_costs(profiler):
+        print('%-30s %10d %12.3f %12.3f' % (name, calls, total, cumulative))
+
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+
+def report_result(result):
+    """ Prints the outcome of a single file as it completes """
+    status = 'OK' if result.succeeded else 'FAILED'
+    print('%-6s %8.3fs %s' % (status, result.seconds, result.input_file))
+    if not result.succeeded:
+        print('       ' + result.error.replace('\n', '\n       '))
+
+
+def main_batch(conversion_id, input_dir, output_dir, jobs, options):
+    """ Converts every matching input file concurrently, exiting with a failure if any file fails """
+    input_files = batch.find_inputs(input_dir)
+    print('Converting %d files from %s to %s' % (len(input_files), input_dir, output_dir))
+
+    start = time.perf_counter()
+    results = batch.convert_batch(input_files, output_dir, conversion_id, jobs, options, report_result)
+    report_totals(results, start)
+
+
+def main_submit(socket_path, input_file, output_file, input_dir, output_dir, options):
+    """ Submits a file, or every matching file of a directory, to a server, failing if any fails """
+    if input_dir != '' and output_dir != '':
+        batch.check_batch_options(options)
+        output_dir = resolve_path(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        output_format = options.get('output_format', 'json')
+        jobs = [(input_file, batch.output_path(input_file, output_dir, output_format), options)
+                for input_file in batch.find_inputs(resolve_path(input_dir))]
+    elif input_file != '' and output_file != '':
+        jobs = [(resolve_path(input_file), resolve_path(output_file), options)]
+    else:
+        raise Exception('Please provide an input and outfile, or an input and output directory')
+
+    print('Submitting %d files to %s' % (len(jobs), socket_path))
+
+    start = time.perf_counter()
+    results = daemon.submit(socket_path, jobs, report_result)
+    report_totals(results, start)
+
+
+def report_totals(results, start):
+    """ Prints the files converted and failed since start, exiting with a failure if any failed """
+    failures = [result for result in results if not result.succeeded]
+
+    print('Conversion Complete: %d succeeded, %d failed in %.3fs' % (
+        len(results) - len(failures), len(failures), time.perf_counter() - start))
+
+    if failures:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -6,11 +6,26 @@ test_validation
 ----------------------------------
 Tests for `ingestion` module.
 """
+import asyncio
+import bz2
+import contextlib
+import cProfile
+import gzip
+import io
 import operator
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
 import unittest
 import json
+import lzma
+from xml.sax.saxutils import escape
 
-from ingestion import file_io, parser, models, validate
+import main
+from benchmarks import generator, harness
+from ingestion import batch, daemon, file_io, index, parser, models, serialiser, sorting, stats, validate
 from ingestion.conversion_factory import ConversionFactory, CSVConversion, XMLConversion
 
 
@@ -35,6 +50,1056 @@ class TestConversionFactory(unittest.TestCase):
         with self.assertRaises(NameError):
             ConversionFactory.create_conversion('HTMLConversion')
 
+    def test_should_fail_if_id_evaluated(self):
+        for id in ('os', 'Conversion.Factory', '__import__("os")'):
+            with self.assertRaises(NameError):
+                ConversionFactory.create_conversion(id)
+
+
+EXAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example.csv')
+
+
+def convert(conversion, input_file=EXAMPLE_CSV):
+    """ runs a conversion into a temporary file and returns the output """
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'output.json')
+        conversion.set_input_file(input_file)
+        conversion.set_output_file(output_file)
+        conversion.execute()
+
+        with open(output_file) as outfile:
+            return outfile.read()
+
+
+class TestCSVConversion(unittest.TestCase):
+    def test_should_fail_if_streaming_output_differs(self):
+        expected = convert(CSVConversion())
+
+        conversion = CSVConversion()
+        conversion.set_streaming(True)
+        output = convert(conversion)
+
+        self.assertEqual(output, expected)
+        self.assertEqual(len(conversion.models), 0)
+        self.assertEqual(len(json.loads(output)), 14)
+
+    def test_should_fail_if_empty_stream_not_empty_array(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, 'empty.csv')
+            with open(input_file, 'w') as infile:
+                infile.write('item id,description,price,cost,price_type,quantity_on_hand\n')
+
+            conversion = CSVConversion()
+            conversion.set_streaming(True)
+            self.assertEqual(convert(conversion, input_file), file_io.output_json([]))
+
+    def test_should_fail_if_parallel_output_differs(self):
+        conversion = CSVConversion()
+        conversion.set_workers(2)
+        conversion.set_chunk_size(64)
+
+        self.assertEqual(convert(conversion), convert(CSVConversion()))
+
+    def test_should_fail_if_parallel_splits_quoted_newlines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, 'quoted.csv')
+            with open(input_file, 'w', newline='') as infile:
+                infile.write('item id,description,price_type\n')
+                for index in range(50):
+                    infile.write('%d,"Line ""%d""\nBreak",open\n' % (index, index))
+
+            conversion = CSVConversion()
+            conversion.set_workers(3)
+            conversion.set_chunk_size(10)
+            output = convert(conversion, input_file)
+
+            self.assertEqual(output, convert(CSVConversion(), input_file))
+            self.assertEqual(len(json.loads(output)), 50)
+
+    def test_should_fail_if_mapped_extractor_output_differs(self):
+        expected = convert(CSVConversion())
+
+        for streaming, workers in ((False, 1), (True, 1), (False, 2)):
+            conversion = CSVConversion()
+            conversion.set_extractor('mmap')
+            conversion.set_encoding('utf-8')
+            conversion.set_streaming(streaming)
+            conversion.set_workers(workers)
+            conversion.set_chunk_size(64)
+
+            self.assertEqual(convert(conversion), expected)
+
+    def test_should_fail_if_unsupported_extractor_accepted(self):
+        with self.assertRaises(ValueError):
+            CSVConversion().set_extractor('xlsx')
+
+    def test_should_fail_if_model_changes_not_kept(self):
+        conversion = CSVConversion()
+        convert(conversion)
+        conversion.models[0].price = 9.99
+
+        self.assertEqual(conversion.models[0].price, 9.99)
+
+    def test_should_fail_if_columnar_output_differs(self):
+        conversion = CSVConversion()
+        conversion.set_columnar(True)
+
+        self.assertEqual(convert(conversion), convert(CSVConversion()))
+        self.assertIsInstance(conversion.models, models.InventoryBatch)
+
+
+class ChunkedReader(object):
+    """ provides the read of an asyncio stream reader, returning the data a few bytes at a time """
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    async def read(self, size=-1):
+        chunk, self.data = self.data[:self.size], self.data[self.size:]
+        return chunk
+
+
+class TestPipeConversion(unittest.TestCase):
+    def execute(self, conversion, data, size=7):
+        output = io.BytesIO()
+        asyncio.run(conversion.execute_async(ChunkedReader(data, size), file_io.AsyncFileWriter(output)))
+        return output.getvalue().decode('utf-8')
+
+    def test_should_fail_if_pipe_output_differs(self):
+        with open(EXAMPLE_CSV, 'rb') as infile:
+            data = infile.read()
+
+        for output_format in ('json', 'ndjson'):
+            expected = CSVConversion()
+            expected.set_output_format(output_format)
+            conversion = CSVConversion()
+            conversion.set_output_format(output_format)
+
+            self.assertEqual(self.execute(conversion, data), convert(expected))
+            self.assertEqual(conversion.stats.rows, 14)
+            self.assertEqual(conversion.stats.bytes_read, len(data))
+
+    def test_should_fail_if_quoted_newlines_split(self):
+        data = 'item id,description,price_type\r\n' + ''.join(
+            '%d,"Line ""%d""\r\nBr\u00e9ak",open\r\n' % (index, index) for index in range(20))
+
+        conversion = CSVConversion()
+        conversion.set_encoding('utf-8')
+        output = self.execute(conversion, data.encode('utf-8'), size=5)
+
+        # descriptions are sanitised of digits
+        self.assertEqual([item['description'] for item in json.loads(output)],
+                         ['Line ""\r\nBr\u00e9ak'] * 20)
+
+    def test_should_fail_if_empty_pipe_not_empty_array(self):
+        self.assertEqual(self.execute(CSVConversion(), b''), '[]')
+
+    def test_should_fail_if_unsupported_options_ignored(self):
+        for options in ({'workers': 2}, {'checkpoint_file': 'checkpoint.json'}, {'pipelined': True},
+                        {'extractor': 'mmap'}):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, options)
+
+            with self.assertRaises(ValueError):
+                self.execute(conversion, b'item id\n1\n')
+
+    def test_should_fail_if_record_boundary_within_quotes(self):
+        self.assertEqual(file_io.find_record_boundary('a,b\n1,"x\ny'), 4)
+        self.assertEqual(file_io.find_record_boundary('a,b\n1,"x\ny"\n2'), 12)
+        self.assertEqual(file_io.find_record_boundary('a,b'), 0)
+
+
+class TestNDJSONOutput(unittest.TestCase):
+    def setUp(self):
+        self.expected = json.loads(convert(CSVConversion()))
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.output_file = os.path.join(self.directory.name, 'output.ndjson')
+
+    def execute(self, **options):
+        conversion = CSVConversion()
+        conversion.set_input_file(EXAMPLE_CSV)
+        conversion.set_output_file(self.output_file)
+        conversion.set_output_format('ndjson')
+        conversion.set_streaming(options.get('streaming', False))
+        conversion.set_workers(options.get('workers', 1))
+        conversion.set_chunk_size(64)
+        conversion.set_shard_limits(options.get('max_records'), options.get('max_bytes'))
+        conversion.execute()
+
+    def read_lines(self, file):
+        with open(os.path.join(self.directory.name, file)) as infile:
+            return [json.loads(line) for line in infile]
+
+    def test_should_fail_if_lines_differ_from_json(self):
+        for options in ({}, {'streaming': True}, {'workers': 2}):
+            self.execute(**options)
+            self.assertEqual(self.read_lines('output.ndjson'), self.expected)
+
+    def test_should_fail_if_not_sharded_by_records(self):
+        self.execute(max_records=4, workers=2)
+
+        with open(self.output_file + '.manifest.json') as infile:
+            manifest = json.load(infile)
+
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(manifest['records'], 14)
+        self.assertEqual([shard['records'] for shard in manifest['shards']], [4, 4, 4, 2])
+        self.assertEqual([item for shard in manifest['shards']
+                          for item in self.read_lines(shard['file'])], self.expected)
+        self.assertFalse(os.path.exists(self.output_file))
+
+    def test_should_fail_if_shard_exceeds_bytes(self):
+        self.execute(max_bytes=400, streaming=True)
+
+        with open(self.output_file + '.manifest.json') as infile:
+            shards = json.load(infile)['shards']
+
+        self.assertGreater(len(shards), 1)
+        for shard in shards:
+            size = os.path.getsize(os.path.join(self.directory.name, shard['file']))
+            self.assertEqual(size, shard['bytes'])
+            self.assertLessEqual(size, 400)
+
+    def test_should_fail_if_unsupported_format_accepted(self):
+        with self.assertRaises(ValueError):
+            CSVConversion().set_output_format('xml')
+
+
+class TestSQLiteOutput(unittest.TestCase):
+    def setUp(self):
+        self.expected = json.loads(convert(CSVConversion()))
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'inventory.csv')
+        self.output_file = os.path.join(self.directory.name, 'output.db')
+
+        with open(EXAMPLE_CSV) as infile:
+            self.lines = infile.read().splitlines(True)
+
+    def execute(self, lines=None, **options):
+        with open(self.input_file, 'w') as outfile:
+            outfile.writelines(self.lines if lines is None else lines)
+
+        conversion = CSVConversion()
+        conversion.set_input_file(self.input_file)
+        conversion.set_output_file(self.output_file)
+        conversion.set_output_format('sqlite')
+        conversion.set_chunk_size(64)
+        batch.apply_options(conversion, options)
+        conversion.execute()
+        return conversion
+
+    def read_items(self):
+        """ reads the items and their modifiers back from the database as the dicts written to json """
+        connection = sqlite3.connect(self.output_file)
+        connection.row_factory = sqlite3.Row
+        try:
+            items = []
+            for row in connection.execute('SELECT * FROM items ORDER BY key'):
+                modifiers = connection.execute('SELECT name, price FROM modifiers WHERE item_key = ? '
+                                               'ORDER BY position', (row['key'],))
+                item = {key: row[key] for key in row.keys() if key not in ('key', 'extras')}
+                item['modifiers'] = [{key: value for key, value in zip(('name', 'price'), modifier)
+                                      if value is not None} for modifier in modifiers]
+                items.append(item)
+
+            indexes = {row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")}
+            return items, indexes
+        finally:
+            connection.close()
+
+    def test_should_fail_if_items_differ_from_json(self):
+        for options in ({}, {'streaming': True}, {'workers': 2},
+                        {'checkpoint_file': self.output_file + '.ckpt'},
+                        {'money': models.MONEY_CENTS}):
+            conversion = self.execute(**options)
+            items, indexes = self.read_items()
+
+            self.assertEqual(items, self.expected)
+            self.assertEqual({'items_id', 'modifiers_item_key'}, indexes)
+            self.assertEqual(conversion.stats.bytes_written, os.path.getsize(self.output_file))
+            os.remove(self.output_file)
+
+    def test_should_fail_if_reingest_not_upserted(self):
+        self.execute()
+
+        lines = list(self.lines)
+        lines[1] = lines[1].replace('$1.25', '$1.35')
+        lines.append('9000001,Tea,$1.00,,system,5\n')
+        self.execute(lines)
+
+        items = {item['id']: item for item in self.read_items()[0]}
+        self.assertEqual(len(items), 15)
+        self.assertEqual(items[111010]['price'], 1.35)
+        self.assertEqual(items[111010]['modifiers'], self.expected[0]['modifiers'])
+        self.assertEqual(items[9000001]['description'], 'Tea')
+
+    def test_should_fail_if_duplicate_ids_not_replaced(self):
+        lines = self.lines + [self.lines[1].replace('$1.25', '$9.99').split(',Small')[0] + '\n']
+        self.execute(lines)
+
+        items = [item for item in self.read_items()[0] if item['id'] == 111010]
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0]['price'], 9.99)
+        self.assertEqual(items[0]['modifiers'], [])
+
+    def test_should_fail_if_incremental_conversion_accepted(self):
+        self.execute()
+        size = os.path.getsize(self.output_file)
+
+        for full_rebuild in (False, True):
+            with self.assertRaises(ValueError):
+                self.execute(state_file=os.path.join(self.directory.name, 'state.db'),
+                             full_rebuild=full_rebuild)
+
+        self.assertEqual(os.path.getsize(self.output_file), size)
+        self.assertEqual(self.read_items()[0], self.expected)
+
+    def test_should_fail_if_pipe_accepted(self):
+        conversion = CSVConversion()
+        conversion.set_output_format('sqlite')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(conversion.execute_async(ChunkedReader(b'', 1), None))
+
+
+class TestIdIndex(unittest.TestCase):
+    def setUp(self):
+        self.expected = {item['id']: item for item in json.loads(convert(CSVConversion()))}
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'inventory.csv')
+        self.output_file = os.path.join(self.directory.name, 'output.json')
+
+        with open(EXAMPLE_CSV) as infile:
+            self.lines = infile.read().splitlines(True)
+        self.write_input(self.lines)
+
+    def write_input(self, lines):
+        with open(self.input_file, 'w') as outfile:
+            outfile.writelines(lines)
+
+    def execute(self, **options):
+        conversion = CSVConversion()
+        conversion.set_input_file(self.input_file)
+        conversion.set_output_file(self.output_file)
+        conversion.set_chunk_size(64)
+        batch.apply_options(conversion, options)
+        conversion.execute()
+        return conversion
+
+    def test_should_fail_if_output_items_not_found(self):
+        for options in ({}, {'compact': True}, {'output_format': 'ndjson'}, {'workers': 2}):
+            conversion = self.execute(index='output', **options)
+            self.assertIn('index', conversion.stats.stages)
+
+            with index.IdIndex(self.output_file) as id_index:
+                self.assertEqual(id_index.count, 14)
+                for id, item in self.expected.items():
+                    self.assertEqual(id_index.lookup(id), item)
+                self.assertIsNone(id_index.lookup(1))
+
+    def test_should_fail_if_source_items_not_found(self):
+        lines = self.lines + ['9000001,"Line\nBreak",$1.00,,system,5\n']
+        self.write_input(lines)
+        self.execute(index='source')
+
+        with index.IdIndex(self.input_file) as id_index:
+            self.assertEqual(id_index.lookup(111010), self.expected[111010])
+            self.assertEqual(id_index.lookup(9000001)['description'], 'Line\nBreak')
+
+    def test_should_fail_if_bulk_lookup_not_found(self):
+        self.execute(index='output')
+        ids = [111784, 111010, 1, 111010]
+
+        with index.IdIndex(self.output_file) as id_index:
+            items = id_index.lookup_many(ids)
+
+        self.assertEqual(items, {111010: self.expected[111010], 111784: self.expected[111784]})
+
+    def test_should_fail_if_last_duplicate_not_found(self):
+        self.write_input(self.lines + [self.lines[1].replace('$1.25', '$9.99')])
+        self.execute(index='output', output_format='ndjson')
+
+        with index.IdIndex(self.output_file) as id_index:
+            self.assertEqual(id_index.count, 15)
+            self.assertEqual(id_index.lookup(111010)['price'], 9.99)
+
+    def test_should_fail_if_unsupported_index_accepted(self):
+        with self.assertRaises(ValueError):
+            CSVConversion().set_index('input')
+
+        with self.assertRaises(ValueError):
+            self.execute(index='output', output_format='sqlite')
+
+
+class RecordingHook(stats.ConversionHook):
+    """ records the notifications of a conversion """
+
+    def __init__(self):
+        self.events = []
+
+    def stage_started(self, conversion_stats, stage):
+        self.events.append(('started', stage))
+
+    def stage_finished(self, conversion_stats, stage, seconds):
+        self.events.append(('finished', stage))
+
+    def rows_converted(self, conversion_stats, rows):
+        self.events.append(('rows', rows))
+
+
+class TestConversionStats(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'invalid.csv')
+
+        with open(self.input_file, 'w') as infile:
+            infile.write('item id,description,price,cost,price_type,quantity_on_hand,'
+                         'modifier_1_name,modifier_1_price\n'
+                         '1,Tea,$1.00,n/a,system,5,Small,$1x\n'
+                         'x1,Coffee,,,open,,Large,$0.50\n'
+                         '3,Milk,$1.2.3,$0.1,system,many\n')
+
+    def test_should_fail_if_stats_not_recorded(self):
+        conversion = CSVConversion()
+        output = convert(conversion)
+
+        self.assertEqual(list(conversion.stats.stages), ['extract', 'parse', 'transform'])
+        self.assertEqual(conversion.stats.rows, 14)
+        self.assertEqual(conversion.stats.bytes_read, os.path.getsize(EXAMPLE_CSV))
+        self.assertEqual(conversion.stats.bytes_written, len(output))
+        # modifier names containing spaces fail sanitisation as they are neither alpha nor a price
+        self.assertEqual(conversion.stats.invalid, {'modifier_1_name': 1, 'modifier_2_name': 1})
+
+    def test_should_fail_if_invalid_values_not_counted(self):
+        expected = {'cost': 1, 'item id': 1, 'modifier_1_price': 1, 'price': 1, 'quantity_on_hand': 1}
+
+        for streaming, workers in ((False, 1), (True, 1), (False, 2)):
+            conversion = CSVConversion()
+            conversion.set_streaming(streaming)
+            conversion.set_workers(workers)
+            conversion.set_chunk_size(16)
+            convert(conversion, self.input_file)
+
+            self.assertEqual(conversion.stats.invalid, expected)
+            self.assertEqual(conversion.stats.rows, 3)
+
+    def test_should_fail_if_hooks_not_notified(self):
+        hook = RecordingHook()
+        conversion = CSVConversion()
+        conversion.set_streaming(True)
+        conversion.add_hook(hook)
+        conversion.set_hook_interval(5)
+        convert(conversion)
+
+        self.assertEqual(hook.events,
+                         [('started', 'stream'), ('rows', 5), ('rows', 10), ('finished', 'stream')])
+
+    def test_should_fail_if_validator_costs_missing(self):
+        profiler = cProfile.Profile()
+        profiler.runcall(convert, CSVConversion())
+
+        costs = {name: calls for name, calls, _, _ in stats.validator_costs(profiler)}
+        self.assertEqual(costs['is_valid_int'], 28)
+        # price types are memoized, so are only sanitised once per distinct value
+        self.assertEqual(costs['is_valid_price_type'], 2)
+
+
+class TestPipelinedConversion(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_should_fail_if_pipelined_output_differs(self):
+        for output_format in ('json', 'ndjson'):
+            expected = CSVConversion()
+            expected.set_output_format(output_format)
+            expected = convert(expected)
+
+            for options in ({}, {'parsers': 3, 'pipeline_batch_size': 2},
+                            {'pipeline_batch_size': 1, 'pipeline_depth': 1},
+                            {'lazy': True, 'extractor': 'mmap'}):
+                conversion = CSVConversion()
+                batch.apply_options(conversion,
+                                    dict(options, pipelined=True, output_format=output_format))
+
+                self.assertEqual(convert(conversion), expected)
+                self.assertEqual(conversion.stats.rows, 14)
+                self.assertEqual(conversion.stats.invalid, {'modifier_1_name': 1, 'modifier_2_name': 1})
+
+    def test_should_fail_if_waits_not_recorded(self):
+        hook = RecordingHook()
+        conversion = CSVConversion()
+        batch.apply_options(conversion, {'pipelined': True, 'parsers': 2, 'pipeline_batch_size': 3,
+                                         'hook_interval': 5})
+        conversion.add_hook(hook)
+        convert(conversion)
+
+        self.assertEqual(sorted(conversion.stats.waits), ['parse-1', 'parse-2', 'read', 'write'])
+        self.assertTrue(all(seconds >= 0 for seconds in conversion.stats.waits.values()))
+        self.assertEqual(conversion.stats.to_dict()['waits'], conversion.stats.waits)
+        self.assertEqual([event for event in hook.events if event[0] == 'rows'],
+                         [('rows', 6), ('rows', 12)])
+
+    def test_should_fail_if_memory_budget_ignored(self):
+        conversion = CSVConversion()
+        rows = [['111010', 'Coffee', '$1.25']] * 100
+
+        conversion.set_memory_budget(1)
+        self.assertEqual(conversion._pipeline_depth(rows), 1)
+        conversion.set_memory_budget(1024 * 1024 * 1024)
+        self.assertGreater(conversion._pipeline_depth(rows), 100)
+
+    def test_should_fail_if_stage_error_not_raised(self):
+        input_file = os.path.join(self.directory.name, 'input.csv')
+        with open(input_file, 'w') as outfile:
+            outfile.write('item id,price_type\n' + '1,system\n' * 50 + '2,bogus\n' + '3,open\n' * 50)
+
+        conversion = CSVConversion()
+        batch.apply_options(conversion, {'pipelined': True, 'parsers': 2, 'pipeline_batch_size': 4,
+                                         'pipeline_depth': 1})
+        with self.assertRaises(validate.ValidationError):
+            convert(conversion, input_file)
+
+        conversion = CSVConversion()
+        reject_file = os.path.join(self.directory.name, 'rejects.csv')
+        batch.apply_options(conversion, {'pipelined': True, 'parsers': 2, 'pipeline_batch_size': 4,
+                                         'error_policy': 'reject', 'reject_file': reject_file})
+
+        self.assertEqual(len(json.loads(convert(conversion, input_file))), 100)
+        self.assertEqual(conversion.stats.rejected, 1)
+        with open(os.path.join(self.directory.name, 'rejects.csv')) as infile:
+            self.assertEqual(len(infile.read().splitlines()), 2)
+
+
+class TestIncrementalConversion(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'inventory.csv')
+        self.state_file = os.path.join(self.directory.name, 'state.db')
+
+        with open(EXAMPLE_CSV) as infile:
+            self.lines = infile.read().splitlines(True)
+        self.write_input(self.lines)
+
+    def write_input(self, lines):
+        with open(self.input_file, 'w') as outfile:
+            outfile.writelines(lines)
+
+    def execute(self, full_rebuild=False, **options):
+        conversion = CSVConversion()
+        conversion.set_state_file(self.state_file)
+        conversion.set_full_rebuild(full_rebuild)
+        batch.apply_options(conversion, options)
+        output = convert(conversion, self.input_file)
+        return conversion, output
+
+    def test_should_fail_if_unchanged_file_not_skipped(self):
+        conversion, output = self.execute()
+        self.assertFalse(conversion.skipped)
+        self.assertEqual(conversion.changes['added'], 14)
+        self.assertEqual(len(output.splitlines()), 14)
+
+        conversion, output = self.execute()
+        self.assertTrue(conversion.skipped)
+        self.assertEqual(output, '')
+
+    def test_should_fail_if_delta_not_emitted(self):
+        self.execute()
+
+        lines = list(self.lines)
+        lines[1] = lines[1].replace('$1.25', '$1.35')
+        del lines[2]
+        lines.append('9000001,Tea,$1.00,,system,5\n')
+        self.write_input(lines)
+
+        conversion, output = self.execute()
+        changes = map(json.loads, output.splitlines())
+        delta = {(change['change'], change['id']): change for change in changes}
+
+        self.assertEqual(sorted(delta), [('added', 9000001), ('changed', 111010), ('removed', 111784)])
+        self.assertEqual(delta[('changed', 111010)]['item']['price'], 1.35)
+        self.assertNotIn('item', delta[('removed', 111784)])
+        self.assertEqual(conversion.changes, {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 12})
+
+    def test_should_fail_if_full_rebuild_not_full_output(self):
+        self.execute()
+
+        conversion, output = self.execute(full_rebuild=True)
+
+        self.assertFalse(conversion.skipped)
+        self.assertEqual(output, convert(CSVConversion(), self.input_file))
+        self.assertTrue(self.execute()[0].skipped)
+
+    def test_should_fail_if_rejected_row_reported_or_recorded(self):
+        options = {'error_policy': 'reject',
+                   'reject_file': os.path.join(self.directory.name, 'rejects.csv')}
+        invalid = list(self.lines)
+        invalid[1] = invalid[1].replace('system', 'bogus')
+        fixed = list(self.lines)
+        fixed[1] = fixed[1].replace('$1.25', '$1.35')
+
+        for full_rebuild in (False, True):
+            self.state_file = os.path.join(self.directory.name, 'state-%s.db' % full_rebuild)
+            self.write_input(self.lines)
+            self.execute(**options)
+
+            self.write_input(invalid)
+            conversion, output = self.execute(full_rebuild, **options)
+
+            self.assertEqual(conversion.stats.rejected, 1)
+            self.assertEqual(conversion.changes,
+                             {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 13})
+            if full_rebuild:
+                self.assertNotIn(111010, [item['id'] for item in json.loads(output)])
+            else:
+                self.assertEqual(output, '')
+
+            self.write_input(fixed)
+            conversion, output = self.execute(**options)
+
+            changes = map(json.loads, output.splitlines())
+            self.assertEqual([(change['change'], change['id']) for change in changes],
+                             [('changed', 111010)])
+            self.assertEqual(conversion.changes,
+                             {'added': 0, 'changed': 1, 'removed': 0, 'unchanged': 13})
+            self.assertEqual(conversion.stats.rejected, 0)
+
+
+def write_xml(input_file, output_file, item_tag='item'):
+    """ writes the rows of a csv file as the child elements of xml item elements """
+    header, rows = file_io.read_csv_rows(input_file)
+    tags = [key.replace(' ', '_') for key in header]
+
+    with open(output_file, 'w', encoding='utf-8') as outfile:
+        outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n<inventory>\n')
+        for row in rows:
+            outfile.write('  <%s>\n' % item_tag)
+            for tag, value in zip(tags, row):
+                outfile.write('    <%s>%s</%s>\n' % (tag, escape(value), tag))
+            outfile.write('  </%s>\n' % item_tag)
+        outfile.write('</inventory>\n')
+
+
+class TestXMLConversion(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'inventory.xml')
+
+    def test_should_fail_if_xml_output_not_matching_csv(self):
+        write_xml(EXAMPLE_CSV, self.input_file)
+        conversion = ConversionFactory.create_conversion('XMLConversion')
+
+        self.assertEqual(convert(conversion, self.input_file), convert(CSVConversion(), EXAMPLE_CSV))
+        self.assertEqual(conversion.stats.rows, 14)
+        self.assertIn('stream', conversion.stats.stages)
+
+    def test_should_fail_if_item_tag_not_configurable(self):
+        csv_file = os.path.join(self.directory.name, 'inventory.csv')
+        generator.generate_csv(csv_file, 500)
+        write_xml(csv_file, self.input_file, 'product')
+
+        conversion = XMLConversion()
+        conversion.set_item_tag('product')
+        conversion.set_output_format('ndjson')
+        csv_conversion = CSVConversion()
+        csv_conversion.set_output_format('ndjson')
+
+        self.assertEqual(convert(conversion, self.input_file), convert(csv_conversion, csv_file))
+
+    def test_should_fail_if_processed_items_not_cleared(self):
+        with open(self.input_file, 'w') as outfile:
+            outfile.write('<feed xmlns="urn:feed"><items>'
+                          '<item><item_id>1</item_id><price>$1.50</price></item>'
+                          '<item><item_id>2</item_id></item></items></feed>')
+
+        records = file_io.iter_xml_records(self.input_file, 'item')
+        self.assertEqual(next(records), (['item_id', 'price'], ['1', '$1.50']))
+        self.assertEqual(next(records), (['item_id'], ['2']))
+        self.assertEqual(next(records, None), None)
+
+    def test_should_fail_if_missing_input_not_raised(self):
+        with self.assertRaises(FileNotFoundError):
+            XMLConversion().execute()
+
+    def test_should_fail_if_cli_options_not_checked(self):
+        write_xml(EXAMPLE_CSV, self.input_file)
+        output_file = os.path.join(self.directory.name, 'output.json')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            main.main(['-i', self.input_file, '-o', output_file, '-s'])
+        with open(output_file) as infile:
+            self.assertEqual(infile.read(), convert(CSVConversion(), EXAMPLE_CSV))
+
+        for options in (['--on-error', 'reject'], ['--where', 'price_type=open'], ['-w', '2'],
+                        ['--sort']):
+            with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(ValueError):
+                main.main(['-i', self.input_file, '-o', output_file] + options)
+
+
+class InterruptingHook(stats.ConversionHook):
+    """ raises after a number of rows are converted, simulating an interrupted conversion """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def rows_converted(self, stats, rows):
+        if rows >= self.rows:
+            raise KeyboardInterrupt()
+
+
+class TestRejectsAndCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.input_file = os.path.join(self.directory.name, 'inventory.csv')
+        self.output_file = os.path.join(self.directory.name, 'output.json')
+        self.checkpoint_file = os.path.join(self.directory.name, 'checkpoint.json')
+        generator.generate_csv(self.input_file, 2000)
+
+        with open(self.input_file) as infile:
+            self.lines = infile.read().splitlines(True)
+        self.expected = convert(CSVConversion(), self.input_file)
+
+        for index in (1, 700, 1500):
+            line = self.lines[index].replace(',system,', ',bogus,')
+            self.lines[index] = line.replace(',open,', ',bogus,')
+        with open(self.input_file, 'w') as outfile:
+            outfile.writelines(self.lines)
+
+    def create_conversion(self, conversion=None, **options):
+        conversion = conversion or CSVConversion()
+        conversion.set_input_file(self.input_file)
+        conversion.set_output_file(self.output_file)
+        conversion.set_error_policy('reject')
+        batch.apply_options(conversion, options)
+        return conversion
+
+    def read_output(self):
+        with open(self.output_file) as outfile:
+            return json.load(outfile)
+
+    def read_rejects(self):
+        with open(self.output_file + '.rejects.csv') as rejects:
+            return rejects.read().splitlines(True)
+
+    def assert_rejected(self, conversion):
+        ids = [int(self.lines[index].split(',')[0]) for index in (1, 700, 1500)]
+        expected = [item for item in json.loads(self.expected) if item['id'] not in ids]
+
+        self.assertEqual(self.read_output(), expected)
+        self.assertEqual(conversion.stats.rejected, 3)
+        self.assertEqual(conversion.stats.rows, 1997)
+
+        rejects = self.read_rejects()
+        self.assertTrue(rejects[0].endswith(',reject_reason\n'))
+        self.assertEqual([line.split(',')[0] for line in rejects[1:]], [str(id) for id in ids])
+        self.assertTrue(rejects[1].endswith(",Unsupported price type 'bogus'\n"))
+
+    def test_should_fail_if_invalid_row_not_aborting(self):
+        conversion = self.create_conversion()
+        conversion.set_error_policy('abort')
+
+        with self.assertRaises(validate.ValidationError):
+            conversion.execute()
+
+        with self.assertRaises(ValueError):
+            conversion.set_error_policy('ignore')
+
+    def test_should_fail_if_invalid_rows_not_rejected(self):
+        conversion = self.create_conversion()
+        conversion.execute()
+        self.assert_rejected(conversion)
+
+    def test_should_fail_if_invalid_rows_not_rejected_in_parallel(self):
+        conversion = self.create_conversion(workers=2, chunk_size=16384)
+        conversion.execute()
+        self.assert_rejected(conversion)
+
+    def test_should_fail_if_interrupted_conversion_not_resumed(self):
+        conversion = self.create_conversion(checkpoint_file=self.checkpoint_file, chunk_size=16384,
+                                            hook_interval=100)
+        conversion.add_hook(InterruptingHook(1000))
+
+        with self.assertRaises(KeyboardInterrupt):
+            conversion.execute()
+
+        with open(self.checkpoint_file) as infile:
+            checkpoint = json.load(infile)
+        self.assertGreater(checkpoint['rows'], 0)
+        self.assertLess(checkpoint['rows'], 1997)
+        self.assertEqual(checkpoint['rejected'], 2)
+
+        conversion = self.create_conversion(checkpoint_file=self.checkpoint_file, chunk_size=16384)
+        conversion.execute()
+
+        self.assert_rejected(conversion)
+        self.assertFalse(os.path.exists(self.checkpoint_file))
+
+    def test_should_fail_if_checkpoint_of_other_input_resumed(self):
+        with open(self.checkpoint_file, 'w') as outfile:
+            json.dump({'input_size': 1, 'input_mtime': 1, 'offset': 1, 'rows': 0, 'output_position': 0,
+                       'rejected': 0, 'reject_position': None}, outfile)
+
+        with self.assertRaises(ValueError):
+            self.create_conversion(checkpoint_file=self.checkpoint_file).execute()
+
+
+class TestBatch(unittest.TestCase):
+    def test_should_fail_if_failure_aborts_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_dir = os.path.join(directory, 'input')
+            output_dir = os.path.join(directory, 'output')
+            os.makedirs(input_dir)
+
+            for name in ('store_1', 'store_2'):
+                input_file = os.path.join(input_dir, name + '.csv')
+                with open(EXAMPLE_CSV) as infile, open(input_file, 'w') as outfile:
+                    outfile.write(infile.read())
+            with open(os.path.join(input_dir, 'broken.csv'), 'w') as outfile:
+                outfile.write('item id,price_type\n1,bogus\n')
+
+            completed = []
+            input_files = batch.find_inputs(input_dir)
+            results = batch.convert_batch(input_files, output_dir, jobs=2, options={'compact': True},
+                                          callback=completed.append)
+
+            self.assertEqual([os.path.basename(result.input_file) for result in results],
+                             ['broken.csv', 'store_1.csv', 'store_2.csv'])
+            self.assertEqual(len(completed), 3)
+            self.assertEqual([result.succeeded for result in results], [False, True, True])
+            self.assertIn('Unsupported price type', results[0].error)
+
+            with open(results[1].output_file) as outfile:
+                self.assertEqual(json.loads(outfile.read()), json.loads(convert(CSVConversion())))
+
+    def test_should_fail_if_rejects_shared_between_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_files = []
+            for name in ('store_1', 'store_2'):
+                input_files.append(os.path.join(directory, name + '.csv'))
+                with open(input_files[-1], 'w') as outfile:
+                    outfile.write('item id,price_type\n1,bogus\n2,open\n3,bogus\n')
+
+            for option in ('reject_file', 'checkpoint_file'):
+                with self.assertRaises(ValueError):
+                    batch.convert_batch(input_files, directory, jobs=2,
+                                        options={'error_policy': 'reject',
+                                                 option: os.path.join(directory, 'shared')})
+
+            results = batch.convert_batch(input_files, directory, jobs=2,
+                                          options={'error_policy': 'reject'})
+
+            for result in results:
+                with open(result.output_file + '.rejects.csv') as infile:
+                    self.assertEqual(len(infile.read().splitlines()), 3)
+                self.assertEqual(result.stats['rejected'], 2)
+
+    def test_should_fail_if_sqlite_output_not_named(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_dir = os.path.join(directory, 'output')
+            results = batch.convert_batch([EXAMPLE_CSV], output_dir, jobs=1,
+                                          options={'output_format': 'sqlite'})
+
+            self.assertTrue(results[0].succeeded, results[0].error)
+            self.assertEqual(results[0].output_file, os.path.join(output_dir, 'example.db'))
+
+            connection = sqlite3.connect(results[0].output_file)
+            try:
+                self.assertEqual(connection.execute('SELECT COUNT(*) FROM items').fetchone(), (14,))
+            finally:
+                connection.close()
+
+
+class TestCompressedFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.expected = convert(CSVConversion())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def read(self, name, module):
+        with open(self.path(name), 'rb') as infile:
+            return module.decompress(infile.read())
+
+    def test_should_fail_if_compressed_input_differs(self):
+        with open(EXAMPLE_CSV, 'rb') as infile:
+            data = infile.read()
+
+        for name, module in (('example.csv.gz', gzip), ('example.csv.bz2', bz2),
+                             ('example.csv.xz', lzma)):
+            with module.open(self.path(name), 'wb') as outfile:
+                outfile.write(data)
+
+            for streaming in (False, True):
+                conversion = CSVConversion()
+                conversion.set_streaming(streaming)
+                self.assertEqual(convert(conversion, self.path(name)), self.expected)
+
+        self.assertEqual(batch.find_inputs(self.directory.name),
+                         [self.path('example.csv.bz2'), self.path('example.csv.gz'),
+                          self.path('example.csv.xz')])
+        self.assertEqual(batch.output_path(self.path('example.csv.gz'), 'out'),
+                         os.path.join('out', 'example.json'))
+
+    def test_should_fail_if_compressed_output_differs(self):
+        for name, module in (('example.json.gz', gzip), ('example.json.bz2', bz2),
+                             ('example.json.xz', lzma)):
+            for options in ({}, {'streaming': True}, {'workers': 2, 'chunk_size': 64}):
+                conversion = CSVConversion()
+                batch.apply_options(conversion, options)
+                conversion.set_input_file(EXAMPLE_CSV)
+                conversion.set_output_file(self.path(name))
+                conversion.execute()
+
+                with module.open(self.path(name), 'rt') as infile:
+                    self.assertEqual(infile.read(), self.expected)
+
+    def test_should_fail_if_blocks_not_compressed_as_members(self):
+        data = self.expected.encode('ascii')
+
+        for compress, module in ((file_io.COMPRESSIONS['.gz'][1], gzip), (bz2.compress, bz2),
+                                 (lzma.compress, lzma)):
+            writer = file_io.CompressedWriter(self.path('output'), compress, block_size=100, workers=2)
+            for start in range(0, len(data), 33):
+                writer.write(data[start:start + 33])
+            writer.close()
+
+            self.assertEqual(self.read('output', module), data)
+
+            file_io.CompressedWriter(self.path('empty'), compress).close()
+            self.assertEqual(self.read('empty', module), b'')
+
+    def test_should_fail_if_compressed_shards_misnamed(self):
+        conversion = CSVConversion()
+        conversion.set_output_format('ndjson')
+        conversion.set_shard_limits(10)
+        conversion.set_input_file(EXAMPLE_CSV)
+        conversion.set_output_file(self.path('example.ndjson.gz'))
+        conversion.execute()
+
+        lines = []
+        for number in range(2):
+            with gzip.open(self.path('example-%05d.ndjson.gz' % number), 'rt') as infile:
+                lines += infile.read().splitlines()
+
+        self.assertEqual([json.loads(line) for line in lines], json.loads(self.expected))
+
+    def test_should_fail_if_byte_offsets_of_compressed_files_accepted(self):
+        with gzip.open(self.path('example.csv.gz'), 'wb') as outfile:
+            outfile.write(b'item id\n1\n')
+
+        for input_file, output_file, options in (
+                (self.path('example.csv.gz'), 'example.json', {'workers': 2}),
+                (self.path('example.csv.gz'), 'example.json', {'extractor': 'mmap'}),
+                (EXAMPLE_CSV, 'example.json.gz', {'checkpoint_file': self.path('checkpoint.json')}),
+                (EXAMPLE_CSV, 'example.json.gz', {'index': 'output'})):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, options)
+            conversion.set_input_file(input_file)
+            conversion.set_output_file(self.path(output_file))
+
+            with self.assertRaises(ValueError):
+                conversion.execute()
+
+
+class TestConversionServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.server = daemon.ConversionServer(os.path.join(self.directory.name, 'server.sock'), jobs=1)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def output(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_should_fail_if_jobs_not_converted(self):
+        broken = self.output('broken.csv')
+        with open(broken, 'w') as outfile:
+            outfile.write('item id,price_type\n1,bogus\n')
+
+        completed = []
+        results = daemon.submit(self.server.socket_path, [
+            (EXAMPLE_CSV, self.output('example.json'), {}),
+            (broken, self.output('broken.json'), {}),
+            (EXAMPLE_CSV, self.output('example.ndjson'),
+             {'output_format': 'ndjson', 'shard_limits': (10, None)})
+        ], completed.append)
+
+        self.assertEqual(len(completed), 3)
+        self.assertEqual([result.succeeded for result in results], [True, False, True])
+        self.assertIn('Unsupported price type', results[1].error)
+        self.assertEqual(results[0].stats['rows'], 14)
+        self.assertEqual(results[0].stats['invalid'], {'modifier_1_name': 1, 'modifier_2_name': 1})
+
+        with open(self.output('example.json')) as outfile:
+            self.assertEqual(outfile.read(), convert(CSVConversion()))
+        self.assertTrue(os.path.exists(self.output('example-00001.ndjson')))
+
+    def test_should_fail_if_conversion_evaluated(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.server.socket_path)
+            job = {'id': 0, 'conversion': '__import__("os")', 'input_file': EXAMPLE_CSV,
+                   'output_file': self.output('x.json')}
+            client.sendall(b'not json\n' + json.dumps(job).encode() + b'\n')
+            client.shutdown(socket.SHUT_WR)
+
+            with client.makefile('rb') as infile:
+                replies = [json.loads(line) for line in infile]
+
+        self.assertEqual([reply['status'] for reply in replies], ['failed', 'failed'])
+        self.assertIsNone(replies[0]['id'])
+        self.assertIn('NameError', replies[1]['error'])
+        self.assertFalse(os.path.exists(self.output('x.json')))
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_should_fail_if_generator_not_deterministic(self):
+        rows = list(generator.iter_rows(200, modifiers=4, null_density=0.1, invalid_rate=0.1, seed=7))
+
+        self.assertEqual(rows, list(generator.iter_rows(200, modifiers=4, null_density=0.1,
+                                                        invalid_rate=0.1, seed=7)))
+        self.assertTrue(all(len(row) <= len(generator.create_header(4)) for row in rows))
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, 'inventory.csv')
+            generator.generate_csv(input_file, 200, modifiers=4, null_density=0.1, invalid_rate=0.1,
+                                   seed=7)
+            self.assertEqual(len(json.loads(convert(CSVConversion(), input_file))), 200)
+
+    def test_should_fail_if_regression_not_reported(self):
+        baseline = harness.BenchmarkResult(1000, 1024, {'parse': 1.0, 'total': 2.0},
+                                           {'parse': 1000, 'total': 2000})
+
+        self.assertEqual(harness.compare(baseline, baseline), [])
+
+        slower = harness.BenchmarkResult(2000, 2048, {'parse': 2.5, 'total': 4.0},
+                                         {'parse': 4000, 'total': 4000})
+        regressions = harness.compare(slower, baseline, threshold=0.1, memory_threshold=0.2)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('parse throughput'))
+        self.assertTrue(regressions[1].startswith('parse peak memory'))
+
 
 class TestParser(unittest.TestCase):
     def test_inventory_item_parser(self):
@@ -72,10 +1137,414 @@ class TestParser(unittest.TestCase):
         self.assertEqual(item.quantity_on_hand, expected_item.quantity_on_hand)
         self.assertEqual(item.modifiers.sort(key=operator.itemgetter('price')),
                          expected_item.modifiers.sort(key=operator.itemgetter('price')))
-        self.assertDictEqual(item.__dict__, expected_item.__dict__)
+        self.assertDictEqual(item.to_dict(), expected_item.to_dict())
+
+
+class TestParsePlan(unittest.TestCase):
+    def test_should_fail_if_plan_differs_from_record_parser(self):
+        header, rows = file_io.read_csv_rows(EXAMPLE_CSV)
+        plan = parser.compile_parse_plan(header)
+
+        for row, record in zip(rows, file_io.read_csv(EXAMPLE_CSV)):
+            self.assertDictEqual(plan.parse(row).to_dict(),
+                                 parser.parse_inventory_item(record).to_dict())
+
+    def test_should_fail_if_modifier_columns_not_resolved(self):
+        plan = parser.compile_parse_plan(['item id', 'price_type', 'modifier_1_name',
+                                          'modifier_1_price'])
+
+        self.assertEqual([modifier[:3] for modifier in plan.modifiers],
+                         [(2, '1', 'name'), (3, '1', 'price')])
+        self.assertEqual(plan.parse(['7', 'open', 'Small', '$0.50']).modifiers,
+                         [{'name': 'Small', 'price': 0.5}])
+        self.assertEqual(plan.parse(['7', 'open']).modifiers, [])
+
+    def test_should_fail_if_repeated_values_not_shared(self):
+        plan = parser.compile_parse_plan(['item id', 'description', 'price_type', 'modifier_1_name'])
+        first = plan.parse(['1', ''.join(['Coffee', ' Large']), 'System', ''.join(['Sm', 'all'])])
+        second = plan.parse(['2', ''.join(['Coffee', ' Large']), 'SYSTEM', ''.join(['Sm', 'all'])])
+
+        self.assertIs(first.description, second.description)
+        self.assertIs(first.price_type, second.price_type)
+        self.assertIs(first.modifiers[0]['name'], second.modifiers[0]['name'])
+        self.assertEqual(plan.cache_counts(), {'description': (1, 1), 'price_type': (0, 2),
+                                               'modifier_1_name': (1, 1)})
+
+    def test_should_fail_if_cache_unbounded(self):
+        cache = parser.ValueCache(validate.is_valid_description, max_size=2)
+
+        self.assertEqual([cache(value) for value in ('a1', 'b2', 'c3', 'c3')], ['a', 'b', 'c', 'c'])
+        self.assertEqual(len(cache._values), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_should_fail_if_hit_rates_not_recorded(self):
+        conversion = CSVConversion()
+        convert(conversion)
+
+        # example.csv holds two price types across its fourteen rows
+        self.assertEqual(conversion.stats.caches['price_type'], (12, 2))
+        self.assertAlmostEqual(conversion.stats.hit_rate('price_type'), 12 / 14)
+
+
+class TestLazyInventoryItem(unittest.TestCase):
+    def test_should_fail_if_lazy_item_differs_from_parsed(self):
+        header, rows = file_io.read_csv_rows(EXAMPLE_CSV)
+        plan = parser.compile_parse_plan(header + ['supplier'])
+
+        for row in rows:
+            item = plan.parse_lazy(row + ['Acme'])
+            self.assertIsInstance(item, models.InventoryItem)
+            self.assertDictEqual(item.to_dict(), plan.parse(row + ['Acme']).to_dict())
+            self.assertEqual(file_io.output_json([item]),
+                             file_io.output_json([plan.parse(row + ['Acme'])]))
+
+    def test_should_fail_if_unaccessed_fields_converted(self):
+        plan = parser.compile_parse_plan(['item id', 'price', 'price_type', 'quantity_on_hand'])
+        item = plan.parse_lazy(['7', '$1.x', 'bogus', '0'])
+
+        self.assertEqual(item.quantity_on_hand, 0)
+        self.assertIs(item._price, models.UNPARSED)
+        self.assertEqual(plan.invalid, {})
+
+        self.assertIsNone(item.price)
+        self.assertEqual(plan.invalid, {'price': 1})
+        with self.assertRaises(validate.ValidationError):
+            item.price_type
+
+    def test_should_fail_if_assigned_value_not_kept(self):
+        item = parser.compile_parse_plan(['item id', 'price']).parse_lazy(['7', '$1.25'])
+        item.price = 2.5
+        item.set_extra('supplier', 'Acme')
+
+        self.assertEqual(item.to_dict()['price'], 2.5)
+        self.assertEqual(item.extras, {'supplier': 'Acme'})
+        self.assertIsNone(item.cost)
+        self.assertEqual(item.modifiers, [])
+
+    def test_should_fail_if_lazy_conversion_differs(self):
+        expected = convert(CSVConversion())
+
+        for options in ({}, {'streaming': True}, {'workers': 2, 'chunk_size': 64}, {'compact': True}):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, dict(options, lazy=True))
+            compact = CSVConversion()
+            compact.set_compact(options.get('compact', False))
+
+            self.assertEqual(convert(conversion),
+                             convert(compact) if options.get('compact') else expected)
+            self.assertEqual(conversion.stats.invalid, {'modifier_1_name': 1, 'modifier_2_name': 1})
+
+
+class TestProjectionAndPredicates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.items = json.loads(convert(CSVConversion()))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_should_fail_if_projection_differs_from_full_output(self):
+        expected = [{key: item[key] for key in ('id', 'modifiers', 'price')} for item in self.items]
+
+        for options in ({}, {'streaming': True}, {'workers': 2, 'chunk_size': 64}, {'extractor': 'mmap'},
+                        {'compact': True}, {'lazy': True}, {'output_format': 'ndjson'}):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, dict(options, columns=['item id', 'price', 'modifiers']))
+            output = convert(conversion)
+
+            if options.get('output_format') == 'ndjson':
+                self.assertEqual([json.loads(line) for line in output.splitlines()], expected)
+            else:
+                compact = options.get('compact')
+                self.assertEqual(output, json.dumps(expected, sort_keys=True,
+                                                    indent=None if compact else 2,
+                                                    separators=(',', ':') if compact else None))
+            self.assertEqual(conversion.stats.rows, len(expected))
+
+    def test_should_fail_if_rows_not_filtered(self):
+        for options in ({}, {'streaming': True}, {'workers': 2, 'chunk_size': 64},
+                        {'extractor': 'mmap'}):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, dict(options, predicates=['price_type=open']))
+
+            self.assertEqual([item['id'] for item in json.loads(convert(conversion))],
+                             [111784, 2847227, 2847244])
+            self.assertEqual(conversion.stats.rows, 3)
+
+        conversion = CSVConversion()
+        conversion.set_columns(['id', 'description'])
+        conversion.set_predicates(['quantity_on_hand > 500', 'price<=$70'])
+
+        self.assertEqual(json.loads(convert(conversion)), [{'description': 'Coffee', 'id': 111010},
+                                                           {'description': 'Bagel', 'id': 111022},
+                                                           {'description': 'Milk', 'id': 2847225}])
+
+    def test_should_fail_if_unprojected_columns_converted(self):
+        input_file = os.path.join(self.directory.name, 'input.csv')
+        with open(input_file, 'w') as outfile:
+            outfile.write('item id,price,price_type,quantity_on_hand\n1,$1.x,bogus,5\n2,$2.00,bogus,x\n')
+
+        conversion = CSVConversion()
+        conversion.set_columns(['id'])
+        conversion.set_predicates(['quantity_on_hand>1'])
+
+        self.assertEqual(json.loads(convert(conversion, input_file)), [{'id': 1}])
+        self.assertEqual(conversion.stats.invalid, {})
+
+        conversion = CSVConversion()
+        conversion.set_predicates(['price_type=open'])
+        conversion.set_error_policy('reject')
+        conversion.set_reject_file(os.path.join(self.directory.name, 'rejects.csv'))
+
+        self.assertEqual(json.loads(convert(conversion, input_file)), [])
+        self.assertEqual(conversion.stats.rejected, 2)
+
+    def test_should_fail_if_invalid_options_accepted(self):
+        for columns, predicates in ((['price', 'supplier'], []), (None, ['supplier=Acme']),
+                                    (None, ['price_type=bogus']), (None, ['quantity_on_hand>x']),
+                                    (None, ['price_type']), (None, ['modifiers=Small'])):
+            conversion = CSVConversion()
+            conversion.set_columns(columns)
+            conversion.set_predicates(predicates)
+
+            with self.assertRaises(ValueError):
+                convert(conversion)
+
+        conversion = CSVConversion()
+        conversion.set_columns(['id'])
+        conversion.set_output_format('sqlite')
+
+        with self.assertRaises(ValueError):
+            convert(conversion)
+
+
+class TestSortedConversion(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.directory.name, 'input.csv')
+
+        with open(self.input_file, 'w') as outfile:
+            outfile.write('item id,description,price_type\n3,Tea,system\n1,Coffee,system\n'
+                          ',Delivery,open\n3,Green Tea,open\n2,Bagel,system\nx,Refund,open\n'
+                          '3,Mint Tea,system\n1,Latte,open\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def sort(self, **options):
+        conversion = CSVConversion()
+        batch.apply_options(conversion, dict(options, sort_by_id=True))
+        output = convert(conversion, self.input_file)
+        items = [(item['id'], item['description']) for item in json.loads(output)]
+        return items, conversion.stats
+
+    def test_should_fail_if_output_not_sorted_by_id(self):
+        expected = sorted(json.loads(convert(CSVConversion())), key=operator.itemgetter('id'))
+
+        for options in ({}, {'sort_buffer': 3}, {'extractor': 'mmap', 'sort_buffer': 1}):
+            conversion = CSVConversion()
+            batch.apply_options(conversion, dict(options, sort_by_id=True))
+
+            self.assertEqual(json.loads(convert(conversion)), expected)
+            self.assertEqual(conversion.stats.rows, 14)
+            self.assertEqual(conversion.stats.duplicates, 0)
+
+    def test_should_fail_if_duplicates_not_resolved(self):
+        items, summary = self.sort(sort_buffer=2)
+        self.assertEqual(items, [(1, 'Latte'), (2, 'Bagel'), (3, 'Mint Tea'), (None, 'Delivery'),
+                                 (None, 'Refund')])
+        self.assertEqual(summary.duplicates, 3)
+
+        items, summary = self.sort(duplicate_policy='first')
+        self.assertEqual(items,
+                         [(1, 'Coffee'), (2, 'Bagel'), (3, 'Tea'), (None, 'Delivery'), (None, 'Refund')])
+        self.assertEqual(summary.duplicates, 3)
+
+        items, summary = self.sort(duplicate_policy='keep', sort_buffer=1)
+        self.assertEqual([id for id, _ in items], [1, 1, 2, 3, 3, 3, None, None])
+        self.assertEqual(items[3:6], [(3, 'Tea'), (3, 'Green Tea'), (3, 'Mint Tea')])
+        self.assertEqual(summary.duplicates, 3)
+
+    def test_should_fail_if_filtered_rows_sorted(self):
+        conversion = CSVConversion()
+        batch.apply_options(conversion, {'sort_by_id': True, 'columns': ['description'],
+                                         'predicates': ['price_type=system']})
+
+        self.assertEqual(json.loads(convert(conversion, self.input_file)),
+                         [{'description': 'Coffee'}, {'description': 'Bagel'},
+                          {'description': 'Mint Tea'}])
+        self.assertEqual(conversion.stats.duplicates, 1)
+
+    def test_should_fail_if_runs_not_merged(self):
+        with sorting.ExternalSorter(buffer_size=2, directory=self.directory.name) as sorter:
+            for id in range(500):
+                sorter.add((id * 7) % 250, id)
+
+            self.assertEqual(list(sorter.sorted(sorting.DUPLICATES_KEEP)),
+                             sorted(range(500), key=lambda id: ((id * 7) % 250, id)))
+            self.assertEqual(sorter.spilled, 250)
+            self.assertEqual(sorter.duplicates, 250)
+
+        self.assertEqual(os.listdir(self.directory.name), ['input.csv'])
+
+    def test_should_fail_if_invalid_options_accepted(self):
+        with self.assertRaises(ValueError):
+            CSVConversion().set_duplicate_policy('newest')
+
+        conversion = CSVConversion()
+        batch.apply_options(conversion, {'sort_by_id': True, 'workers': 2})
+        with self.assertRaises(ValueError):
+            convert(conversion)
+
+
+class TestMoneyConversion(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_should_fail_if_decimal_output_differs_from_float_output(self):
+        for options in ({}, {'streaming': True}, {'workers': 2, 'chunk_size': 64},
+                        {'extractor': 'mmap'}, {'compact': True}, {'lazy': True},
+                        {'output_format': 'ndjson'}, {'pipelined': True}, {'sort_by_id': True},
+                        {'columns': ['id', 'price', 'modifiers']}):
+            expected = CSVConversion()
+            batch.apply_options(expected, options)
+            conversion = CSVConversion()
+            batch.apply_options(conversion, dict(options, money=models.MONEY_DECIMAL))
+
+            self.assertEqual(convert(conversion), convert(expected))
+            self.assertEqual(conversion.stats.invalid, expected.stats.invalid)
+
+    def test_should_fail_if_cents_not_exact(self):
+        input_file = os.path.join(self.directory.name, 'input.csv')
+        with open(input_file, 'w') as outfile:
+            outfile.write('item id,price,cost,modifier_1_name,modifier_1_price\n'
+                          '1,"$1,234.50",-$0.10,Small,$0.20\n2,$0.1,1.005,Large,\n'
+                          '3,,$0.70,Large,$-0.05\n')
+
+        conversion = CSVConversion()
+        conversion.set_money(models.MONEY_CENTS)
+        items = json.loads(convert(conversion, input_file))
+
+        self.assertEqual([(item['price'], item['cost']) for item in items],
+                         [(123450, -10), (10, None), (None, 70)])
+        self.assertEqual([item['modifiers'] for item in items], [[{'name': 'Small', 'price': 20}],
+                                                                 [{'name': 'Large'}],
+                                                                 [{'name': 'Large', 'price': -5}]])
+        self.assertEqual(conversion.stats.invalid, {'cost': 1})
+
+        conversion = CSVConversion()
+        conversion.set_money(models.MONEY_DECIMAL)
+        conversion.set_predicates(['price>=$0.10'])
+        items = json.loads(convert(conversion, input_file))
+
+        self.assertEqual([(item['price'], item['cost']) for item in items],
+                         [(1234.5, -0.1), (0.1, None)])
+
+    def test_should_fail_if_models_not_cents(self):
+        header, rows = file_io.read_csv_rows(EXAMPLE_CSV)
+        plan = parser.compile_parse_plan(header, money=models.MONEY_CENTS)
+        items = models.InventoryBatch(plan.parse(row) for row in rows)
+
+        self.assertIs(type(items[0].price), models.Cents)
+        self.assertEqual((items[0].price, items[0].cost), (125, 80))
+        self.assertEqual(items[0].modifiers[0], {'name': 'Small', 'price': -25})
+        self.assertIs(type(items[0].modifiers[0]['price']), models.Cents)
+        self.assertEqual(sum(item.price or 0 for item in items),
+                         sum(plan.parse(row).price or 0 for row in rows))
+        self.assertEqual(file_io.output_json(items, money=models.MONEY_DECIMAL), file_io.output_json(
+            [parser.compile_parse_plan(header).parse(row) for row in rows]))
+
+    def test_should_fail_if_unsupported_money_format_accepted(self):
+        with self.assertRaises(ValueError):
+            CSVConversion().set_money('pence')
+        with self.assertRaises(ValueError):
+            parser.compile_parse_plan(['price'], money='pence')
+
+
+class TestModels(unittest.TestCase):
+    def test_should_fail_if_modifiers_default_shared(self):
+        item = models.InventoryItem()
+        item.modifiers.append({'name': 'Small'})
+
+        self.assertEqual(models.InventoryItem().modifiers, [])
+
+    def test_should_fail_if_item_has_instance_dict(self):
+        self.assertFalse(hasattr(models.InventoryItem(), '__dict__'))
+
+    def test_should_fail_if_batch_items_differ(self):
+        header, rows = file_io.read_csv_rows(EXAMPLE_CSV)
+        plan = parser.compile_parse_plan(header)
+        items = [plan.parse(row) for row in rows]
+        items.append(models.InventoryItem(id=2 ** 70, price='free',
+                                          modifiers=[{'name': 'Small', 'size': 1}]))
+
+        batch = models.InventoryBatch(items)
+
+        self.assertEqual(len(batch), len(items))
+        self.assertEqual([item.to_dict() for item in batch], [item.to_dict() for item in items])
+        self.assertEqual(batch[-1].id, 2 ** 70)
+        self.assertEqual(file_io.output_json(batch), file_io.output_json(items))
+
+    def test_should_fail_if_extra_columns_not_kept(self):
+        plan = parser.compile_parse_plan(['item id', 'price_type', 'Category'])
+        item = plan.parse(['1', 'open', 'Drinks'])
+
+        self.assertEqual(item.extras, {'category': 'Drinks'})
+        self.assertEqual(json.loads(file_io.output_json([item]))[0]['category'], 'Drinks')
+
+
+class TestStringDictionary(unittest.TestCase):
+    def test_should_fail_if_codes_not_reused(self):
+        dictionary = models.StringDictionary()
+
+        self.assertEqual([dictionary.encode(value) for value in (None, 'open', 'system', 'open')],
+                         [0, 1, 2, 1])
+        self.assertEqual(dictionary.decode(2), 'system')
+        self.assertEqual(len(dictionary), 3)
 
 
 class TestFileIO(unittest.TestCase):
+    def test_should_fail_if_split_ranges_not_contiguous(self):
+        ranges = file_io.split_csv(EXAMPLE_CSV, 100)
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(EXAMPLE_CSV))
+        self.assertTrue(all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:])))
+        self.assertEqual(file_io.read_csv_range(EXAMPLE_CSV, *ranges[0]),
+                         [file_io.read_csv_rows(EXAMPLE_CSV)[0]])
+
+        rows = [row for start, end in ranges[1:]
+                for row in file_io.read_csv_range(EXAMPLE_CSV, start, end)]
+        self.assertEqual(rows, file_io.read_csv_rows(EXAMPLE_CSV)[1])
+
+    def test_should_fail_if_mapped_rows_differ_from_csv_module(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_file = os.path.join(directory, 'mixed.csv')
+            with open(input_file, 'w', encoding='utf-8', newline='') as infile:
+                infile.write('item id,description,price\r\n1,"Line\r\nBreak",$1\r\n\r\n2,"A ""b""",\r\n'
+                             '3,Caf\u00e9,$2\n4,plain,$3')
+
+            with file_io.MappedCSVReader(input_file, 'utf-8') as reader:
+                self.assertEqual([reader.header] + list(reader.rows()),
+                                 list(file_io.iter_csv_rows(input_file, 'utf-8')))
+
+                self.assertEqual(list(reader.rows(columns=[0]))[2], ['3', None, None])
+
+    def test_should_fail_if_mapped_ranges_differ(self):
+        ranges = file_io.split_csv(EXAMPLE_CSV, 100)
+
+        with file_io.MappedCSVReader(EXAMPLE_CSV, 'utf-8') as reader:
+            rows = [row for start, end in ranges for row in reader.rows(start=start, end=end)]
+
+        self.assertEqual(rows, file_io.read_csv_rows(EXAMPLE_CSV)[1])
+
+    def test_should_fail_if_incompatible_encoding_mapped(self):
+        with self.assertRaises(ValueError):
+            file_io.MappedCSVReader(EXAMPLE_CSV, 'utf-16')
+
     def test_should_fail_if_not_valid_json(self):
         expected = json.dumps([{"simple_key": "simple_value"}], sort_keys=True, indent=2)
 
@@ -85,6 +1554,41 @@ class TestFileIO(unittest.TestCase):
         self.assertEqual(output, expected)
 
 
+class TestSerialiser(unittest.TestCase):
+    def setUp(self):
+        header, rows = file_io.read_csv_rows(EXAMPLE_CSV)
+        plan = parser.compile_parse_plan(header)
+        extra = models.InventoryItem(id=1, description='Caf\u00e9 "Latte"', price=float('nan'),
+                                     modifiers=[{'price': 1.0, 'name': 'Small', 'sizes': [1, 2]}, {}])
+        extra.set_extra('tags', {'b': None, 'a': True})
+        self.values = [plan.parse(row) for row in rows] + [extra, {'key': [(), {}, -0.0, 10 ** 30]}]
+
+    def test_should_fail_if_not_identical_to_encoder(self):
+        expected = json.dumps(self.values, cls=file_io.CustomModelEncoder, sort_keys=True, indent=2)
+
+        self.assertEqual(serialiser.ModelSerialiser().dumps(self.values), expected)
+        self.assertEqual(file_io.output_json(self.values), expected)
+
+    def test_should_fail_if_compact_not_identical_to_encoder(self):
+        expected = json.dumps(self.values, cls=file_io.CustomModelEncoder, sort_keys=True,
+                              separators=(',', ':'))
+
+        self.assertEqual(file_io.output_json(self.values, compact=True), expected)
+
+    def test_should_fail_if_compact_conversion_not_compact(self):
+        conversion = CSVConversion()
+        conversion.set_compact(True)
+        output = convert(conversion)
+
+        self.assertNotIn('\n', output)
+        self.assertEqual(json.loads(output), json.loads(convert(CSVConversion())))
+
+        conversion = CSVConversion()
+        conversion.set_compact(True)
+        conversion.set_streaming(True)
+        self.assertEqual(convert(conversion), output)
+
+
 class TestValidationIntegers(unittest.TestCase):
     def test_should_fail_if_not_int(self):
         expected_value = 3
@@ -126,6 +1630,21 @@ class TestValidationFloats(unittest.TestCase):
         self.assertIsNone(value)
 
 
+class TestValidationCents(unittest.TestCase):
+    def test_should_fail_if_not_cents(self):
+        for value, expected_value in (('1.25', 125), ('$1,234.50', 123450), ('-$0.25', -25),
+                                      ('$-0.25', -25), ('.5', 50), ('49', 4900), (' 3.10 ', 310),
+                                      ('1,000,000', 100000000)):
+            value = validate.is_valid_cents(value)
+            self.assertEqual(expected_value, value)
+            self.assertIs(type(value), models.Cents)
+
+    def test_should_fail_if_invalid_currency_not_none(self):
+        for value in ('', ' ', '$', '-', 'six', '1.255', '1e3', 'nan', '1,23.00', '12,3456', '1.2.3',
+                      '--1'):
+            self.assertIsNone(validate.is_valid_cents(value))
+
+
 class TestValidationStrings(unittest.TestCase):
     def test_should_fail_if_not_string(self):
         expected_value = 'Coffee'